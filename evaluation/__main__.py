@@ -0,0 +1,973 @@
+import argparse
+import asyncio
+import csv
+import importlib.util
+import json
+import logging
+import os
+import sys
+
+# The evaluation scripts import each other as top-level modules ("from utils import ..."),
+# and evaluation.py shares this directory's name, so run them from their own directory.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.modules.pop("evaluation", None)
+
+from benchmark import (  # noqa: E402
+    blank_pairs,
+    golden_check,
+    load_baseline,
+    real_pairs,
+    regressions,
+    run_benchmarks,
+    save_baseline,
+    synthetic_pairs,
+)
+from corpus import (  # noqa: E402
+    LABELS_ROOT,
+    MAPPING_PATH,
+    MATCH_TYPES,
+    dataset_metrics,
+    f1_rows,
+    f1_scores,
+    join_predictions,
+    label_files,
+    report_categories,
+    score_predictions,
+    write_csv,
+    write_f1_csv,
+)
+from corrections import DEFAULT_THRESHOLD, CorrectionMiner  # noqa: E402
+from data_loader import (  # noqa: E402
+    PredictionStreamStats,
+    iter_jsonl_predictions,
+    load_label_data,
+    load_predictions,
+    parse_model_output,
+    prediction_key,
+)
+from diagram import compile_diagram  # noqa: E402
+from element_records import ElementRecordWriter  # noqa: E402
+from evaluation import METRIC_PROFILES, select_metrics  # noqa: E402
+from inference import (  # noqa: E402
+    DIAGRAM_TYPES,
+    ChatClient,
+    ImageFile,
+    InferenceRunner,
+    dataset_classes,
+    dataset_requests,
+    example_count,
+    find_image,
+    infer_and_score,
+    prompt_path,
+    render_prompt,
+)
+from instrumentation import Telemetry  # noqa: E402
+from label_store import LabelPack, build_label_pack, label_split_dirs, open_label_store, pack_path  # noqa: E402
+from matching import SIMILARITIES  # noqa: E402
+from normalization import NORMALIZATION_STEPS  # noqa: E402
+from shards import (  # noqa: E402
+    ShardAggregate,
+    aggregate_path,
+    build_manifest,
+    configuration_digest,
+    load_manifest,
+    shard_images,
+    write_manifest,
+)
+
+
+def _load_mapping(args):
+    if args.no_mapping:
+        return None
+    with open(args.mapping, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _load_variants(args):
+    """
+    {name: mapping dictionary or None} of --variants: "corrected" is --mapping,
+    "uncorrected" no mapping and NAME=PATH the mapping file at PATH; None without --variants.
+    """
+    if not args.variants:
+        return None
+    variants = {}
+    for spec in args.variants:
+        name, _, path = spec.partition("=")
+        if not path and name not in ("corrected", "uncorrected"):
+            raise SystemExit(f"--variants: {spec!r} is neither corrected, uncorrected nor NAME=PATH.")
+        if name in variants:
+            raise SystemExit(f"--variants: {name} is given twice.")
+        if name == "uncorrected" and not path:
+            variants[name] = None
+            continue
+        with open(path or args.mapping, "r", encoding="utf-8") as f:
+            variants[name] = json.load(f)
+    return variants
+
+
+def _cache_options(args):
+    if not args.cache_dir:
+        return None
+    return {"directory": args.cache_dir, "max_bytes": int(args.cache_max_mb * 2**20)}
+
+
+def _evaluation_options(args, label_dirs):
+    options = {}
+    if args.normalization:
+        options["normalization"] = sorted(args.normalization)
+    if args.metrics:
+        options["metrics"] = _metric_selection(args.metrics, label_dirs, args.label_store == "pack")
+    if args.recover_truncated:
+        options["recover_truncated"] = True
+    if args.fuzzy_threshold is not None:
+        if args.similarity == "levenshtein" and importlib.util.find_spec("rapidfuzz") is None:
+            raise SystemExit("--similarity levenshtein requires the rapidfuzz package.")
+        options.update(fuzzy_threshold=args.fuzzy_threshold, similarity=args.similarity)
+    if args.iou_threshold is not None:
+        if not 0 < args.iou_threshold <= 1:
+            raise SystemExit("--iou-threshold must be in (0, 1].")
+        options.update(iou_threshold=args.iou_threshold, text_weight=args.text_weight)
+    if args.graph_metrics:
+        options["graph_metrics"] = True
+    return options or None
+
+
+def _load_labels(labels_dir, packed):
+    store = open_label_store(labels_dir, packed)
+    try:
+        return [store.load(key) for key in store.keys()]
+    finally:
+        store.close()
+
+
+def _metric_selection(names, label_dirs, packed):
+    """{dataset: metric names} for --metrics; "auto" picks the metrics that apply to each dataset's labels."""
+    selection = {}
+    for dataset, labels_dir in label_dirs.items():
+        metrics = set(dataset_metrics(_load_labels(labels_dir, packed))) if "auto" in names else set()
+        try:
+            metrics |= select_metrics(name for name in names if name != "auto")
+        except ValueError as e:
+            raise SystemExit(str(e))
+        selection[dataset] = sorted(metrics)
+    return selection
+
+
+def score(args):
+    label_dirs = {dataset: os.path.join(args.labels_root, dataset, args.split) for dataset in args.dataset}
+    packed = args.label_store == "pack"
+    stats = PredictionStreamStats()
+    telemetry = None
+    if args.metrics_jsonl or args.prometheus_textfile:
+        telemetry = Telemetry(args.metrics_jsonl, args.prometheus_textfile)
+
+    if args.predictions.endswith(".jsonl"):
+        items = join_predictions(iter_jsonl_predictions(args.predictions, stats), label_dirs, stats, packed=packed)
+    elif len(label_dirs) == 1:
+        [(dataset, labels_dir)] = label_dirs.items()
+        predictions = load_predictions(args.predictions)
+        items = ((dataset, None, key, predictions.get(key)) for key in label_files(labels_dir, packed))
+    else:
+        raise SystemExit("Several datasets can only be scored from a .jsonl prediction file.")
+
+    manifest = None
+    if args.manifest:
+        if args.shard is None:
+            raise SystemExit("--manifest needs --shard.")
+        manifest = load_manifest(args.manifest)
+        unknown = [dataset for dataset in label_dirs if dataset not in manifest["datasets"]]
+        if unknown:
+            raise SystemExit(f"{args.manifest} has no shards for {', '.join(unknown)}.")
+        try:
+            shard_keys = {dataset: set(shard_images(manifest, dataset, args.shard)) for dataset in label_dirs}
+        except ValueError as e:
+            raise SystemExit(str(e))
+        items = (item for item in items if item[2] in shard_keys[item[0]])
+
+    variants = _load_variants(args)
+    if variants is not None and (manifest is not None or args.element_records):
+        raise SystemExit("--variants cannot be combined with --manifest or --element-records.")
+    mapping_dictionary = _load_mapping(args) if variants is None else None
+    evaluation_options = _evaluation_options(args, label_dirs)
+    element_writer = ElementRecordWriter(args.element_records) if args.element_records else None
+    results = score_predictions(
+        items,
+        label_dirs,
+        mapping_dictionary=mapping_dictionary,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        cache_options=_cache_options(args),
+        evaluation_options=evaluation_options,
+        packed=packed,
+        telemetry=telemetry,
+        element_writer=element_writer,
+        variants=variants,
+        keep_images=bool(args.save_counts or args.bootstrap),
+    )
+    if telemetry is not None:
+        telemetry.close()
+    if element_writer is not None:
+        element_writer.close()
+        print(f"Wrote {element_writer.rows} element records to {args.element_records}", file=sys.stderr)
+
+    categories = {}
+    for variant, results in (results if variants is not None else {None: results}).items():
+        _write_scores(args, label_dirs, results, variant, manifest, mapping_dictionary, evaluation_options, categories)
+
+    if stats.lines:
+        print(
+            f"{stats.records} of {stats.lines} lines read ({stats.bad_lines} bad, "
+            f"{stats.unmatched} unmatched, {stats.duplicates} duplicates skipped)",
+            file=sys.stderr,
+        )
+
+
+def _write_scores(args, label_dirs, results, variant, manifest, mapping_dictionary, evaluation_options, categories):
+    # Write the CSVs (or shard counts) of one mapping variant; file names get _<variant> when it has one.
+    packed = args.label_store == "pack"
+    prefix = f"_{variant}" if variant else ""
+    name = f"{variant} " if variant else ""
+    for dataset, labels_dir in label_dirs.items():
+        runs = sorted((run_id for d, run_id in results if d == dataset), key=lambda run_id: run_id or "")
+        if manifest is not None:
+            # A shard only writes its summed counts; merge turns them into the F1 CSV.
+            aggregate = ShardAggregate(
+                manifest["id"], dataset, configuration_digest(evaluation_options, mapping_dictionary), [args.shard]
+            )
+            for run_id in runs:
+                aggregate.add_result(run_id, run_id or args.method, results[(dataset, run_id)])
+            output_path = aggregate_path(args.output_dir, dataset, args.shard, manifest["shards"])
+            aggregate.save(output_path)
+            print(f"{dataset}: wrote shard {args.shard} of {manifest['shards']} to {output_path}", file=sys.stderr)
+            continue
+        if not runs:
+            print(f"{dataset}: no predictions", file=sys.stderr)
+            continue
+
+        if dataset not in categories:
+            categories[dataset] = report_categories(_load_labels(labels_dir, packed))
+        rows = []
+        interval_rows = []
+        for run_id in runs:
+            method = run_id or args.method
+            result = results[(dataset, run_id)]
+            rows.extend(f1_rows(method, f1_scores(result.totals), categories[dataset]))
+            print(
+                f"{dataset} [{name}{method}]: scored {result.images} images "
+                f"({result.missing} missing, {result.malformed} malformed, {result.truncated} truncated predictions, "
+                f"{result.cached} from cache)",
+                file=sys.stderr,
+            )
+
+            matrix = result.matrix() if args.save_counts or args.bootstrap else None
+            if args.save_counts:
+                counts_path = os.path.join(args.output_dir, f"{dataset}{prefix}_{method}_counts.npz")
+                os.makedirs(args.output_dir, exist_ok=True)
+                matrix.save(counts_path)
+            if args.bootstrap:
+                interval_rows.extend(
+                    interval_table(method, matrix, categories[dataset], args.bootstrap, args.confidence, args.seed)
+                )
+
+        output_path = os.path.join(args.output_dir, f"{dataset}{prefix}_f1_scores.csv")
+        write_f1_csv(output_path, rows)
+        print(f"{dataset}: wrote {output_path}", file=sys.stderr)
+        if interval_rows:
+            write_csv(os.path.join(args.output_dir, f"{dataset}{prefix}_f1_intervals.csv"), INTERVAL_HEADER, interval_rows)
+
+
+def _example_queries(path):
+    """Parsed outputs of a JSONL prediction file as {(dataset, image_key): diagram}, first record first."""
+    queries = {}
+    for key, _, output in iter_jsonl_predictions(path):
+        queries.setdefault((key.partition("__")[0], prediction_key(key)), parse_model_output(output))
+    return queries
+
+
+def _nearest_examples(index, dataset, image_keys, labels_dir, packed, queries, k, exclude_self):
+    """
+    {image_key: k nearest example keys} of a dataset's images. The query of an image is its
+    output in queries (an empty diagram when it has none), or its own label without queries.
+    """
+    store = None if queries is not None else open_label_store(labels_dir, packed)
+    try:
+        return {
+            image_key: [
+                key
+                for key, _ in index.nearest(
+                    store.load(image_key) if store is not None else queries.get((dataset, image_key)) or {},
+                    k,
+                    exclude=(image_key,) if exclude_self else (),
+                )
+            ]
+            for image_key in image_keys
+        }
+    finally:
+        if store is not None:
+            store.close()
+
+
+def _few_shot_prompt(args, dataset, template, classes, train_store, example_keys, example_images):
+    """Prompt segments and example images for the given examples; example_images caches their ImageFiles."""
+    for key in example_keys:
+        if key not in example_images:
+            path = find_image(os.path.join(args.images_root, dataset, args.example_split), key)
+            if path is None:
+                raise SystemExit(f"{dataset}: no image for example {key}.")
+            example_images[key] = ImageFile(path)
+    examples = [train_store.load(key) for key in example_keys]
+    try:
+        segments = render_prompt(template, DIAGRAM_TYPES.get(dataset, "diagram"), *classes, examples)
+    except ValueError as e:
+        raise SystemExit(f"{dataset}: {e}")
+    return segments, [example_images[key] for key in example_keys]
+
+
+def infer(args):
+    packed = args.label_store == "pack"
+    params = dict(json.loads(args.params)) if args.params else {}
+    if args.temperature is not None:
+        params["temperature"] = args.temperature
+    if args.max_tokens is not None:
+        params["max_tokens"] = args.max_tokens
+
+    queries = _example_queries(args.example_queries) if args.example_queries else None
+    requests, missing, label_dirs = [], [], {}
+    for dataset in args.dataset:
+        label_dirs[dataset] = os.path.join(args.labels_root, dataset, args.split)
+        train_dir = os.path.join(args.labels_root, dataset, args.example_split)
+        with open(prompt_path(args.prompt, dataset), encoding="utf-8") as f:
+            template = f.read()
+        count = example_count(template)
+        image_keys = label_files(label_dirs[dataset], packed)
+
+        # Without --example-keys, a split with an example index gives every image its own examples.
+        nearest = None
+        if count and not args.example_keys:
+            from examples import index_path, open_example_index  # needs numpy, only loaded with example indexes
+
+            if os.path.isfile(index_path(train_dir)):
+                nearest = _nearest_examples(
+                    open_example_index(train_dir, packed),
+                    dataset,
+                    image_keys,
+                    label_dirs[dataset],
+                    packed,
+                    queries,
+                    count,
+                    exclude_self=args.split == args.example_split,
+                )
+
+        train_store = open_label_store(train_dir, packed)
+        try:
+            train_keys = train_store.keys()
+            classes = dataset_classes(train_store.load(key) for key in train_keys)
+            example_images = {}
+            if nearest is None:
+                keys = (args.example_keys or train_keys)[:count]
+                segments, images = _few_shot_prompt(args, dataset, template, classes, train_store, keys, example_images)
+                prompts = None
+            else:
+                segments, images = None, ()
+                prompts = {
+                    image_key: _few_shot_prompt(args, dataset, template, classes, train_store, keys, example_images)
+                    for image_key, keys in nearest.items()
+                }
+        finally:
+            train_store.close()
+
+        images_dir = os.path.join(args.images_root, dataset, args.split)
+        dataset_queue, dataset_missing = dataset_requests(dataset, image_keys, images_dir, segments, images, prompts)
+        requests.extend(dataset_queue)
+        missing.extend((dataset, key) for key in dataset_missing)
+        if dataset_missing:
+            print(f"{dataset}: {len(dataset_missing)} images not found in {images_dir}", file=sys.stderr)
+
+    runner = InferenceRunner(
+        ChatClient(args.base_url, os.environ.get(args.api_key_env), args.timeout),
+        args.model,
+        params,
+        cache_options={"directory": args.response_cache, "max_bytes": int(args.cache_max_mb * 2**20)}
+        if args.response_cache
+        else None,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        max_retries=args.retries,
+    )
+    run_id = args.method or args.prompt
+    predictions_path = os.path.join(args.output_dir, "predictions.jsonl")
+    try:
+        results = asyncio.run(
+            infer_and_score(
+                runner,
+                requests,
+                label_dirs,
+                run_id,
+                predictions_path,
+                missing=missing,
+                mapping_dictionary=_load_mapping(args),
+                evaluation_options=_evaluation_options(args, label_dirs),
+                packed=packed,
+                workers=args.workers,
+            )
+        )
+    finally:
+        runner.close()
+    print(
+        f"{len(requests)} requests: {runner.sent} sent, {runner.retried} retried, {runner.failed} failed, "
+        f"{runner.cached} from the response cache; wrote {predictions_path}",
+        file=sys.stderr,
+    )
+
+    for dataset, labels_dir in label_dirs.items():
+        result = results.get((dataset, run_id))
+        if result is None:
+            print(f"{dataset}: no images", file=sys.stderr)
+            continue
+        categories = report_categories(_load_labels(labels_dir, packed))
+        output_path = os.path.join(args.output_dir, f"{dataset}_f1_scores.csv")
+        write_f1_csv(output_path, f1_rows(run_id, f1_scores(result.totals), categories))
+        print(
+            f"{dataset} [{run_id}]: scored {result.images} images "
+            f"({result.missing} missing, {result.malformed} malformed, {result.truncated} truncated predictions); "
+            f"wrote {output_path}",
+            file=sys.stderr,
+        )
+
+
+INTERVAL_HEADER = ("Method", "Match Type", "Category", "F1 Score", "Macro F1", "CI Low", "CI High")
+COMPARISON_HEADER = ("Match Type", "Category", "F1 A", "F1 B", "Difference", "p-value")
+
+
+def interval_table(method, matrix, categories, n_resamples, confidence, seed):
+    """Micro F1, macro F1 and bootstrap interval rows for the reported categories."""
+    from aggregate import bootstrap_f1, macro_f1, micro_f1  # needs numpy, only loaded with --bootstrap
+    micro, macro = micro_f1(matrix), macro_f1(matrix)
+    low, high = bootstrap_f1(matrix, n_resamples=n_resamples, confidence=confidence, seed=seed)
+    rows = []
+    for match_type, _ in MATCH_TYPES:
+        for category in categories:
+            if (match_type, category) not in matrix.metrics:
+                continue
+            i = matrix.metrics.index((match_type, category))
+            rows.append((method, match_type, category) + tuple(round(float(v[i]), 3) for v in (micro, macro, low, high)))
+    return rows
+
+
+def compare(args):
+    from aggregate import CountMatrix, align, micro_f1, paired_permutation_test  # needs numpy
+    run_a, run_b = CountMatrix.load(args.counts_a), CountMatrix.load(args.counts_b)
+    aligned_a, aligned_b = align(run_a, run_b)
+    if len(aligned_a.image_keys) < max(len(run_a.image_keys), len(run_b.image_keys)):
+        print(f"Comparing on the {len(aligned_a.image_keys)} images both runs share.", file=sys.stderr)
+
+    difference, p_values = paired_permutation_test(
+        aligned_a, aligned_b, n_permutations=args.permutations, seed=args.seed
+    )
+    f1_a, f1_b = micro_f1(aligned_a), micro_f1(aligned_b)
+    rows = [
+        (
+            match_type,
+            category,
+            round(float(f1_a[i]), 3),
+            round(float(f1_b[i]), 3),
+            round(float(difference[i]), 3),
+            round(float(p_values[i]), 4),
+        )
+        for i, (match_type, category) in enumerate(aligned_a.metrics)
+    ]
+
+    if args.output:
+        write_csv(args.output, COMPARISON_HEADER, rows)
+    else:
+        writer = csv.writer(sys.stdout, lineterminator="\n")
+        writer.writerow(COMPARISON_HEADER)
+        writer.writerows(rows)
+
+
+def pack(args):
+    labels_dirs = label_split_dirs(args.labels_root)
+    if args.dataset:
+        roots = [os.path.normpath(os.path.join(args.labels_root, dataset)) for dataset in args.dataset]
+        labels_dirs = [d for d in labels_dirs if any(d == root or d.startswith(root + os.sep) for root in roots)]
+
+    stale = 0
+    for labels_dir in labels_dirs:
+        if not args.verify:
+            path = build_label_pack(labels_dir)
+            print(f"{labels_dir}: wrote {path}", file=sys.stderr)
+            continue
+        if not os.path.isfile(pack_path(labels_dir)):
+            print(f"{labels_dir}: no pack", file=sys.stderr)
+            stale += 1
+            continue
+        label_pack = LabelPack(pack_path(labels_dir))
+        problems = label_pack.stale_entries(labels_dir)
+        label_pack.close()
+        for image_key, problem in problems:
+            print(f"{labels_dir}: {image_key} {problem}", file=sys.stderr)
+        stale += bool(problems)
+    if stale:
+        raise SystemExit(f"{stale} pack(s) missing or out of date; rerun without --verify to rebuild.")
+
+
+EXAMPLES_HEADER = ("Dataset", "Query", "Rank", "Example", "Similarity")
+
+
+def shard(args):
+    label_dirs = {dataset: os.path.join(args.labels_root, dataset, args.split) for dataset in args.dataset}
+    manifest = build_manifest(label_dirs, args.shards, packed=args.label_store == "pack")
+    write_manifest(args.output, manifest)
+    for dataset, entry in manifest["datasets"].items():
+        sizes = [len(images) for images in entry["images"]]
+        print(f"{dataset}: {sum(sizes)} images in {args.shards} shards of {min(sizes)}-{max(sizes)}", file=sys.stderr)
+    print(f"Wrote manifest {manifest['id']} to {args.output}", file=sys.stderr)
+
+
+def merge(args):
+    manifest = load_manifest(args.manifest)
+    merged = {}
+    for path in args.aggregates:
+        aggregate = ShardAggregate.load(path)
+        if aggregate.manifest_id != manifest["id"]:
+            raise SystemExit(f"{path} was scored with manifest {aggregate.manifest_id}, not {manifest['id']}.")
+        previous = merged.get(aggregate.dataset)
+        try:
+            merged[aggregate.dataset] = aggregate if previous is None else previous.merge(aggregate)
+        except ValueError as e:
+            raise SystemExit(f"{path}: {e}")
+
+    for dataset, aggregate in sorted(merged.items()):
+        missing = sorted(set(range(manifest["shards"])) - aggregate.shards)
+        if missing:
+            print(f"{dataset}: shards {missing} are missing; scores cover the other shards only", file=sys.stderr)
+        output_path = os.path.join(args.output_dir, f"{dataset}_f1_scores.csv")
+        write_f1_csv(output_path, aggregate.f1_rows(manifest["datasets"][dataset]["categories"]))
+        print(f"{dataset}: merged {len(aggregate.shards)} shards into {output_path}", file=sys.stderr)
+
+
+CORRECTIONS_HEADER = ("Image", "Predicted Text", "Label Text", "Similarity")
+
+
+def mine_corrections(args):
+    label_dirs = {dataset: os.path.join(args.labels_root, dataset, args.split) for dataset in args.dataset}
+    packed = args.label_store == "pack"
+    stats = PredictionStreamStats()
+    if args.predictions.endswith(".jsonl"):
+        items = join_predictions(iter_jsonl_predictions(args.predictions, stats), label_dirs, stats, packed=packed)
+    elif len(label_dirs) == 1:
+        [(dataset, labels_dir)] = label_dirs.items()
+        predictions = load_predictions(args.predictions)
+        items = ((dataset, None, key, predictions.get(key)) for key in label_files(labels_dir, packed))
+    else:
+        raise SystemExit("Several datasets can only be mined from a .jsonl prediction file.")
+
+    miner = CorrectionMiner(_load_mapping(args), args.threshold)
+    stores = {dataset: open_label_store(labels_dir, packed) for dataset, labels_dir in label_dirs.items()}
+    labels = {}
+    try:
+        for dataset, _, image_key, raw_output in items:
+            label = labels.get((dataset, image_key))
+            if label is None:
+                label = labels[(dataset, image_key)] = compile_diagram(stores[dataset].load(image_key))
+            output = parse_model_output(raw_output)
+            if output is not None:
+                miner.add(dataset, image_key, label, output)
+    finally:
+        for store in stores.values():
+            store.close()
+
+    miner.write(args.output)
+    print(
+        f"Mined {miner.images} predictions: {len(miner.rows())} corrections for {len(miner.proposals)} images "
+        f"written to {args.output}",
+        file=sys.stderr,
+    )
+    if args.report:
+        write_csv(args.report, CORRECTIONS_HEADER, miner.rows())
+
+
+def examples(args):
+    from examples import index_path, open_example_index  # needs numpy, only loaded with example indexes
+    rows = []
+    for dataset in args.dataset:
+        labels_dir = os.path.join(args.labels_root, dataset, args.split)
+        index = open_example_index(labels_dir, packed=args.label_store == "pack")
+        print(f"{labels_dir}: {len(index)} examples in {index_path(labels_dir)}", file=sys.stderr)
+        for query in args.query or []:
+            neighbors = index.nearest(load_label_data(query), args.k, exclude=(os.path.basename(query),))
+            for rank, (image_key, similarity) in enumerate(neighbors, 1):
+                rows.append((dataset, query, rank, image_key, round(similarity, 4)))
+    if args.query:
+        writer = csv.writer(sys.stdout, lineterminator="\n")
+        writer.writerow(EXAMPLES_HEADER)
+        writer.writerows(rows)
+
+
+BENCHMARK_HEADER = ("Workload", "Function", "Images", "ms per Image", "Images per Second", "Peak Memory KiB")
+
+
+def bench(args):
+    workloads = {}
+    if "real" in args.suite:
+        workloads[f"real-{args.split}"] = real_pairs(args.labels_root, args.split, noise=args.noise, seed=args.seed)
+    if "synthetic" in args.suite:
+        for size in args.sizes:
+            workloads[f"synthetic-{size}"] = synthetic_pairs(
+                args.pairs,
+                seed=args.seed,
+                noise=args.noise,
+                nodes=size,
+                groups=max(1, size // 20),
+                attributes=args.attributes,
+                methods=args.methods,
+                cardinalities=bool(args.attributes or args.methods),
+            )
+    mapping_dictionary = _load_mapping(args)
+
+    if args.check:
+        failed = 0
+        # Null and missing fields, which the other workloads never have, are checked too.
+        for workload, pairs in dict(workloads, blank=blank_pairs(seed=args.seed)).items():
+            pairs = [pair for pair in pairs if len(pair[2].get("nodes") or []) <= args.check_max_nodes]
+            mismatches = golden_check(pairs, mapping_dictionary)
+            for image_key, function, expected, actual in mismatches[:20]:
+                print(f"{workload} {image_key} {function}: expected {expected}, got {actual}", file=sys.stderr)
+            print(f"{workload}: {len(pairs)} images checked, {len(mismatches)} mismatches", file=sys.stderr)
+            failed += len(mismatches)
+        if failed:
+            raise SystemExit("Golden check failed.")
+
+    results = run_benchmarks(workloads, repeat=args.repeat, mapping_dictionary=mapping_dictionary, only=args.only)
+    rows = [
+        (
+            r["workload"],
+            r["function"],
+            r["images"],
+            round(r["ms_per_image"], 4),
+            round(r["images_per_second"], 1),
+            round(r["peak_memory_kib"], 1),
+        )
+        for r in results
+    ]
+    writer = csv.writer(sys.stdout, lineterminator="\n")
+    writer.writerow(BENCHMARK_HEADER)
+    writer.writerows(rows)
+    if args.output:
+        write_csv(args.output, BENCHMARK_HEADER, rows)
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+        print(f"Wrote baseline {args.save_baseline}", file=sys.stderr)
+    if args.baseline:
+        slower = regressions(results, load_baseline(args.baseline), args.threshold)
+        for key, before, after in slower:
+            print(f"Regression: {key} {before:.4f} -> {after:.4f} ms per image", file=sys.stderr)
+        if slower:
+            raise SystemExit(f"{len(slower)} benchmark(s) slower than the baseline by more than {args.threshold:.0%}.")
+
+
+def serve_command(args):
+    from service import ScoringService, serve  # needs numpy, only loaded by the serve command
+
+    # The service reports its address at INFO level.
+    logging.getLogger("evaluation").setLevel(logging.INFO)
+    label_dirs = {dataset: os.path.join(args.labels_root, dataset, args.split) for dataset in args.dataset}
+    service = ScoringService(
+        label_dirs,
+        mapping_dictionary=_load_mapping(args),
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        cache_options=_cache_options(args),
+        evaluation_options=_evaluation_options(args, label_dirs),
+        packed=args.label_store == "pack",
+    )
+    asyncio.run(serve(service, args.host, args.port, args.unix_socket))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m evaluation", description="Diagram extraction evaluation.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    score_parser = commands.add_parser("score", help="Score a prediction set and write <dataset>_f1_scores.csv.")
+    score_parser.add_argument(
+        "--dataset", required=True, nargs="+", help="Dataset directories under the labels root, e.g. hdBPMN-icdar2021."
+    )
+    score_parser.add_argument(
+        "--predictions",
+        required=True,
+        help="Directory with one file per image, a JSON file {image: output}, or a .jsonl file "
+        'with one {"image_key": "<dataset>__<image>", "run_id": ..., "output": ...} object per line.',
+    )
+    score_parser.add_argument("--output-dir", required=True, help="Run directory, e.g. results/two_shot.")
+    score_parser.add_argument("--method", default="default", help="Value of the Method column for records without run_id.")
+    score_parser.add_argument("--split", default="test")
+    score_parser.add_argument("--labels-root", default=LABELS_ROOT)
+    score_parser.add_argument("--mapping", default=MAPPING_PATH, help="mapping_dictionary.json with text corrections.")
+    score_parser.add_argument("--no-mapping", action="store_true", help="Score without text corrections.")
+    score_parser.add_argument(
+        "--variants",
+        nargs="+",
+        metavar="VARIANT",
+        help="Score several mapping variants in one pass and write <dataset>_<variant>_f1_scores.csv for each: "
+        "corrected (--mapping), uncorrected, or NAME=PATH of another mapping file.",
+    )
+    score_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count, 1 = serial).")
+    score_parser.add_argument("--chunk-size", type=int, default=8, help="Images per work unit.")
+    score_parser.add_argument(
+        "--label-store",
+        choices=("json", "pack"),
+        default="json",
+        help="Read labels from the JSON files or from the split packs built by the pack command.",
+    )
+    score_parser.add_argument("--cache-dir", help="Reuse per-image results from this on-disk cache.")
+    score_parser.add_argument("--cache-max-mb", type=float, default=512, help="Evict least recently used results above this size.")
+    score_parser.add_argument(
+        "--normalization",
+        nargs="+",
+        choices=NORMALIZATION_STEPS,
+        help="Extra normalization steps for the normalized match type, e.g. nfkc hyphenation.",
+    )
+    score_parser.add_argument(
+        "--fuzzy-threshold",
+        type=float,
+        help="Also report fuzzy matches of node texts, edge labels and group names with similarity >= this value.",
+    )
+    score_parser.add_argument("--similarity", choices=SIMILARITIES, default="ngram", help="Fuzzy similarity measure.")
+    score_parser.add_argument(
+        "--iou-threshold",
+        type=float,
+        help="Also report a spatial match type: nodes matched by bbox IoU >= this value, relations through the matched nodes.",
+    )
+    score_parser.add_argument(
+        "--text-weight",
+        type=float,
+        default=0.0,
+        help="Weight of text similarity against IoU when choosing between overlapping boxes (spatial mode).",
+    )
+    score_parser.add_argument(
+        "--graph-metrics",
+        action="store_true",
+        help="Also report a graph match type: Weisfeiler-Lehman subtree and approximate graph edit similarity.",
+    )
+    score_parser.add_argument(
+        "--recover-truncated",
+        action="store_true",
+        help="Score unparseable (e.g. truncated) outputs on their complete elements instead of as empty diagrams.",
+    )
+    score_parser.add_argument(
+        "--metrics",
+        nargs="+",
+        help=f"Only compute these metrics or profiles ({', '.join(METRIC_PROFILES)}); "
+        "auto picks the metrics that apply to each dataset's labels.",
+    )
+    score_parser.add_argument(
+        "--metrics-jsonl", help="Write per-image instrumentation (sizes, per-metric wall time, status) as JSON lines."
+    )
+    score_parser.add_argument(
+        "--prometheus-textfile", help="Write run counters (throughput, cache hits, statuses, metric time) for Prometheus."
+    )
+    score_parser.add_argument(
+        "--element-records",
+        help="Write per-element match records of the exact and normalized metrics to this SQLite "
+        "(or .parquet) file.",
+    )
+    score_parser.add_argument("--save-counts", action="store_true", help="Also save per-image counts as <dataset>_<method>_counts.npz.")
+    score_parser.add_argument(
+        "--bootstrap", type=int, default=0, metavar="N", help="Write <dataset>_f1_intervals.csv with N bootstrap resamples."
+    )
+    score_parser.add_argument(
+        "--manifest", help="Shard manifest (see shard); with --shard, only score that shard's images and write its counts."
+    )
+    score_parser.add_argument("--shard", type=int, help="Shard index to score, from 0.")
+    score_parser.add_argument("--confidence", type=float, default=0.95)
+    score_parser.add_argument("--seed", type=int, default=0)
+    score_parser.set_defaults(func=score)
+
+    pack_parser = commands.add_parser(
+        "pack", help="Pack each label split directory into one indexed <split>.pack file for fast loading."
+    )
+    pack_parser.add_argument("--dataset", nargs="+", help="Only pack these datasets (default: every split under the labels root).")
+    pack_parser.add_argument("--labels-root", default=LABELS_ROOT)
+    pack_parser.add_argument("--verify", action="store_true", help="Check existing packs against the JSON files instead of building.")
+    pack_parser.set_defaults(func=pack)
+
+    shard_parser = commands.add_parser(
+        "shard", help="Write a manifest that splits the images of datasets into shards for score --shard."
+    )
+    shard_parser.add_argument("--dataset", nargs="+", required=True)
+    shard_parser.add_argument("--shards", type=int, required=True, help="Number of shards.")
+    shard_parser.add_argument("--output", required=True, help="Manifest JSON file to write.")
+    shard_parser.add_argument("--split", default="test")
+    shard_parser.add_argument("--labels-root", default=LABELS_ROOT)
+    shard_parser.add_argument("--label-store", choices=("json", "pack"), default="json")
+    shard_parser.set_defaults(func=shard)
+
+    merge_parser = commands.add_parser(
+        "merge", help="Merge shard counts written by score --shard into <dataset>_f1_scores.csv."
+    )
+    merge_parser.add_argument("aggregates", nargs="+", help="<dataset>_shard<k>of<n>.json files of any datasets.")
+    merge_parser.add_argument("--manifest", required=True, help="The manifest the shards were scored with.")
+    merge_parser.add_argument("--output-dir", required=True)
+    merge_parser.set_defaults(func=merge)
+
+    corrections_parser = commands.add_parser(
+        "mine-corrections",
+        help="Propose mapping_dictionary.json entries from near misses between predicted and label node texts.",
+    )
+    corrections_parser.add_argument("--dataset", nargs="+", required=True)
+    corrections_parser.add_argument(
+        "--predictions", required=True, help="Predictions JSON file or directory, or a .jsonl file of one or more runs."
+    )
+    corrections_parser.add_argument("--output", required=True, help="Proposals JSON file, in the mapping file's format.")
+    corrections_parser.add_argument("--report", help="Also write the proposals with their similarity to this CSV.")
+    corrections_parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD, help="Minimum character trigram similarity."
+    )
+    corrections_parser.add_argument("--split", default="test")
+    corrections_parser.add_argument("--labels-root", default=LABELS_ROOT)
+    corrections_parser.add_argument("--label-store", choices=("json", "pack"), default="json")
+    corrections_parser.add_argument(
+        "--mapping", default=MAPPING_PATH, help="Existing corrections; texts they already fix are not proposed again."
+    )
+    corrections_parser.add_argument("--no-mapping", action="store_true")
+    corrections_parser.set_defaults(func=mine_corrections)
+
+    examples_parser = commands.add_parser(
+        "examples", help="Build or update the few-shot example index of a split and query it."
+    )
+    examples_parser.add_argument("--dataset", nargs="+", required=True)
+    examples_parser.add_argument("--split", default="train", help="Split the examples are drawn from.")
+    examples_parser.add_argument("--labels-root", default=LABELS_ROOT)
+    examples_parser.add_argument("--label-store", choices=("json", "pack"), default="json")
+    examples_parser.add_argument(
+        "--query", nargs="+", help="Diagram JSON files to find examples for; prints the nearest examples as CSV."
+    )
+    examples_parser.add_argument("-k", type=int, default=2, help="Examples per query.")
+    examples_parser.set_defaults(func=examples)
+
+    bench_parser = commands.add_parser(
+        "bench", help="Benchmark evaluate_output and every count_* matcher on real and synthetic diagrams."
+    )
+    bench_parser.add_argument("--suite", nargs="+", choices=("real", "synthetic"), default=["real", "synthetic"])
+    bench_parser.add_argument("--split", default="test", help="Label split of the real suite.")
+    bench_parser.add_argument("--labels-root", default=LABELS_ROOT)
+    bench_parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Synthetic node counts, e.g. 10000.")
+    bench_parser.add_argument("--pairs", type=int, default=10, help="Synthetic label/prediction pairs per size.")
+    bench_parser.add_argument("--attributes", type=int, default=0, help="Synthetic attributes per node.")
+    bench_parser.add_argument("--methods", type=int, default=0, help="Synthetic methods per node.")
+    bench_parser.add_argument("--noise", type=float, default=0.1, help="Share of prediction elements that differ from the label.")
+    bench_parser.add_argument("--seed", type=int, default=0)
+    bench_parser.add_argument("--repeat", type=int, default=3, help="Timed passes per workload; the best one counts.")
+    bench_parser.add_argument("--only", nargs="+", help="Only benchmark functions whose name contains one of these.")
+    bench_parser.add_argument("--mapping", default=MAPPING_PATH)
+    bench_parser.add_argument("--no-mapping", action="store_true")
+    bench_parser.add_argument(
+        "--check", action="store_true", help="First compare all results with the reference implementation (reference.py)."
+    )
+    bench_parser.add_argument(
+        "--check-max-nodes", type=int, default=2000, help="Skip the quadratic reference check on larger diagrams."
+    )
+    bench_parser.add_argument("--output", help="Also write the results to this CSV file.")
+    bench_parser.add_argument("--baseline", help="Fail if a result is slower than this baseline JSON by more than --threshold.")
+    bench_parser.add_argument("--threshold", type=float, default=0.25)
+    bench_parser.add_argument("--save-baseline", help="Write the results as a baseline JSON file.")
+    bench_parser.set_defaults(func=bench)
+
+    serve_parser = commands.add_parser(
+        "serve", help="Run a local HTTP scoring service with preloaded labels (POST /score, GET /runs)."
+    )
+    serve_parser.add_argument("--dataset", required=True, nargs="+", help="Datasets whose labels are preloaded.")
+    serve_parser.add_argument("--split", default="test")
+    serve_parser.add_argument("--labels-root", default=LABELS_ROOT)
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765, help="TCP port (0 = any free port).")
+    serve_parser.add_argument("--unix-socket", help="Listen on this Unix domain socket instead of TCP.")
+    serve_parser.add_argument("--mapping", default=MAPPING_PATH)
+    serve_parser.add_argument("--no-mapping", action="store_true")
+    serve_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    serve_parser.add_argument("--chunk-size", type=int, default=8, help="Images per work unit.")
+    serve_parser.add_argument("--label-store", choices=("json", "pack"), default="json")
+    serve_parser.add_argument("--cache-dir", help="Reuse per-image results from this on-disk cache.")
+    serve_parser.add_argument("--cache-max-mb", type=float, default=512)
+    serve_parser.add_argument("--normalization", nargs="+", choices=NORMALIZATION_STEPS)
+    serve_parser.add_argument("--fuzzy-threshold", type=float)
+    serve_parser.add_argument("--similarity", choices=SIMILARITIES, default="ngram")
+    serve_parser.add_argument("--metrics", nargs="+", help="Only compute these metrics or profiles (see score).")
+    serve_parser.add_argument("--recover-truncated", action="store_true", help="See score.")
+    serve_parser.add_argument("--iou-threshold", type=float)
+    serve_parser.add_argument("--text-weight", type=float, default=0.0)
+    serve_parser.add_argument("--graph-metrics", action="store_true", help="See score.")
+    serve_parser.set_defaults(func=serve_command)
+
+    infer_parser = commands.add_parser(
+        "infer",
+        help="Run a model through an OpenAI-compatible chat completions endpoint and score its outputs as they arrive.",
+    )
+    infer_parser.add_argument("--dataset", required=True, nargs="+")
+    infer_parser.add_argument(
+        "--images-root", required=True, help="Directory with the images as <dataset>/<split>/<image>.png (or .jpg, ...)."
+    )
+    infer_parser.add_argument("--base-url", required=True, help="Endpoint base URL, e.g. http://localhost:8000/v1.")
+    infer_parser.add_argument("--model", required=True)
+    infer_parser.add_argument("--output-dir", required=True, help="Run directory for predictions.jsonl and the F1 CSVs.")
+    infer_parser.add_argument(
+        "--prompt", default="two_shot", help="Prompt variant in prompts/, e.g. zero_shot; UML datasets use <variant>_uml.txt."
+    )
+    infer_parser.add_argument("--method", help="Run id of the predictions and Method column (default: the prompt variant).")
+    infer_parser.add_argument("--api-key-env", default="OPENAI_API_KEY", help="Environment variable holding the API key.")
+    infer_parser.add_argument("--temperature", type=float)
+    infer_parser.add_argument("--max-tokens", type=int)
+    infer_parser.add_argument("--params", help="Other request parameters as a JSON object, e.g. '{\"top_p\": 0.9}'.")
+    infer_parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight.")
+    infer_parser.add_argument("--rate", type=float, help="Maximum requests started per second.")
+    infer_parser.add_argument("--retries", type=int, default=5, help="Retries of failed, rate-limited or timed-out requests.")
+    infer_parser.add_argument("--timeout", type=float, default=600, help="Seconds per request.")
+    infer_parser.add_argument("--response-cache", help="Reuse responses from this on-disk cache.")
+    infer_parser.add_argument("--cache-max-mb", type=float, default=2048)
+    infer_parser.add_argument("--example-split", default="train", help="Split the few-shot examples and classes come from.")
+    infer_parser.add_argument(
+        "--example-keys",
+        nargs="+",
+        help="Few-shot example labels, in prompt order. By default every image gets the labels of the example split "
+        "nearest to its query (see examples) when the split has an example index, else the first ones of the split.",
+    )
+    infer_parser.add_argument(
+        "--example-queries",
+        help="JSONL predictions (e.g. a zero_shot run's predictions.jsonl) to find nearest examples for; "
+        "by default the images' own labels are the queries, which shows what ideal example selection gains.",
+    )
+    infer_parser.add_argument("--split", default="test")
+    infer_parser.add_argument("--labels-root", default=LABELS_ROOT)
+    infer_parser.add_argument("--label-store", choices=("json", "pack"), default="json")
+    infer_parser.add_argument("--mapping", default=MAPPING_PATH)
+    infer_parser.add_argument("--no-mapping", action="store_true")
+    infer_parser.add_argument("--workers", type=int, default=1, help="Scoring worker processes.")
+    infer_parser.add_argument("--normalization", nargs="+", choices=NORMALIZATION_STEPS)
+    infer_parser.add_argument("--metrics", nargs="+", help="Only compute these metrics or profiles (see score).")
+    infer_parser.add_argument("--recover-truncated", action="store_true", help="See score.")
+    infer_parser.set_defaults(
+        func=infer, fuzzy_threshold=None, similarity="ngram", iou_threshold=None, text_weight=0.0, graph_metrics=False
+    )
+
+    compare_parser = commands.add_parser(
+        "compare", help="Paired permutation test between two runs' saved per-image counts."
+    )
+    compare_parser.add_argument("counts_a", help="<dataset>_<method>_counts.npz of run A.")
+    compare_parser.add_argument("counts_b", help="<dataset>_<method>_counts.npz of run B.")
+    compare_parser.add_argument("--permutations", type=int, default=10000)
+    compare_parser.add_argument("--seed", type=int, default=0)
+    compare_parser.add_argument("--output", help="Write the comparison CSV here instead of stdout.")
+    compare_parser.set_defaults(func=compare)
+
+    return parser
+
+
+def main(argv=None):
+    logging.basicConfig(format="%(levelname)s %(name)s: %(message)s")
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import numpy as np
+
+TP, LABEL, PRED = 0, 1, 2
+
+
+class CountMatrix:
+    """
+    Per-image match counts of a run: counts[image, metric] = (tp, label, pred).
+
+    metrics are (match_type, category) pairs; image_keys name the rows.
+    """
+
+    def __init__(self, counts, image_keys, metrics):
+        self.counts = np.asarray(counts, dtype=np.int64).reshape(len(image_keys), len(metrics), 3)
+        self.image_keys = list(image_keys)
+        self.metrics = [tuple(metric) for metric in metrics]
+
+    @classmethod
+    def from_image_counts(cls, image_counts, metrics=None):
+        """Build from (image_key, {(match_type, category): (tp, label, pred)}) pairs."""
+        image_counts = list(image_counts)
+        if metrics is None:
+            metrics = list(image_counts[0][1]) if image_counts else []
+        counts = np.zeros((len(image_counts), len(metrics), 3), dtype=np.int64)
+        for row, (_, image) in enumerate(image_counts):
+            counts[row] = [image.get(metric, (0, 0, 0)) for metric in metrics]
+        return cls(counts, [image_key for image_key, _ in image_counts], metrics)
+
+    def totals(self):
+        """Summed (tp, label, pred) per metric, shape (metrics, 3)."""
+        return self.counts.sum(axis=0)
+
+    def totals_dict(self):
+        return {metric: tuple(int(v) for v in total) for metric, total in zip(self.metrics, self.totals())}
+
+    def select(self, image_keys=None, metrics=None):
+        """Sub-matrix restricted to (and ordered by) the given image keys and metrics."""
+        rows = slice(None) if image_keys is None else [self.image_keys.index(key) for key in image_keys]
+        columns = slice(None) if metrics is None else [self.metrics.index(tuple(metric)) for metric in metrics]
+        return CountMatrix(
+            self.counts[rows][:, columns],
+            self.image_keys if image_keys is None else image_keys,
+            self.metrics if metrics is None else metrics,
+        )
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            counts=self.counts,
+            image_keys=np.array(self.image_keys, dtype=str),
+            metrics=np.array(["/".join(metric) for metric in self.metrics], dtype=str),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            metrics = [tuple(metric.split("/", 1)) for metric in data["metrics"].tolist()]
+            return cls(data["counts"], data["image_keys"].tolist(), metrics)
+
+
+def f1_from_counts(counts):
+    """F1 = 2 tp / (label + pred) over the last axis of a (..., 3) array; 0.0 where nothing was expected or predicted."""
+    counts = np.asarray(counts, dtype=np.float64)
+    tp, denominator = counts[..., TP], counts[..., LABEL] + counts[..., PRED]
+    return np.divide(2 * tp, denominator, out=np.zeros_like(tp), where=denominator > 0)
+
+
+def micro_f1(matrix):
+    """F1 of the summed counts, per metric."""
+    return f1_from_counts(matrix.totals())
+
+
+def macro_f1(matrix):
+    """Mean per-image F1, per metric; images with nothing expected or predicted are left out."""
+    per_image = f1_from_counts(matrix.counts)
+    defined = (matrix.counts[..., LABEL] + matrix.counts[..., PRED]) > 0
+    n_defined = defined.sum(axis=0)
+    return np.divide((per_image * defined).sum(axis=0), n_defined, out=np.zeros(per_image.shape[1]), where=n_defined > 0)
+
+
+def bootstrap_f1(matrix, n_resamples=1000, confidence=0.95, seed=0, block_size=256):
+    """
+    Percentile bootstrap confidence interval of the micro F1 per metric.
+
+    Images are resampled with replacement. A block of resamples is drawn as a
+    multinomial weight matrix (resamples x images) and its counts are summed with one
+    matrix product, so there is no Python loop per resample. Returns (low, high).
+    """
+    n_images = len(matrix.image_keys)
+    n_metrics = len(matrix.metrics)
+    if n_images == 0:
+        return np.zeros(n_metrics), np.zeros(n_metrics)
+
+    rng = np.random.default_rng(seed)
+    flat = matrix.counts.reshape(n_images, -1).astype(np.float64)
+    probabilities = np.full(n_images, 1.0 / n_images)
+    samples = np.empty((n_resamples, n_metrics))
+
+    for start in range(0, n_resamples, block_size):
+        size = min(block_size, n_resamples - start)
+        weights = rng.multinomial(n_images, probabilities, size=size)
+        sums = weights @ flat
+        samples[start:start + size] = f1_from_counts(sums.reshape(size, n_metrics, 3))
+
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(samples, [alpha, 1 - alpha], axis=0)
+    return low, high
+
+
+def align(a, b):
+    """Restrict two CountMatrix objects to their shared images and metrics, in the same order."""
+    b_images = set(b.image_keys)
+    b_metrics = set(b.metrics)
+    image_keys = [key for key in a.image_keys if key in b_images]
+    metrics = [metric for metric in a.metrics if metric in b_metrics]
+    return a.select(image_keys, metrics), b.select(image_keys, metrics)
+
+
+def paired_permutation_test(a, b, n_permutations=10000, seed=0, block_size=512):
+    """
+    Paired permutation test for the micro F1 difference between two runs on the same images.
+
+    Each permutation swaps the two runs' counts on a random subset of images. For a
+    block of permutations the swapped totals are one matrix product of a 0/1 swap
+    matrix with the per-image count differences. Returns (difference, p_values), where
+    difference is micro F1 of a minus b and p_values are two-sided.
+    """
+    a, b = align(a, b)
+    n_images = len(a.image_keys)
+    n_metrics = len(a.metrics)
+
+    flat_a = a.counts.reshape(n_images, -1).astype(np.float64)
+    flat_b = b.counts.reshape(n_images, -1).astype(np.float64)
+    delta = flat_b - flat_a
+    total_a, total_b = flat_a.sum(axis=0), flat_b.sum(axis=0)
+
+    def f1(totals):
+        return f1_from_counts(totals.reshape(totals.shape[:-1] + (n_metrics, 3)))
+
+    observed = f1(total_a) - f1(total_b)
+    threshold = np.abs(observed) - 1e-12
+    exceed = np.zeros(n_metrics, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+
+    for start in range(0, n_permutations, block_size):
+        size = min(block_size, n_permutations - start)
+        swaps = rng.integers(0, 2, size=(size, n_images)).astype(np.float64)
+        shift = swaps @ delta
+        difference = f1(total_a + shift) - f1(total_b - shift)
+        exceed += (np.abs(difference) >= threshold).sum(axis=0)
+
+    return observed, (exceed + 1) / (n_permutations + 1)
@@ -0,0 +1,359 @@
+import gc
+import json
+import os
+import random
+import time
+import tracemalloc
+
+import matching
+import reference
+from evaluation import evaluate_output
+from label_store import LabelDirectory, label_split_dirs
+
+# Every dict-level matcher: (function name, element list it compares, field for count_field_matches).
+MATCHERS = (
+    ("count_field_matches", "nodes", "text"),
+    ("count_field_matches", "nodes", "class"),
+    ("count_field_matches", "relations", "label"),
+    ("count_field_matches", "relations", "class"),
+    ("count_field_matches", "groups", "name"),
+    ("count_field_matches", "groups", "class"),
+    ("count_node_text_class_matches", "nodes", None),
+    ("count_node_attribute_matches", "nodes", None),
+    ("count_node_method_matches", "nodes", None),
+    ("count_node_attribute_method_matches", "nodes", None),
+    ("count_arrow_path_matches", "relations", None),
+    ("count_arrow_path_and_label_matches", "relations", None),
+    ("count_arrow_path_label_class_matches", "relations", None),
+    ("count_cardinality_matches", "relations", None),
+    ("count_group_node_matches", "groups", None),
+    ("count_full_group_matches", "groups", None),
+)
+EVALUATE_OUTPUT = "evaluate_output"
+
+NODE_CLASSES = ("task", "exclusiveGateway", "startEvent", "endEvent", "dataObject", "class", "interface", "state")
+RELATION_CLASSES = ("sequenceFlow", "messageFlow", "association", "generalization", "composition", "dependency")
+GROUP_CLASSES = ("pool", "lane", "package")
+WORDS = (
+    "order", "customer", "invoice", "check", "send", "receive", "payment", "approve", "reject", "ship",
+    "product", "stock", "request", "review", "update", "account", "create", "close", "notify", "archive",
+)
+LABELS = ("", "", "", "yes", "no", "ok", "failed")
+CARDINALITIES = ("1", "0..1", "0..*", "1..*", "*")
+
+
+def matcher_name(matcher):
+    name, elements, field = matcher
+    return f"{name}[{elements}.{field}]" if field else name
+
+
+def run_matcher(module, matcher, label, model, normalize):
+    """Call one matcher of module (matching or reference) on a label/model dict pair."""
+    name, elements, field = matcher
+    function = getattr(module, name)
+    label_items, model_items = label.get(elements) or [], model.get(elements) or []
+    if field is not None:
+        return function(label_items, model_items, field, normalize=normalize)
+    if elements == "nodes":
+        return function(label_items, model_items, normalize=normalize)
+    label_nodes, model_nodes = label.get("nodes") or [], model.get("nodes") or []
+    return function(label_items, model_items, label_nodes, model_nodes, normalize=normalize)
+
+
+def synthetic_label(rng, nodes=20, relations=None, groups=0, attributes=0, methods=0, cardinalities=False):
+    """
+    A random label dict with the given element counts.
+
+    relations defaults to 1.2 edges per node; attributes and methods are the number
+    per node, and cardinalities adds UML-style cardinality_start/_end to relations.
+    """
+    relations = int(nodes * 1.2) if relations is None else relations
+    node_list = []
+    for i in range(nodes):
+        node = {
+            "id": f"n{i}",
+            "text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))).capitalize(),
+            "class": rng.choice(NODE_CLASSES),
+        }
+        if attributes:
+            node["attributes"] = [f"{rng.choice(WORDS)}_{j}: int" for j in range(attributes)]
+        if methods:
+            node["methods"] = [f"{rng.choice(WORDS)}{j}()" for j in range(methods)]
+        node_list.append(node)
+
+    relation_list = []
+    for i in range(relations if nodes else 0):
+        relation = {
+            "id": f"r{i}",
+            "head": f"n{rng.randrange(nodes)}",
+            "tail": f"n{rng.randrange(nodes)}",
+            "label": rng.choice(LABELS),
+            "class": rng.choice(RELATION_CLASSES),
+        }
+        if cardinalities:
+            relation["cardinality_start"] = rng.choice(CARDINALITIES)
+            relation["cardinality_end"] = rng.choice(CARDINALITIES)
+        relation_list.append(relation)
+
+    group_list = []
+    for i in range(groups):
+        size = rng.randint(1, max(1, 2 * nodes // groups)) if nodes else 0
+        group_list.append(
+            {
+                "id": f"g{i}",
+                "name": f"{rng.choice(WORDS).capitalize()} {i}",
+                "class": rng.choice(GROUP_CLASSES),
+                "nodes": [f"n{rng.randrange(nodes)}" for _ in range(size)],
+            }
+        )
+    return {"nodes": node_list, "relations": relation_list, "groups": group_list}
+
+
+def _misspell(text, rng):
+    if not text:
+        return text
+    choice = rng.randrange(4)
+    if choice == 0:
+        return text.upper()
+    if choice == 1:
+        return text.replace(" ", "_") + " "
+    position = rng.randrange(len(text))
+    if choice == 2:
+        return text[:position] + text[position + 1:]
+    return text[:position] + rng.choice("aeiou") + text[position:]
+
+
+def perturb(label, rng, noise=0.1):
+    """
+    A prediction derived from a label: with probability noise each element is dropped,
+    duplicated or has a text, class or endpoint changed, and spurious elements are added.
+    Element order is shuffled.
+    """
+    nodes = []
+    for node in label.get("nodes") or []:
+        if rng.random() < noise:
+            kind = rng.randrange(4)
+            if kind == 0:
+                continue
+            node = dict(node)
+            if kind == 1:
+                node["text"] = _misspell(node.get("text"), rng)
+            elif kind == 2:
+                node["class"] = rng.choice(NODE_CLASSES)
+            elif node.get("attributes"):
+                node["attributes"] = list(reversed(node["attributes"]))[1:]
+            nodes.append(node)
+            if rng.random() < noise:
+                nodes.append(dict(node))
+        else:
+            nodes.append(node)
+    node_ids = [node.get("id") for node in nodes]
+    for i in range(int(len(nodes) * noise / 2)):
+        nodes.append({"id": f"extra{i}", "text": rng.choice(WORDS), "class": rng.choice(NODE_CLASSES)})
+
+    relations = []
+    for relation in label.get("relations") or []:
+        if rng.random() < noise:
+            kind = rng.randrange(4)
+            if kind == 0:
+                continue
+            relation = dict(relation)
+            if kind == 1:
+                relation["head"], relation["tail"] = relation.get("tail"), relation.get("head")
+            elif kind == 2:
+                relation["label"] = _misspell(relation.get("label"), rng) or rng.choice(LABELS)
+            elif node_ids:
+                relation["tail"] = rng.choice(node_ids)
+        relations.append(relation)
+
+    groups = []
+    for group in label.get("groups") or []:
+        if rng.random() < noise:
+            group = dict(group, nodes=list(group.get("nodes") or [])[:-1], name=_misspell(group.get("name"), rng))
+        groups.append(group)
+
+    rng.shuffle(nodes)
+    rng.shuffle(relations)
+    return {"nodes": nodes, "relations": relations, "groups": groups}
+
+
+def synthetic_pairs(count, seed=0, noise=0.1, **sizes):
+    """count (dataset, image_key, label, prediction) tuples from synthetic_label and perturb."""
+    rng = random.Random(seed)
+    pairs = []
+    for i in range(count):
+        label = synthetic_label(rng, **sizes)
+        pairs.append(("synthetic", f"synthetic_{i}.json", label, perturb(label, rng, noise)))
+    return pairs
+
+
+# Values a label or prediction field can have besides a proper string.
+BLANKS = (None, "", "missing")
+
+
+def _blank_fields(items, rng, rate):
+    blanked = []
+    for item in items:
+        item = dict(item)
+        for field in list(item):
+            if field != "id" and not isinstance(item[field], list) and rng.random() < rate:
+                blank = rng.choice(BLANKS)
+                if blank == "missing":
+                    del item[field]
+                else:
+                    item[field] = blank
+        blanked.append(item)
+    return blanked
+
+
+def blank_pairs(count=200, seed=0, rate=0.2):
+    """
+    count (dataset, image_key, label, prediction) tuples like synthetic_pairs, with UML
+    fields and groups, where fields of either side are set to None or "" or left out with
+    probability rate (list fields are kept, as the original matchers require lists
+    there). Synthetic labels always have every field, so the golden check runs
+    these too.
+    """
+    rng = random.Random(seed)
+    pairs = []
+    for i in range(count):
+        label = synthetic_label(rng, nodes=12, groups=2, attributes=1, methods=1, cardinalities=True)
+        model = perturb(label, rng)
+        label, model = (
+            {elements: _blank_fields(diagram[elements], rng, rate) for elements in ("nodes", "relations", "groups")}
+            for diagram in (label, model)
+        )
+        pairs.append(("blank", f"blank_{i}.json", label, model))
+    return pairs
+
+
+def real_pairs(labels_root, split="test", noise=0.1, seed=0):
+    """
+    (dataset, image_key, label, prediction) for every label of the given split under
+    labels_root (and datasets without splits), with predictions from perturb.
+    """
+    rng = random.Random(seed)
+    root = os.path.normpath(labels_root)
+    pairs = []
+    for labels_dir in label_split_dirs(root):
+        parts = os.path.relpath(labels_dir, root).split(os.sep)
+        if len(parts) > 1 and parts[-1] != split:
+            continue
+        store = LabelDirectory(labels_dir)
+        for image_key in store.keys():
+            label = store.load(image_key)
+            if isinstance(label, dict):
+                pairs.append((parts[0], image_key, label, perturb(label, rng, noise)))
+    return pairs
+
+
+def _workload_functions(mapping_dictionary=None):
+    functions = [
+        (
+            EVALUATE_OUTPUT,
+            lambda dataset, image_key, label, model: evaluate_output(
+                label, model, dataset_name=dataset, image_key=image_key, mapping_dictionary=mapping_dictionary
+            ),
+        )
+    ]
+    for matcher in MATCHERS:
+        functions.append(
+            (
+                matcher_name(matcher),
+                lambda dataset, image_key, label, model, matcher=matcher: (
+                    run_matcher(matching, matcher, label, model, False),
+                    run_matcher(matching, matcher, label, model, True),
+                ),
+            )
+        )
+    return functions
+
+
+def measure(function, pairs, repeat=3):
+    """
+    Time function over all pairs; returns (seconds per image, peak traced memory in bytes).
+    The time is the best of repeat passes; memory comes from one extra pass under tracemalloc.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for pair in pairs:
+            function(*pair)
+        best = min(best, time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for pair in pairs:
+            function(*pair)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best / max(1, len(pairs)), peak
+
+
+def run_benchmarks(workloads, repeat=3, mapping_dictionary=None, only=None):
+    """
+    Benchmark evaluate_output and every matcher (both normalize modes) on each workload,
+    {name: pairs}. Returns one result dict per (workload, function).
+    """
+    results = []
+    for workload, pairs in workloads.items():
+        for name, function in _workload_functions(mapping_dictionary):
+            if only and not any(pattern in name for pattern in only):
+                continue
+            seconds, peak = measure(function, pairs, repeat)
+            results.append(
+                {
+                    "workload": workload,
+                    "function": name,
+                    "images": len(pairs),
+                    "ms_per_image": seconds * 1000,
+                    "images_per_second": 1 / seconds if seconds else float("inf"),
+                    "peak_memory_kib": peak / 1024,
+                }
+            )
+    return results
+
+
+def golden_check(pairs, mapping_dictionary=None):
+    """
+    Compare evaluate_output and every matcher against the reference implementation.
+    Returns a list of (image_key, function, expected, actual) for every difference.
+    """
+    mismatches = []
+    for dataset, image_key, label, model in pairs:
+        expected = reference.reference_evaluate(label, model, dataset, image_key, mapping_dictionary)
+        actual = evaluate_output(label, model, dataset, image_key, mapping_dictionary)
+        if actual != expected:
+            mismatches.append((image_key, EVALUATE_OUTPUT, expected, actual))
+        for matcher in MATCHERS:
+            for normalize in (False, True):
+                expected = run_matcher(reference, matcher, label, model, normalize)
+                actual = run_matcher(matching, matcher, label, model, normalize)
+                if actual != expected:
+                    mismatches.append((image_key, f"{matcher_name(matcher)} normalize={normalize}", expected, actual))
+    return mismatches
+
+
+def load_baseline(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    """Store ms per image of each (workload, function) as {"<workload>/<function>": ms}."""
+    baseline = {f"{r['workload']}/{r['function']}": r["ms_per_image"] for r in results}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def regressions(results, baseline, threshold=0.25):
+    """(key, baseline ms, current ms) for results slower than baseline by more than threshold."""
+    slower = []
+    for r in results:
+        key = f"{r['workload']}/{r['function']}"
+        if key in baseline and r["ms_per_image"] > baseline[key] * (1 + threshold):
+            slower.append((key, baseline[key], r["ms_per_image"]))
+    return slower
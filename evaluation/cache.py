@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+CACHE_FILE = "evaluate_output_cache.sqlite3"
+
+# Modules whose code determines an evaluate_output result, how a raw output is parsed,
+# or what a cache entry holds (corpus._evaluate sets the status and fallbacks).
+EVALUATOR_MODULES = (
+    "corpus.py",
+    "data_loader.py",
+    "diagram.py",
+    "evaluation.py",
+    "fuzzy.py",
+    "graph.py",
+    "matching.py",
+    "normalization.py",
+    "spatial.py",
+    "streaming.py",
+    "utils.py",
+)
+
+_evaluator_version = None
+
+
+def evaluator_version():
+    """Hash of the evaluator sources; editing the matching code invalidates every cached result."""
+    global _evaluator_version
+    if _evaluator_version is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in EVALUATOR_MODULES:
+            with open(os.path.join(directory, name), "rb") as f:
+                digest.update(name.encode())
+                digest.update(f.read())
+        _evaluator_version = digest.hexdigest()
+    return _evaluator_version
+
+
+def file_digest(path):
+    """sha256 of a file's bytes."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def canonical_json(value):
+    """
+    Stable bytes of a value for hashing: strings as b"s:" + UTF-8, anything else as b"j:" +
+    key-sorted JSON, so that e.g. the string "null" and None hash differently.
+    """
+    if isinstance(value, str):
+        return b"s:" + value.encode("utf-8")
+    return b"j:" + json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8")
+
+
+def result_key(label_digest, raw_output, mapping_entry, options=None):
+    """Cache key of one evaluation: label file, prediction, mapping entry, evaluate_output options
+    and evaluator version."""
+    digest = hashlib.sha256()
+    parts = (
+        label_digest.encode(),
+        canonical_json(raw_output),
+        canonical_json(mapping_entry),
+        canonical_json(options or {}),
+        evaluator_version().encode(),
+    )
+    for part in parts:
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk, content-addressed store of per-image evaluation results.
+
+    Backed by one SQLite database in WAL mode, so several worker processes can read
+    and write it at the same time. When the stored values exceed max_bytes, the least
+    recently used entries are evicted down to 90% of the limit.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 2**20, evict_every=256):
+        os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._touched = []
+        self._db = sqlite3.connect(os.path.join(directory, CACHE_FILE), timeout=60, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+
+    def get(self, key):
+        row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched.append((time.time(), key))
+        if len(self._touched) >= self.evict_every:
+            self._flush_access_times()
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        blob = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        self._db.execute(
+            "INSERT OR REPLACE INTO results (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+            (key, blob, len(blob), time.time()),
+        )
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache is below 90% of max_bytes."""
+        self._flush_access_times()
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM results ORDER BY accessed"):
+            if total <= target:
+                break
+            doomed.append((key,))
+            total -= size
+        self._write_many("DELETE FROM results WHERE key = ?", doomed)
+
+    def _flush_access_times(self):
+        if self._touched:
+            self._write_many("UPDATE results SET accessed = ? WHERE key = ?", self._touched)
+            self._touched = []
+
+    def _write_many(self, statement, rows):
+        # One transaction per batch; other processes wait on the busy timeout meanwhile.
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.executemany(statement, rows)
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def close(self):
+        if self._db is not None:
+            self.evict()
+            self._db.close()
+            self._db = None
@@ -0,0 +1,536 @@
+import csv
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing.util import Finalize
+
+import element_records
+import instrumentation
+from cache import ResultCache, result_key
+from data_loader import PredictionStreamStats, parse_model_output, prediction_key
+from diagram import compile_diagram
+from evaluation import METRIC_PROFILES, evaluate_output, evaluate_variants
+from label_store import open_label_store
+from matching import GRAPH_METRICS, METRICS, SPATIAL_METRIC_ELEMENTS
+from normalization import get_normalizer, text_corrections
+from streaming import recover_model_output
+
+EVALUATION_DIR = os.path.dirname(os.path.abspath(__file__))
+LABELS_ROOT = os.path.join(EVALUATION_DIR, "..", "data", "labels")
+MAPPING_PATH = os.path.join(EVALUATION_DIR, "mapping_dictionary.json")
+
+MATCH_TYPES = (
+    ("exact", "exact_matches"),
+    ("normalized", "normalized_matches"),
+    ("fuzzy", "fuzzy_matches"),
+    ("spatial", "spatial_matches"),
+    ("graph", "graph_matches"),
+)
+
+# Element kind whose label/model totals are the recall/precision denominators of each metric.
+METRIC_ELEMENTS = {name: metric.elements for name, metric in METRICS.items()}
+METRIC_ELEMENTS.update(SPATIAL_METRIC_ELEMENTS)
+
+NODE_EDGE_CATEGORIES = (
+    "node_texts",
+    "node_classes",
+    "node_text_and_class",
+    "arrow_path",
+    "arrow_classes",
+    "arrow_labels",
+    "arrow_path_and_label",
+    "arrow_path_label_class",
+)
+SPATIAL_CATEGORIES = ("node_boxes",)
+GRAPH_CATEGORIES = GRAPH_METRICS
+GROUP_CATEGORIES = ("group_names", "group_classes", "group_texts", "group_name_class_texts")
+UML_CATEGORIES = ("attribute_method_text_class",)
+DIAGRAM_RECOGNITION = "diagram_recognition"
+
+CSV_HEADER = ("Method", "Match Type", "Category", "F1 Score")
+
+
+def image_counts(result):
+    """
+    Flatten one evaluate_output result into {(match_type, category): (tp, label, pred)}.
+
+    diagram_recognition is stored as (1, 1, 1) for a perfectly recognized diagram and
+    (0, 1, 1) otherwise, so its corpus-level F1 is the share of perfect diagrams and
+    every category can be summed and merged the same way. Graph metrics already come
+    as (tp, label, pred) counts.
+    """
+    counts = {}
+    label, model = result["label"], result["model"]
+    for match_type, section in MATCH_TYPES:
+        matches = result.get(section)
+        if matches is None:
+            continue
+        for metric, tp in matches.items():
+            if isinstance(tp, (tuple, list)):
+                counts[(match_type, metric)] = tuple(tp)
+                continue
+            element = METRIC_ELEMENTS[metric]
+            counts[(match_type, metric)] = (tp, label[element], model[element])
+
+        recognition = (("node_text_and_class", "nodes"), ("arrow_path_label_class", "relations"))
+        if all(metric in matches for metric, _ in recognition):
+            perfect = all(matches[metric] == label[element] == model[element] for metric, element in recognition)
+            counts[(match_type, DIAGRAM_RECOGNITION)] = (int(perfect), 1, 1)
+    return counts
+
+
+def report_categories(labels):
+    """Categories reported for a dataset, in the order used by the results/ CSVs."""
+    categories = list(NODE_EDGE_CATEGORIES)
+    if any(node.get("bbox") for label in labels for node in label.get("nodes") or []):
+        categories.extend(SPATIAL_CATEGORIES)
+    if any(label.get("groups") for label in labels):
+        categories.extend(GROUP_CATEGORIES)
+    if any(node.get("attributes") or node.get("methods") for label in labels for node in label.get("nodes") or []):
+        categories.extend(UML_CATEGORIES)
+    categories.extend(GRAPH_CATEGORIES)
+    categories.append(DIAGRAM_RECOGNITION)
+    return categories
+
+
+def dataset_metrics(labels):
+    """
+    The metrics a dataset's labels can give non-trivial scores for (the "auto" profile):
+    node and edge metrics, plus group and UML metrics only when some label has groups,
+    or attributes, methods or cardinalities.
+    """
+    metrics = METRIC_PROFILES["nodes"] + METRIC_PROFILES["edges"]
+    if any(label.get("groups") for label in labels):
+        metrics += METRIC_PROFILES["groups"]
+    if any(
+        node.get("attributes") or node.get("methods") for label in labels for node in label.get("nodes") or []
+    ) or any(rel.get("cardinality_start") for label in labels for rel in label.get("relations") or []):
+        metrics += METRIC_PROFILES["uml"]
+    return metrics
+
+
+def f1_scores(totals):
+    """
+    Micro F1 of summed counts {(match_type, category): (tp, label, pred)}, as
+    {(match_type, category): f1}; 0.0 where nothing was expected or predicted.
+    """
+    return {metric: 2 * tp / (label + pred) if label + pred else 0.0 for metric, (tp, label, pred) in totals.items()}
+
+
+def f1_rows(method, scores, categories):
+    """CSV rows (Method, Match Type, Category, F1 Score) from {(match_type, category): f1}.
+    Categories a match type does not compute (e.g. paths in fuzzy mode) are left out."""
+    rows = []
+    for match_type, _ in MATCH_TYPES:
+        for category in categories:
+            if (match_type, category) in scores:
+                rows.append((method, match_type, category, round(scores[(match_type, category)], 3)))
+    return rows
+
+
+def write_csv(path, header, rows):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def write_f1_csv(path, rows):
+    """Write F1 rows in the results/<run>/<dataset>_f1_scores.csv layout."""
+    write_csv(path, CSV_HEADER, rows)
+
+
+# Worker side. Each process compiles a label the first time one of its images comes up;
+# work units only carry (dataset, run_id, image_key, raw model output) tuples.
+
+_worker_state = {}
+
+
+def _init_worker(
+    label_dirs,
+    mapping_dictionary,
+    cache_options=None,
+    evaluation_options=None,
+    packed=False,
+    instrument=False,
+    elements=False,
+    variants=None,
+):
+    _worker_state["label_dirs"] = label_dirs
+    _worker_state["packed"] = packed
+    _worker_state["instrument"] = instrument
+    _worker_state["elements"] = elements
+    _worker_state["stores"] = {}
+    _worker_state["options"] = evaluation_options or {}
+    _worker_state["compiled"] = {}
+    _worker_state["digests"] = {}
+    _worker_state["mapping"] = mapping_dictionary
+    _worker_state["variants"] = variants
+    _worker_state["cache"] = ResultCache(**cache_options) if cache_options else None
+
+
+def _init_pool_worker(
+    label_dirs,
+    mapping_dictionary,
+    cache_options=None,
+    evaluation_options=None,
+    packed=False,
+    instrument=False,
+    elements=False,
+    variants=None,
+):
+    _init_worker(
+        label_dirs, mapping_dictionary, cache_options, evaluation_options, packed, instrument, elements, variants
+    )
+    if _worker_state["cache"] is not None:
+        Finalize(_worker_state["cache"], _worker_state["cache"].close, exitpriority=10)
+
+
+def _label_store(dataset):
+    store = _worker_state["stores"].get(dataset)
+    if store is None:
+        labels_dir = _worker_state["label_dirs"][dataset]
+        store = _worker_state["stores"][dataset] = open_label_store(labels_dir, packed=_worker_state["packed"])
+    return store
+
+
+def _close_label_stores():
+    for store in _worker_state["stores"].values():
+        store.close()
+    _worker_state["stores"] = {}
+
+
+def _compiled_label(dataset, image_key):
+    compiled = _worker_state["compiled"].get((dataset, image_key))
+    if compiled is None:
+        label = _label_store(dataset).load(image_key)
+        normalizer = get_normalizer(_worker_state["options"].get("normalization"))
+        compiled = _worker_state["compiled"][(dataset, image_key)] = compile_diagram(label, normalizer=normalizer)
+    return compiled
+
+
+def _label_digest(dataset, image_key):
+    digest = _worker_state["digests"].get((dataset, image_key))
+    if digest is None:
+        digest = _worker_state["digests"][(dataset, image_key)] = _label_store(dataset).digest(image_key)
+    return digest
+
+
+def preload_labels():
+    """Compile every label of every dataset of this worker up front, for long-running workers."""
+    for dataset in _worker_state["label_dirs"]:
+        for image_key in _label_store(dataset).keys():
+            _compiled_label(dataset, image_key)
+
+
+def _dataset_options(dataset):
+    # The metric selection may be given per dataset as {dataset: metrics}.
+    options = _worker_state["options"]
+    if isinstance(options.get("metrics"), dict):
+        options = dict(options, metrics=options["metrics"].get(dataset))
+    return options
+
+
+def _evaluate(dataset, image_key, raw_output):
+    options = dict(_dataset_options(dataset))
+    recover = options.pop("recover_truncated", False)
+    output = parse_model_output(raw_output)
+    if raw_output is None:
+        status = "missing"
+    elif output is None:
+        status = "malformed"
+        # A truncated or garbled generation is scored on the elements that were complete.
+        if recover and isinstance(raw_output, str):
+            output = recover_model_output(raw_output)
+            if output:
+                status = "truncated"
+    else:
+        status = "ok"
+
+    try:
+        result = _evaluate_output(dataset, image_key, output or {}, options)
+    except Exception as e:
+        # Valid JSON of the wrong shape (e.g. a number as a node text) must not abort the run.
+        instrumentation.logger.warning(
+            "Prediction for %s__%s could not be evaluated (%s: %s); scored as malformed.",
+            dataset,
+            image_key,
+            type(e).__name__,
+            e,
+        )
+        status = "malformed"
+        result = _evaluate_output(dataset, image_key, {}, options)
+    return {"result": result, "status": status}
+
+
+def _evaluate_output(dataset, image_key, output, options):
+    if _worker_state["variants"] is not None:
+        return evaluate_variants(
+            _compiled_label(dataset, image_key),
+            output,
+            _worker_state["variants"],
+            dataset_name=dataset,
+            image_key=image_key,
+            **options,
+        )
+    return evaluate_output(
+        _compiled_label(dataset, image_key),
+        output,
+        dataset_name=dataset,
+        image_key=image_key,
+        mapping_dictionary=_worker_state["mapping"],
+        **options,
+    )
+
+
+def evaluate_image(dataset, image_key, raw_output):
+    """
+    Score one prediction against its label; returns (counts, status, cached, record,
+    elements), where record is the instrumentation record of the image and elements
+    its element records (see element_records.py), each None when the run does not
+    collect them.
+
+    With a result cache, the evaluate_output result is looked up by the hash of the
+    label file, the prediction, the image's mapping entry, the evaluation options and
+    the evaluator version, and only computed on a miss (or when collecting element
+    records, which are not cached).
+
+    When the worker scores several mapping variants, counts is {variant: counts}, the
+    variants are evaluated together (see evaluate_variants) and cached under the
+    mapping entries of all of them.
+    """
+    timer = instrumentation.start_image() if _worker_state["instrument"] else None
+    rows = element_records.start_image() if _worker_state["elements"] else None
+    cache = _worker_state["cache"]
+    if cache is None:
+        entry, cached = _evaluate(dataset, image_key, raw_output), False
+    else:
+        variants = _worker_state["variants"]
+        if variants is not None:
+            mapping_entry = {
+                variant: text_corrections(mapping, dataset, image_key) or None for variant, mapping in variants.items()
+            }
+        else:
+            mapping_entry = text_corrections(_worker_state["mapping"], dataset, image_key) or None
+        key = result_key(_label_digest(dataset, image_key), raw_output, mapping_entry, _dataset_options(dataset))
+        entry = cache.get(key) if rows is None else None
+        cached = entry is not None
+        if not cached:
+            entry = _evaluate(dataset, image_key, raw_output)
+            cache.put(key, entry)
+
+    result = entry["result"]
+    if _worker_state["variants"] is not None:
+        counts = {variant: image_counts(variant_result) for variant, variant_result in result.items()}
+        # The record's element totals are the same in every variant.
+        result = next(iter(result.values()), None)
+    else:
+        counts = image_counts(result)
+    record = None
+    if timer is not None:
+        record = instrumentation.finish_image(timer, image_key, entry["status"], cached, result)
+    elements = None
+    if rows is not None:
+        elements = element_records.finish_image(image_key, rows)
+    return counts, entry["status"], cached, record, elements
+
+
+def evaluate_chunk(chunk):
+    """
+    Score a work unit of (dataset, run_id, image_key, raw_output) items in an initialized
+    worker; returns ((dataset, run_id), image_key, counts, status, cached, record,
+    elements) per item (see evaluate_image).
+    """
+    return [
+        ((dataset, run_id), image_key) + evaluate_image(dataset, image_key, raw_output)
+        for dataset, run_id, image_key, raw_output in chunk
+    ]
+
+
+def chunks(items, chunk_size):
+    """Lists of up to chunk_size consecutive items, pulled lazily from any iterable."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def label_files(labels_dir, packed=False):
+    """Sorted label file names (image keys) of a dataset split directory or its pack."""
+    store = open_label_store(labels_dir, packed)
+    try:
+        return store.keys()
+    finally:
+        store.close()
+
+
+class CorpusResult:
+    """
+    Summed counts of one run on one dataset split, as totals {(match_type, category):
+    (tp, label, pred)}, so memory does not grow with the number of images. The counts of
+    every image are only kept with keep_images, for matrix() (saved counts, bootstrap
+    intervals and comparisons).
+    """
+
+    def __init__(self, keep_images=False):
+        self.totals = {}
+        self.image_counts = [] if keep_images else None
+        self.images = 0
+        self.missing = 0
+        self.malformed = 0
+        self.truncated = 0
+        self.cached = 0
+
+    def add(self, image_key, counts, status, cached=False):
+        for metric, values in counts.items():
+            total = self.totals.get(metric, (0, 0, 0))
+            self.totals[metric] = (total[0] + values[0], total[1] + values[1], total[2] + values[2])
+        if self.image_counts is not None:
+            self.image_counts.append((image_key, counts))
+        self.images += 1
+        self.missing += status == "missing"
+        self.malformed += status == "malformed"
+        self.truncated += status == "truncated"
+        self.cached += cached
+
+    def matrix(self):
+        """CountMatrix with one row per image, ordered by image key."""
+        from aggregate import CountMatrix  # needs numpy, only loaded for per-image statistics
+        if self.image_counts is None:
+            raise ValueError("Per-image counts were not kept; create the CorpusResult with keep_images=True.")
+        return CountMatrix.from_image_counts(sorted(self.image_counts, key=lambda item: item[0]))
+
+
+def score_predictions(
+    items,
+    label_dirs,
+    mapping_dictionary=None,
+    workers=None,
+    chunk_size=8,
+    cache_options=None,
+    evaluation_options=None,
+    packed=False,
+    telemetry=None,
+    element_writer=None,
+    variants=None,
+    keep_images=False,
+):
+    """
+    Score a stream of (dataset, run_id, image_key, raw_output) work items.
+
+    label_dirs maps dataset names to label split directories; with packed=True the
+    labels are read from the splits' packs (see label_store.py) instead. Returns
+    {(dataset, run_id): CorpusResult}. Missing (None) or unparseable outputs are
+    scored as an empty diagram. With workers > 1 the items are spread over a
+    process pool in chunks of chunk_size; items are pulled lazily and only a
+    bounded number of chunks is in flight, so memory does not grow with the input.
+    Counts are integer sums, so the result does not depend on the number of workers.
+
+    cache_options (ResultCache keyword arguments) enable the on-disk result cache, so
+    a rerun only evaluates images whose inputs changed. evaluation_options are passed
+    to evaluate_output (e.g. fuzzy_threshold). With an instrumentation.Telemetry, every
+    image is timed per metric and its record is passed to telemetry.add. With an
+    element_records.ElementRecordWriter, the per-element match records of every image
+    are passed to element_writer.add as each chunk completes.
+
+    variants ({name: mapping dictionary or None}, e.g. corrected and uncorrected) scores
+    every variant in the same pass instead of mapping_dictionary (see evaluate_variants)
+    and returns {variant: {(dataset, run_id): CorpusResult}}. With keep_images, the
+    CorpusResults also keep the counts of every image (see CorpusResult.matrix).
+    """
+    if variants is not None and element_writer is not None:
+        raise ValueError("Element records cannot be collected for several mapping variants at once.")
+    instrument = telemetry is not None
+    elements = element_writer is not None
+    workers = workers or os.cpu_count() or 1
+    results = {variant: {} for variant in variants} if variants is not None else {None: {}}
+
+    def collect(chunk_results):
+        for key, image_key, counts, status, cached, record, rows in chunk_results:
+            for variant, variant_counts in (counts if variants is not None else {None: counts}).items():
+                result = results[variant].get(key)
+                if result is None:
+                    result = results[variant][key] = CorpusResult(keep_images)
+                result.add(image_key, variant_counts, status, cached)
+            if record is not None:
+                record["dataset"], record["run_id"] = key
+                telemetry.add(record)
+            if rows is not None:
+                element_writer.add(key[0], key[1], rows)
+
+    initargs = (
+        label_dirs, mapping_dictionary, cache_options, evaluation_options, packed, instrument, elements, variants
+    )
+    if workers <= 1:
+        _init_worker(*initargs)
+        try:
+            for chunk in chunks(items, chunk_size):
+                collect(evaluate_chunk(chunk))
+        finally:
+            _close_label_stores()
+            if _worker_state["cache"] is not None:
+                _worker_state["cache"].close()
+        return results if variants is not None else results[None]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_pool_worker, initargs=initargs) as executor:
+        pending = set()
+        for chunk in chunks(items, chunk_size):
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future.result())
+            pending.add(executor.submit(evaluate_chunk, chunk))
+        for future in pending:
+            collect(future.result())
+
+    return results if variants is not None else results[None]
+
+
+def join_predictions(records, label_dirs, stats=None, packed=False):
+    """
+    Join streamed (image_key, run_id, output) records to label files and yield work items.
+
+    Record keys follow the "<dataset>__<image>" convention of mapping_dictionary.json.
+    Records for unknown datasets or images are counted as unmatched, repeated
+    (run, image) pairs as duplicates (the first one wins). Once the stream is exhausted,
+    every label image a run did not predict is yielded with output None. Only the
+    seen keys are kept in memory.
+    """
+    stats = stats if stats is not None else PredictionStreamStats()
+    images = {dataset: set(label_files(labels_dir, packed)) for dataset, labels_dir in label_dirs.items()}
+    seen = {}
+
+    for key, run_id, output in records:
+        dataset, _, image = key.partition("__")
+        image = prediction_key(image)
+        if image not in images.get(dataset, ()):
+            stats.unmatched += 1
+            continue
+        run_seen = seen.setdefault((dataset, run_id), set())
+        if image in run_seen:
+            stats.duplicates += 1
+            continue
+        run_seen.add(image)
+        yield dataset, run_id, image, output
+
+    for (dataset, run_id), run_seen in seen.items():
+        for image in sorted(images[dataset] - run_seen):
+            yield dataset, run_id, image, None
+
+
+def evaluate_corpus(labels_dir, predictions, dataset, mapping_dictionary=None, workers=None, chunk_size=8):
+    """
+    Score every label in labels_dir against predictions ({image_key: raw output})
+    and return the CorpusResult.
+    """
+    items = ((dataset, None, key, predictions.get(key)) for key in label_files(labels_dir))
+    results = score_predictions(
+        items, {dataset: labels_dir}, mapping_dictionary=mapping_dictionary, workers=workers, chunk_size=chunk_size
+    )
+    return results.get((dataset, None)) or CorpusResult()
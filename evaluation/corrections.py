@@ -0,0 +1,123 @@
+"""
+Mining candidate entries for mapping_dictionary.json.
+
+For every image, predicted node texts that have no exact match in the label are paired
+with label node texts that have none either, when their character trigram Dice
+similarity (on lowercased texts) reaches a threshold. Candidates come from an inverted
+index of the unmatched label texts' trigrams, so only pairs sharing a trigram are
+scored. Pairs are taken one-to-one, most similar first, and proposed as corrections in
+the mapping file's format, {"<dataset>__<image>": {lowercased predicted text: label text}}.
+"""
+import json
+import os
+from collections import Counter, defaultdict
+
+from diagram import compile_diagram
+from normalization import correction_key, text_corrections
+
+DEFAULT_THRESHOLD = 0.8
+
+
+def _unmatched_texts(label_texts, model_texts):
+    # Distinct non-empty texts left over after exact multiset matching, in first-seen order.
+    label_counts, model_counts = Counter(label_texts), Counter(model_texts)
+    common = label_counts & model_counts
+
+    def rest(counts):
+        return [text for text in counts - common if isinstance(text, str) and text.strip()]
+
+    return rest(label_counts), rest(model_counts)
+
+
+def correction_candidates(label_texts, model_texts, threshold=DEFAULT_THRESHOLD, n=3):
+    """
+    Near-miss pairs between unmatched model and label texts, as [(model text, label text,
+    similarity)], one-to-one and most similar first.
+    """
+    from fuzzy import ngram_sets  # fuzzy.py needs numpy/scipy, only loaded when mining corrections
+    label_rest, model_rest = _unmatched_texts(label_texts, model_texts)
+    if not label_rest or not model_rest:
+        return []
+    label_grams = ngram_sets([text.lower() for text in label_rest], n)
+    index = defaultdict(list)
+    for i, grams in enumerate(label_grams):
+        for gram in grams:
+            index[gram].append(i)
+
+    scored = []
+    for j, grams in enumerate(ngram_sets([text.lower() for text in model_rest], n)):
+        shared = Counter()
+        for gram in grams:
+            shared.update(index.get(gram, ()))
+        for i, count in shared.items():
+            similarity = 2 * count / (len(label_grams[i]) + len(grams))
+            if similarity >= threshold:
+                scored.append((similarity, j, i))
+
+    pairs = []
+    used_labels, used_models = set(), set()
+    for similarity, j, i in sorted(scored, key=lambda item: (-item[0], item[1], item[2])):
+        if i not in used_labels and j not in used_models:
+            used_labels.add(i)
+            used_models.add(j)
+            pairs.append((model_rest[j], label_rest[i], similarity))
+    return pairs
+
+
+def image_proposals(label, model_output, corrections=None, threshold=DEFAULT_THRESHOLD):
+    """
+    Proposed corrections of one image: {lowercased predicted text: (label text, similarity)}.
+    Existing corrections are applied to the prediction first, so only new ones are proposed.
+    """
+    label = compile_diagram(label) if isinstance(label, dict) else label
+    model = compile_diagram(model_output or {}, text_corrections=corrections)
+    return {
+        model_text.lower(): (label_text, similarity)
+        for model_text, label_text, similarity in correction_candidates(label.node_texts, model.node_texts, threshold)
+    }
+
+
+class CorrectionMiner:
+    """
+    Proposals over any number of predictions. add() mines one image; when several runs
+    propose different label texts for the same predicted text, the most similar wins.
+    """
+
+    def __init__(self, mapping_dictionary=None, threshold=DEFAULT_THRESHOLD):
+        self.mapping_dictionary = mapping_dictionary
+        self.threshold = threshold
+        self.images = 0
+        self.proposals = {}
+
+    def add(self, dataset, image_key, label, model_output):
+        corrections = text_corrections(self.mapping_dictionary, dataset, image_key)
+        found = image_proposals(label, model_output, corrections, self.threshold)
+        self.images += 1
+        if not found:
+            return
+        entry = self.proposals.setdefault(correction_key(dataset, image_key), {})
+        for model_text, (label_text, similarity) in found.items():
+            if model_text not in entry or similarity > entry[model_text][1]:
+                entry[model_text] = (label_text, similarity)
+
+    def mapping(self):
+        """The proposals in mapping_dictionary.json format, sorted by image key."""
+        return {
+            key: {text: label for text, (label, _) in sorted(entry.items())}
+            for key, entry in sorted(self.proposals.items())
+        }
+
+    def rows(self):
+        """(image key, predicted text, label text, similarity) of every proposal, for review."""
+        return [
+            (key, text, label, round(similarity, 3))
+            for key, entry in sorted(self.proposals.items())
+            for text, (label, similarity) in sorted(entry.items())
+        ]
+
+    def write(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.mapping(), f, ensure_ascii=False, indent=2)
@@ -1,13 +1,114 @@
-import json
-
-def load_label_data(label_path: str) -> dict:
-    """Load label data from a JSON file."""
-    with open(label_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-def build_id_to_text_map(nodes: list, normalize: bool = True) -> dict:
-    """Create mapping from node ID to text (normalized if specified)."""
-    from utils import normalize_string  # avoid circular import issues
-    if normalize:
-        return {node.get("id"): normalize_string(node.get("text")) for node in nodes}
-    return {node.get("id"): node.get("text", "") for node in nodes}
\ No newline at end of file
+import json
+import os
+import re
+
+try:
+    import orjson
+    decode_json = orjson.loads
+except ImportError:  # plain json is fast enough for small runs
+    decode_json = json.loads
+
+def load_label_data(label_path: str) -> dict:
+    """Load label data from a JSON file."""
+    with open(label_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def build_id_to_text_map(nodes: list, normalize: bool = True) -> dict:
+    """Create mapping from node ID to text (normalized if specified)."""
+    from utils import normalize_string  # avoid circular import issues
+    if normalize:
+        return {node.get("id"): normalize_string(node.get("text")) for node in nodes}
+    return {node.get("id"): node.get("text", "") for node in nodes}
+
+def load_label_set(labels_dir: str) -> dict:
+    """Load every label JSON file in a dataset split directory, keyed by file name."""
+    return {
+        name: load_label_data(os.path.join(labels_dir, name))
+        for name in sorted(os.listdir(labels_dir))
+        if name.endswith(".json")
+    }
+
+_JSON_BLOCK = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+def parse_model_output(raw):
+    """Turn a raw model generation into a diagram dict.
+    Accepts an already parsed dict, plain JSON text or JSON wrapped in a ```json fence.
+    Returns None if no JSON object can be recovered."""
+    if isinstance(raw, list) and len(raw) == 1:
+        raw = raw[0]
+    if isinstance(raw, dict) or raw is None:
+        return raw
+    if not isinstance(raw, str):
+        return None
+
+    candidates = [raw]
+    candidates.extend(_JSON_BLOCK.findall(raw))
+    start, end = raw.find("{"), raw.rfind("}")
+    if 0 <= start < end:
+        candidates.append(raw[start:end + 1])
+
+    for candidate in candidates:
+        try:
+            parsed = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(parsed, list) and len(parsed) == 1:
+            parsed = parsed[0]
+        if isinstance(parsed, dict):
+            return parsed
+    return None
+
+def load_predictions(path: str) -> dict:
+    """Load model predictions keyed by image file name.
+    path is either a directory with one JSON (or raw text) file per image, or a single
+    JSON file mapping image keys to model outputs."""
+    if os.path.isdir(path):
+        predictions = {}
+        for name in sorted(os.listdir(path)):
+            stem, ext = os.path.splitext(name)
+            if ext not in (".json", ".txt"):
+                continue
+            with open(os.path.join(path, name), 'r', encoding='utf-8') as f:
+                predictions[prediction_key(stem)] = f.read()
+        return predictions
+
+    with open(path, 'r', encoding='utf-8') as f:
+        return {prediction_key(key): output for key, output in json.load(f).items()}
+
+def prediction_key(key: str) -> str:
+    """Canonical image key: the label file name, without any "dataset__" prefix."""
+    from utils import simplify_filename  # avoid circular import issues
+    key = simplify_filename(key)
+    return key if key.endswith(".json") else f"{key}.json"
+
+class PredictionStreamStats:
+    """Counters filled while streaming a JSONL prediction file."""
+
+    def __init__(self):
+        self.lines = 0
+        self.records = 0
+        self.bad_lines = 0
+        self.unmatched = 0
+        self.duplicates = 0
+
+def iter_jsonl_predictions(path: str, stats: PredictionStreamStats = None):
+    """Lazily yield (image_key, run_id, output) from a JSONL prediction file.
+    Each line is an object {"image_key": "<dataset>__<image>", "run_id": ..., "output": ...};
+    lines that are not valid JSON or lack image_key/output are counted and skipped.
+    Uses orjson when it is installed."""
+    stats = stats if stats is not None else PredictionStreamStats()
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            stats.lines += 1
+            try:
+                record = decode_json(line)
+            except ValueError:
+                stats.bad_lines += 1
+                continue
+            if not isinstance(record, dict) or not isinstance(record.get("image_key"), str) or "output" not in record:
+                stats.bad_lines += 1
+                continue
+            stats.records += 1
+            yield record["image_key"], record.get("run_id"), record["output"]
@@ -0,0 +1,172 @@
+import sys
+
+from normalization import correct_text, get_normalizer
+from utils import make_hashable
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _sorted_raw_tuple(values):
+    return tuple(make_hashable(v) for v in sorted(v or "" for v in values))
+
+
+class CompiledDiagram:
+    """
+    Read-only, pre-normalized view of one diagram (label or model output).
+
+    Every string is normalized once and interned; relation endpoints and group
+    members are resolved to node indices (-1 when the id is unknown). Per-element
+    values are stored in parallel tuples, so all metrics share the same data and
+    the source dicts are never copied or mutated.
+    """
+
+    __slots__ = (
+        "node_texts",
+        "node_texts_norm",
+        "node_path_texts_norm",
+        "node_classes",
+        "node_classes_norm",
+        "node_attributes",
+        "node_attributes_norm",
+        "node_methods",
+        "node_methods_norm",
+        "node_bboxes",
+        "rel_heads",
+        "rel_tails",
+        "rel_labels",
+        "rel_labels_norm",
+        "rel_classes",
+        "rel_classes_norm",
+        "rel_cardinality_starts",
+        "rel_cardinality_starts_norm",
+        "rel_cardinality_ends",
+        "rel_cardinality_ends_norm",
+        "group_names",
+        "group_names_norm",
+        "group_classes",
+        "group_classes_norm",
+        "group_members",
+        "has_rel_classes",
+        "has_cardinality_starts",
+        "attribute_count",
+        "method_count",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields[name])
+
+    @property
+    def node_count(self):
+        return len(self.node_texts)
+
+    @property
+    def relation_count(self):
+        return len(self.rel_heads)
+
+    @property
+    def group_count(self):
+        return len(self.group_names)
+
+    def endpoint_text(self, index, normalize):
+        """Text of the node at index as used for head/tail comparison ("" for unresolved ids)."""
+        if index < 0:
+            return ""
+        return self.node_path_texts_norm[index] if normalize else self.node_texts[index]
+
+    def member_text(self, index, normalize):
+        """Text of the node at index as used for group membership ("" for unresolved ids)."""
+        if index < 0:
+            return ""
+        return self.node_texts_norm[index] if normalize else self.node_texts[index]
+
+
+def compile_diagram(data, text_corrections=None, normalizer=None):
+    """
+    Compile a label or model output dict into a CompiledDiagram.
+
+    text_corrections maps lowercased node texts to corrected texts (one
+    mapping_dictionary.json entry); matching node texts are replaced before
+    normalization. normalizer is a normalization.Normalizer (default: the base pipeline).
+    """
+    nodes = data.get("nodes") or []
+    rels = data.get("relations") or []
+    groups = data.get("groups") or []
+
+    normalizer = normalizer or get_normalizer()
+    normalize_many = normalizer.normalize_many
+
+    node_texts = []
+    node_classes = []
+    node_attributes = []
+    node_methods = []
+    id_to_index = {}
+
+    for i, node in enumerate(nodes):
+        text = correct_text(node.get("text", ""), text_corrections)
+        node_texts.append(_intern(make_hashable(text)))
+        node_classes.append(_intern(make_hashable(node.get("class", ""))))
+        node_attributes.append(node.get("attributes") or [])
+        node_methods.append(node.get("methods") or [])
+        id_to_index[make_hashable(node.get("id"))] = i
+
+    node_texts_norm = normalize_many(node_texts)
+    rel_classes = tuple(_intern(make_hashable(rel.get("class", ""))) for rel in rels)
+    rel_cardinality_starts = tuple(_intern(make_hashable(rel.get("cardinality_start") or "")) for rel in rels)
+
+    def resolve(node_id):
+        return id_to_index.get(make_hashable(node_id), -1)
+
+    return CompiledDiagram(
+        node_texts=tuple(node_texts),
+        node_texts_norm=node_texts_norm,
+        # Endpoint texts have always been normalized twice, which also maps "n one" -> "none" -> "".
+        node_path_texts_norm=normalize_many(node_texts_norm),
+        node_classes=tuple(node_classes),
+        node_classes_norm=normalize_many(node_classes),
+        node_attributes=tuple(_sorted_raw_tuple(attrs) for attrs in node_attributes),
+        node_attributes_norm=tuple(tuple(sorted(normalize_many(attrs))) for attrs in node_attributes),
+        node_methods=tuple(_sorted_raw_tuple(meths) for meths in node_methods),
+        node_methods_norm=tuple(tuple(sorted(normalize_many(meths))) for meths in node_methods),
+        node_bboxes=tuple(node.get("bbox") for node in nodes),
+        rel_heads=tuple(resolve(rel.get("head")) for rel in rels),
+        rel_tails=tuple(resolve(rel.get("tail")) for rel in rels),
+        rel_labels=tuple(_intern(make_hashable(rel.get("label", ""))) for rel in rels),
+        rel_labels_norm=normalize_many([rel.get("label") for rel in rels]),
+        rel_classes=rel_classes,
+        rel_classes_norm=normalize_many([rel.get("class") for rel in rels]),
+        rel_cardinality_starts=rel_cardinality_starts,
+        rel_cardinality_starts_norm=normalize_many([rel.get("cardinality_start") or "" for rel in rels]),
+        rel_cardinality_ends=tuple(_intern(make_hashable(rel.get("cardinality_end", ""))) for rel in rels),
+        rel_cardinality_ends_norm=normalize_many([rel.get("cardinality_end") for rel in rels]),
+        group_names=tuple(_intern(make_hashable(group.get("name", ""))) for group in groups),
+        group_names_norm=normalize_many([group.get("name") for group in groups]),
+        group_classes=tuple(_intern(make_hashable(group.get("class", ""))) for group in groups),
+        group_classes_norm=normalize_many([group.get("class") for group in groups]),
+        group_members=tuple(tuple(resolve(nid) for nid in group.get("nodes") or []) for group in groups),
+        has_rel_classes=any(rel_classes),
+        has_cardinality_starts=any(rel_cardinality_starts),
+        attribute_count=sum(len(attrs) for attrs in node_attributes),
+        method_count=sum(len(meths) for meths in node_methods),
+    )
+
+
+def correct_node_texts(diagram, text_corrections, normalizer=None):
+    """
+    The CompiledDiagram that compiling diagram's source with text_corrections would give,
+    sharing every field but the node texts with diagram; diagram itself when no node text
+    changes. normalizer must be the one diagram was compiled with.
+    """
+    if not text_corrections:
+        return diagram
+    node_texts = tuple(_intern(correct_text(text, text_corrections)) for text in diagram.node_texts)
+    if node_texts == diagram.node_texts:
+        return diagram
+    normalize_many = (normalizer or get_normalizer()).normalize_many
+    fields = {name: getattr(diagram, name) for name in CompiledDiagram.__slots__}
+    fields["node_texts"] = node_texts
+    fields["node_texts_norm"] = normalize_many(node_texts)
+    fields["node_path_texts_norm"] = normalize_many(fields["node_texts_norm"])
+    return CompiledDiagram(**fields)
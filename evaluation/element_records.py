@@ -0,0 +1,181 @@
+"""
+Opt-in per-element match records, for confusion-style analysis of what fails.
+
+Worker side: when a run enables it, evaluate_image sets current to a list before each
+image, and the exact and normalized matchers append one row per label element and per
+unmatched model element of every metric they compute. With records off, current stays
+None and the only cost is that check. Cached results carry no records, so images are
+re-evaluated (and the cache refreshed) while records are on.
+
+Parent side: ElementRecordWriter receives the rows of each chunk as it completes and
+writes them in batches to an indexed SQLite database, or to Parquet when the path ends
+in .parquet (needs pyarrow). Only one batch is held in memory.
+"""
+import json
+import os
+import sqlite3
+from collections import Counter
+
+from matching import METRICS
+
+# Rows collected for the image being evaluated in this process, None when records are off.
+current = None
+
+RECORD_FIELDS = (
+    "dataset",
+    "run_id",
+    "image_key",
+    "match_type",
+    "metric",
+    "kind",
+    "class",
+    "label_value",
+    "predicted_value",
+    "matched",
+)
+
+_CLASS_FIELDS = {"nodes": "node_classes_norm", "relations": "rel_classes_norm", "groups": "group_classes_norm"}
+
+
+def start_image():
+    global current
+    current = []
+    return current
+
+
+def finish_image(image_key, rows):
+    """The rows of one image with its key, as (image_key, match_type, metric, kind, class, label, predicted, matched)."""
+    global current
+    current = None
+    return [(image_key,) + row for row in rows]
+
+
+def _render(value):
+    # Keys are strings or nested tuples and frozensets of strings; the latter are stored as JSON arrays.
+    if isinstance(value, str) or value is None:
+        return value
+    return json.dumps(value, ensure_ascii=False, default=lambda members: sorted(members, key=str))
+
+
+def metric_rows(label, model, label_keys, model_keys, metric, match_type):
+    """
+    Rows of one metric: every label element with whether it was matched and, if not,
+    the most similar unmatched model value (character trigram similarity); then every
+    unmatched model element, with no label value.
+    """
+    kind = METRICS[metric].elements
+    label_values, model_values = label_keys[metric], model_keys[metric]
+    label_classes = getattr(label, _CLASS_FIELDS[kind])
+    model_classes = getattr(model, _CLASS_FIELDS[kind])
+
+    available = Counter(model_values)
+    label_matched = []
+    for value in label_values:
+        matched = available[value] > 0
+        if matched:
+            available[value] -= 1
+        label_matched.append(matched)
+    model_unmatched = []
+    for index, value in enumerate(model_values):
+        if available[value] > 0:
+            available[value] -= 1
+            model_unmatched.append(index)
+
+    missed = [index for index, matched in enumerate(label_matched) if not matched]
+    best = {}
+    if missed and model_unmatched:
+        from fuzzy import ngram_similarity_matrix  # needs numpy/scipy, only loaded with records on
+        candidates = [_render(model_values[index]) for index in model_unmatched]
+        scores = ngram_similarity_matrix([_render(label_values[index]) for index in missed], candidates)
+        best = dict(zip(missed, (candidates[column] for column in scores.argmax(axis=1).tolist())))
+
+    rows = []
+    for index, value in enumerate(label_values):
+        rendered = _render(value)
+        predicted = rendered if label_matched[index] else best.get(index)
+        rows.append((match_type, metric, kind, label_classes[index], rendered, predicted, int(label_matched[index])))
+    for index in model_unmatched:
+        rows.append((match_type, metric, kind, model_classes[index], None, _render(model_values[index]), 0))
+    return rows
+
+
+def add_matches(label, model, label_keys, model_keys, metrics, match_type):
+    """Append the rows of every metric to current."""
+    for metric in metrics:
+        current.extend(metric_rows(label, model, label_keys, model_keys, metric, match_type))
+
+
+class ElementRecordWriter:
+    """
+    Batched writer of element records. add() buffers the rows of one run's images and
+    writes a batch once batch_size rows are pending; close() writes the rest.
+
+    SQLite records are appended to an "elements" table indexed by (dataset, run_id,
+    metric, class) and (metric, class), so records of several runs can share a file.
+    """
+
+    def __init__(self, path, batch_size=50000):
+        self.path = path
+        self.batch_size = batch_size
+        self.rows = 0
+        self._pending = []
+        self._db = self._parquet = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if path.endswith(".parquet"):
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError as e:
+                raise ImportError("Parquet element records require the pyarrow package.") from e
+        else:
+            self._db = sqlite3.connect(path, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS elements ("
+                "dataset TEXT, run_id TEXT, image_key TEXT, match_type TEXT, metric TEXT, kind TEXT, "
+                "class TEXT, label_value TEXT, predicted_value TEXT, matched INTEGER)"
+            )
+
+    def add(self, dataset, run_id, rows):
+        self._pending.extend((dataset, run_id) + row for row in rows)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        if self._db is not None:
+            self._db.execute("BEGIN")
+            self._db.executemany(f"INSERT INTO elements VALUES ({', '.join('?' * len(RECORD_FIELDS))})", self._pending)
+            self._db.execute("COMMIT")
+        else:
+            self._write_parquet(self._pending)
+        self.rows += len(self._pending)
+        self._pending = []
+
+    def _write_parquet(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = list(zip(*rows))
+        types = [pa.string()] * (len(RECORD_FIELDS) - 1) + [pa.int8()]
+        table = pa.table(
+            [pa.array(column, type=type_) for column, type_ in zip(columns, types)], names=list(RECORD_FIELDS)
+        )
+        if self._parquet is None:
+            self._parquet = pq.ParquetWriter(self.path, table.schema)
+        self._parquet.write_table(table)
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            # Built once at the end: cheaper than updating the indexes on every batch.
+            self._db.execute("CREATE INDEX IF NOT EXISTS elements_run ON elements (dataset, run_id, metric, class)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS elements_metric ON elements (metric, class)")
+            self._db.close()
+            self._db = None
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
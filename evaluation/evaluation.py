@@ -1,138 +1,290 @@
-import copy
-
-from matching import (
-    count_field_matches,
-    count_node_text_class_matches,
-    count_arrow_path_matches,
-    count_arrow_path_and_label_matches,
-    count_arrow_path_label_class_matches,
-    count_group_node_matches,
-    count_full_group_matches,
-    count_node_attribute_method_matches,
-    count_node_method_matches,
-    count_node_attribute_matches,
-    count_cardinality_matches,
-)
-
-def evaluate_output(label_data, model_output, dataset_name=None, image_key=None, mapping_dictionary=None):
-    """Compare model output to label data using exact and normalized matching."""
-
-    # Extract label nodes, relations, groups and their attributes/methods
-    label_nodes = label_data.get("nodes") or []
-    label_rels = label_data.get("relations") or []
-    label_groups = label_data.get("groups") or []
-
-    label_attributes = []
-    for node in label_nodes:
-        node["attributes"] = node.get("attributes") or []
-        label_attributes.extend(node["attributes"])
-
-    label_methods = []
-    for node in label_nodes:
-        node["methods"] = node.get("methods") or []
-        label_methods.extend(node["methods"])
-
-    label_cardinalities = []
-    for rel in label_rels:
-        rel["cardinality_start"] = rel.get("cardinality_start") or ""
-        label_cardinalities.append(rel["cardinality_start"])
-
-    model_output = model_output if isinstance(model_output, dict) else None
-    if model_output is None:
-        print("Model output is None")
-        return None
-
-    original_model_nodes = model_output.get("nodes") or []
-    model_rels = model_output.get("relations") or []
-    model_groups = model_output.get("groups") or []
-
-    if dataset_name and image_key:
-        mapping_key = f"{dataset_name}__{image_key}"
-        mapping_for_image = mapping_dictionary.get(mapping_key, {})
-
-        if mapping_for_image:
-            model_nodes = copy.deepcopy(original_model_nodes)
-
-            for node in model_nodes:
-                original_text = node["text"].lower() if node["text"] else node["text"]
-                if original_text in mapping_for_image:
-                    corrected_text = mapping_for_image[original_text]
-                    node["text"] = corrected_text
-        else:
-            model_nodes = original_model_nodes
-    else:
-        model_nodes = original_model_nodes
-
-    model_attributes = []
-    for node in model_nodes:
-        node["attributes"] = node.get("attributes") or []
-        model_attributes.extend(node["attributes"])
-
-    model_methods = []
-    for node in model_nodes:
-        node["methods"] = node.get("methods") or []
-        model_methods.extend(node["methods"])
-
-    model_cardinalities = []
-    for rel in model_rels:
-        rel["cardinality_start"] = rel.get("cardinality_start") or ""
-        model_cardinalities.append(rel["cardinality_start"])
-
-    try:
-        result = {
-            "label": {
-                "nodes": len(label_nodes),
-                "relations": len(label_rels),
-                "groups": len(label_groups),
-                "attributes": len(label_attributes),
-                "methods": len(label_methods),
-                "cardinalities": len(label_cardinalities),
-            },
-            "model": {
-                "nodes": len(model_nodes),
-                "relations": len(model_rels),
-                "groups": len(model_groups),
-                "attributes": len(model_attributes),
-                "methods": len(model_methods),
-                "cardinalities": len(model_cardinalities),
-            },
-            "exact_matches": {
-                "node_texts": count_field_matches(label_nodes, model_nodes, "text", normalize=False),
-                "node_classes": count_field_matches(label_nodes, model_nodes, "class", normalize=False),
-                "node_text_and_class": count_node_text_class_matches(label_nodes, model_nodes, normalize=False),
-                "arrow_labels": count_field_matches(label_rels, model_rels, "label", normalize=False),
-                "arrow_classes": count_field_matches(label_rels, model_rels, "class", normalize=False),
-                "group_names": count_field_matches(label_groups, model_groups, "name", normalize=False),
-                "group_classes": count_field_matches(label_groups, model_groups, "class", normalize=False),
-                "arrow_path": count_arrow_path_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=False),
-                "arrow_path_and_label": count_arrow_path_and_label_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=False),
-                "arrow_path_label_class": count_arrow_path_label_class_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=False),
-                "group_texts": count_group_node_matches(label_groups, model_groups, label_nodes, model_nodes, normalize=False),
-                "group_name_class_texts": count_full_group_matches(label_groups, model_groups, label_nodes, model_nodes, normalize=False),
-                "attribute_method_text_class": count_node_attribute_method_matches(label_nodes, model_nodes, normalize=False),
-            },
-            "normalized_matches": {
-                "node_texts": count_field_matches(label_nodes, model_nodes, "text", normalize=True),
-                "node_classes": count_field_matches(label_nodes, model_nodes, "class", normalize=True),
-                "node_text_and_class": count_node_text_class_matches(label_nodes, model_nodes, normalize=True),
-                "arrow_labels": count_field_matches(label_rels, model_rels, "label", normalize=True),
-                "arrow_classes": count_field_matches(label_rels, model_rels, "class", normalize=True),
-                "group_names": count_field_matches(label_groups, model_groups, "name", normalize=True),
-                "group_classes": count_field_matches(label_groups, model_groups, "class", normalize=True),
-                "arrow_path": count_arrow_path_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=True),
-                "arrow_path_and_label": count_arrow_path_and_label_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=True),
-                "arrow_path_label_class": count_arrow_path_label_class_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=True),
-                "group_texts": count_group_node_matches(label_groups, model_groups, label_nodes, model_nodes, normalize=True),
-                "group_name_class_texts": count_full_group_matches(label_groups, model_groups, label_nodes, model_nodes, normalize=True),
-                "attribute_method_text_class": count_node_attribute_method_matches(label_nodes, model_nodes, normalize=True),
-                "node_methods": count_node_method_matches(label_nodes, model_nodes, normalize=True),
-                "node_attributes": count_node_attribute_matches(label_nodes, model_nodes, normalize=True),
-                "arrow_cardinalities": count_cardinality_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=True),
-            },
-        }
-
-    except Exception as e:
-        print(f"Error in evaluate_output: {e}")
-        raise
-
-    return result
\ No newline at end of file
+import time
+
+import element_records
+import instrumentation
+from diagram import CompiledDiagram, compile_diagram, correct_node_texts
+from matching import METRICS, MetricKeys, count_metric_matches, dependent_metrics
+from normalization import get_normalizer, text_corrections
+
+logger = instrumentation.logger
+
+EXACT_METRICS = (
+    "node_texts",
+    "node_classes",
+    "node_text_and_class",
+    "arrow_labels",
+    "arrow_classes",
+    "group_names",
+    "group_classes",
+    "arrow_path",
+    "arrow_path_and_label",
+    "arrow_path_label_class",
+    "group_texts",
+    "group_name_class_texts",
+    "attribute_method_text_class",
+)
+
+NORMALIZED_METRICS = EXACT_METRICS + (
+    "node_methods",
+    "node_attributes",
+    "arrow_cardinalities",
+)
+
+# Named metric selections for evaluate_output(metrics=...), e.g. for node-only dashboards.
+METRIC_PROFILES = {
+    "nodes": ("node_texts", "node_classes", "node_text_and_class"),
+    "edges": (
+        "arrow_labels",
+        "arrow_classes",
+        "arrow_path",
+        "arrow_path_and_label",
+        "arrow_path_label_class",
+    ),
+    "groups": ("group_names", "group_classes", "group_texts", "group_name_class_texts"),
+    "uml": ("attribute_method_text_class", "node_methods", "node_attributes", "arrow_cardinalities"),
+}
+
+# Metrics whose keys are built from node texts, the only ones a text correction changes.
+NODE_TEXT_METRICS = dependent_metrics(("node_texts", "node_text_and_class", "arrow_path", "group_texts"))
+
+
+def select_metrics(names):
+    """Expand metric and profile names (METRIC_PROFILES) into a frozenset of metric names."""
+    selected = set()
+    for name in names:
+        if name in METRIC_PROFILES:
+            selected.update(METRIC_PROFILES[name])
+        elif name in METRICS:
+            selected.add(name)
+        else:
+            raise ValueError(
+                f"Unknown metric or profile {name!r}; expected one of {sorted(METRIC_PROFILES)} or {sorted(METRICS)}."
+            )
+    return frozenset(selected)
+
+
+def _element_counts(diagram):
+    return {
+        "nodes": diagram.node_count,
+        "relations": diagram.relation_count,
+        "groups": diagram.group_count,
+        "attributes": diagram.attribute_count,
+        "methods": diagram.method_count,
+        "cardinalities": diagram.relation_count,
+    }
+
+
+def _count_matches(label, model, metrics, normalize, match_type):
+    label_keys, model_keys = MetricKeys(label, normalize, label), MetricKeys(model, normalize, label)
+    if element_records.current is not None:
+        element_records.add_matches(label, model, label_keys, model_keys, metrics, match_type)
+    timer = instrumentation.current_image
+    if timer is None:
+        return {metric: count_metric_matches(label_keys, model_keys, metric) for metric in metrics}
+
+    matches = {}
+    for metric in metrics:
+        start = time.perf_counter()
+        matches[metric] = count_metric_matches(label_keys, model_keys, metric)
+        timer.metric_seconds[f"{match_type}/{metric}"] = time.perf_counter() - start
+    return matches
+
+
+def evaluate_compiled(
+    label,
+    model,
+    fuzzy_threshold=None,
+    similarity="ngram",
+    metrics=None,
+    iou_threshold=None,
+    text_weight=0.0,
+    graph_metrics=False,
+):
+    """Compare two CompiledDiagrams using exact and normalized matching.
+    With a fuzzy_threshold, normalized node texts, edge labels and group names are also
+    matched by similarity (see fuzzy.py) under "fuzzy_matches". With an iou_threshold,
+    nodes are also matched by their bboxes and relations through the matched nodes (see
+    spatial.py) under "spatial_matches". With graph_metrics, whole-graph similarities (see
+    graph.py) are reported under "graph_matches" as (tp, label, pred) counts. metrics limits the exact and normalized
+    results to a selection of metric names (see select_metrics); by default all are computed."""
+    exact_metrics, normalized_metrics = EXACT_METRICS, NORMALIZED_METRICS
+    if metrics is not None:
+        metrics = select_metrics(metrics)
+        exact_metrics = tuple(metric for metric in EXACT_METRICS if metric in metrics)
+        normalized_metrics = tuple(metric for metric in NORMALIZED_METRICS if metric in metrics)
+
+    result = {
+        "label": _element_counts(label),
+        "model": _element_counts(model),
+        "exact_matches": _count_matches(label, model, exact_metrics, False, "exact"),
+        "normalized_matches": _count_matches(label, model, normalized_metrics, True, "normalized"),
+    }
+
+    if fuzzy_threshold is not None:
+        from fuzzy import fuzzy_matches  # needs numpy/scipy, only loaded in fuzzy mode
+        start = time.perf_counter()
+        result["fuzzy_matches"] = fuzzy_matches(label, model, fuzzy_threshold, similarity, metrics)
+        if instrumentation.current_image is not None:
+            instrumentation.current_image.metric_seconds["fuzzy"] = time.perf_counter() - start
+
+    if iou_threshold is not None:
+        from spatial import spatial_matches  # needs numpy, only loaded in spatial mode
+        start = time.perf_counter()
+        result["spatial_matches"] = spatial_matches(label, model, iou_threshold, text_weight)
+        if instrumentation.current_image is not None:
+            instrumentation.current_image.metric_seconds["spatial"] = time.perf_counter() - start
+
+    if graph_metrics:
+        from graph import graph_matches  # needs numpy/scipy, only loaded with graph metrics
+        start = time.perf_counter()
+        result["graph_matches"] = graph_matches(label, model)
+        if instrumentation.current_image is not None:
+            instrumentation.current_image.metric_seconds["graph"] = time.perf_counter() - start
+
+    return result
+
+
+def _is_scorable(model_output, dataset_name, image_key):
+    if isinstance(model_output, dict):
+        return True
+    logger.warning(
+        "Model output%s is %s, not a JSON object; not scored.",
+        f" for {dataset_name}__{image_key}" if image_key else "",
+        "None" if model_output is None else type(model_output).__name__,
+    )
+    return False
+
+
+def _compiled(label_data, normalizer):
+    if isinstance(label_data, CompiledDiagram):
+        return label_data
+    return compile_diagram(label_data, normalizer=normalizer)
+
+
+def evaluate_output(
+    label_data,
+    model_output,
+    dataset_name=None,
+    image_key=None,
+    mapping_dictionary=None,
+    fuzzy_threshold=None,
+    similarity="ngram",
+    normalization=None,
+    metrics=None,
+    iou_threshold=None,
+    text_weight=0.0,
+    graph_metrics=False,
+):
+    """Compare model output to label data using exact and normalized matching.
+    label_data may be a raw label dict or an already compiled CompiledDiagram (compiled
+    with the same normalization). normalization names optional steps of
+    normalization.NORMALIZATION_STEPS added to the base normalization. metrics selects
+    metric and profile names to compute (default: all). iou_threshold and text_weight
+    enable bbox matching and graph_metrics whole-graph similarities (see evaluate_compiled)."""
+
+    if not _is_scorable(model_output, dataset_name, image_key):
+        return None
+
+    start = time.perf_counter()
+    normalizer = get_normalizer(normalization)
+    label = _compiled(label_data, normalizer)
+
+    corrections = text_corrections(mapping_dictionary, dataset_name, image_key) if dataset_name else None
+
+    try:
+        model = compile_diagram(model_output, text_corrections=corrections, normalizer=normalizer)
+        if instrumentation.current_image is not None:
+            instrumentation.current_image.compile_seconds += time.perf_counter() - start
+        result = evaluate_compiled(
+            label,
+            model,
+            fuzzy_threshold=fuzzy_threshold,
+            similarity=similarity,
+            metrics=metrics,
+            iou_threshold=iou_threshold,
+            text_weight=text_weight,
+            graph_metrics=graph_metrics,
+        )
+
+    except Exception as e:
+        logger.error("Error in evaluate_output%s: %s", f" for {dataset_name}__{image_key}" if image_key else "", e)
+        raise
+
+    return result
+
+
+def _recount_node_texts(label, model, result, fuzzy_threshold, similarity, iou_threshold, text_weight):
+    # The result of a model whose node texts were corrected, from the result of the
+    # uncorrected model: only counts that depend on node texts are computed again.
+    result = dict(result)
+    for section, normalize, match_type in (
+        ("exact_matches", False, "exact"),
+        ("normalized_matches", True, "normalized"),
+    ):
+        metrics = [metric for metric in result[section] if metric in NODE_TEXT_METRICS]
+        result[section] = {**result[section], **_count_matches(label, model, metrics, normalize, match_type)}
+    if "node_texts" in result.get("fuzzy_matches", ()):
+        from fuzzy import fuzzy_matches  # needs numpy/scipy, only loaded in fuzzy mode
+        result["fuzzy_matches"] = {
+            **result["fuzzy_matches"],
+            **fuzzy_matches(label, model, fuzzy_threshold, similarity, ("node_texts",)),
+        }
+    if "spatial_matches" in result:
+        from spatial import spatial_matches  # needs numpy, only loaded in spatial mode
+        result["spatial_matches"] = spatial_matches(label, model, iou_threshold, text_weight)
+    # Graph metrics ignore texts, so graph_matches is shared.
+    return result
+
+
+def evaluate_variants(
+    label_data,
+    model_output,
+    mapping_dictionaries,
+    dataset_name=None,
+    image_key=None,
+    fuzzy_threshold=None,
+    similarity="ngram",
+    normalization=None,
+    metrics=None,
+    iou_threshold=None,
+    text_weight=0.0,
+    graph_metrics=False,
+):
+    """Evaluate one model output under several mapping dictionaries in one pass.
+    mapping_dictionaries maps variant names (e.g. "corrected", "uncorrected") to a
+    mapping dictionary or None; returns {variant: evaluate_output result}. The label and
+    the uncorrected model are compiled and matched once. A variant whose corrections
+    change no node text shares that result; otherwise only the node texts are corrected
+    and only the metrics built from them (NODE_TEXT_METRICS) are matched again."""
+
+    if not _is_scorable(model_output, dataset_name, image_key):
+        return dict.fromkeys(mapping_dictionaries)
+
+    start = time.perf_counter()
+    normalizer = get_normalizer(normalization)
+    label = _compiled(label_data, normalizer)
+    model = compile_diagram(model_output, normalizer=normalizer)
+    if instrumentation.current_image is not None:
+        instrumentation.current_image.compile_seconds += time.perf_counter() - start
+    result = evaluate_compiled(
+        label,
+        model,
+        fuzzy_threshold=fuzzy_threshold,
+        similarity=similarity,
+        metrics=metrics,
+        iou_threshold=iou_threshold,
+        text_weight=text_weight,
+        graph_metrics=graph_metrics,
+    )
+
+    results = {}
+    for variant, mapping_dictionary in mapping_dictionaries.items():
+        corrections = text_corrections(mapping_dictionary, dataset_name, image_key) if dataset_name else None
+        corrected = correct_node_texts(model, corrections, normalizer)
+        if corrected is model:
+            results[variant] = result
+        else:
+            results[variant] = _recount_node_texts(
+                label, corrected, result, fuzzy_threshold, similarity, iou_threshold, text_weight
+            )
+    return results
@@ -0,0 +1,214 @@
+"""
+Nearest-neighbor index of training diagrams, for picking few-shot prompt examples.
+
+Every label is described by a fixed-length feature vector made of blocks:
+
+counts    log-scaled node, relation, group, attribute and method counts
+degrees   mean, standard deviation and maximum node degree, share of isolated nodes
+classes   hashed histograms of normalized node and relation classes
+texts     hashed sketch of character trigrams of normalized node texts
+
+Each block is scaled to unit length and weighted by FEATURE_WEIGHTS, and the whole
+vector to unit length, so the dot product of two vectors is their cosine similarity.
+Classes and trigrams are hashed into a fixed number of buckets, so vectors never
+change shape and labels can be added, changed or removed without rebuilding.
+
+An index is persisted next to its split directory as <dir>.examples.npz. A query is a
+single matrix-vector product and a partial sort over the few hundred rows of a split.
+Queries can be any diagram: a test label when studying example selection, or a first
+zero-shot output of the model when choosing examples at inference time.
+"""
+import math
+import os
+import zlib
+
+import numpy as np
+
+from diagram import compile_diagram
+from label_store import open_label_store
+
+INDEX_SUFFIX = ".examples.npz"
+FEATURE_VERSION = 1
+CLASS_BUCKETS = 32
+TEXT_BUCKETS = 128
+FEATURE_WEIGHTS = {"counts": 1.0, "degrees": 0.5, "classes": 1.0, "texts": 0.5}
+
+_BLOCKS = (
+    ("counts", 5),
+    ("degrees", 4),
+    ("classes", 2 * CLASS_BUCKETS),
+    ("texts", TEXT_BUCKETS),
+)
+FEATURE_SIZE = sum(size for _, size in _BLOCKS)
+
+
+def index_path(labels_dir):
+    """Location of the example index of a label split directory: a sibling file <dir>.examples.npz."""
+    return os.path.normpath(labels_dir) + INDEX_SUFFIX
+
+
+def _bucket(value, buckets):
+    # crc32 is stable across processes, unlike hash().
+    return zlib.crc32(value.encode("utf-8")) % buckets
+
+
+def diagram_features(data):
+    """Feature vector (float32, length FEATURE_SIZE) of a diagram dict or CompiledDiagram."""
+    diagram = compile_diagram(data) if isinstance(data, dict) else data
+    blocks = {}
+
+    blocks["counts"] = np.log1p(
+        [
+            diagram.node_count,
+            diagram.relation_count,
+            diagram.group_count,
+            diagram.attribute_count,
+            diagram.method_count,
+        ]
+    )
+
+    degrees = np.zeros(diagram.node_count)
+    endpoints = np.array(diagram.rel_tails + diagram.rel_heads, dtype=np.intp)
+    np.add.at(degrees, endpoints[endpoints >= 0], 1)
+    if diagram.node_count:
+        blocks["degrees"] = np.array(
+            [degrees.mean(), degrees.std(), math.log1p(degrees.max()), float((degrees == 0).mean())]
+        )
+    else:
+        blocks["degrees"] = np.zeros(4)
+
+    classes = np.zeros(2 * CLASS_BUCKETS)
+    for value in diagram.node_classes_norm:
+        classes[_bucket(value, CLASS_BUCKETS)] += 1
+    for value in diagram.rel_classes_norm:
+        classes[CLASS_BUCKETS + _bucket(value, CLASS_BUCKETS)] += 1
+    blocks["classes"] = classes
+
+    texts = np.zeros(TEXT_BUCKETS)
+    for text in diagram.node_texts_norm:
+        padded = f"\x02{text}\x03"
+        for i in range(max(1, len(padded) - 2)):
+            texts[_bucket(padded[i:i + 3], TEXT_BUCKETS)] += 1
+    # Square roots keep long texts from dominating the sketch.
+    blocks["texts"] = np.sqrt(texts)
+
+    vector = np.concatenate([_unit(blocks[name]) * FEATURE_WEIGHTS[name] for name, _ in _BLOCKS])
+    return _unit(vector).astype(np.float32)
+
+
+def _unit(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class ExampleIndex:
+    """
+    Feature vectors of the labels of one split, by image key.
+
+    build() and update() read labels through a label store (directory or pack);
+    update() only recomputes labels whose source digest changed, and drops removed ones.
+    """
+
+    def __init__(self, image_keys=(), digests=(), vectors=None):
+        self._assign(image_keys, digests, vectors)
+
+    def _assign(self, image_keys, digests, vectors):
+        self.image_keys = list(image_keys)
+        self.digests = list(digests)
+        if vectors is None:
+            vectors = np.zeros((0, FEATURE_SIZE), dtype=np.float32)
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self._rows = {key: row for row, key in enumerate(self.image_keys)}
+
+    def __len__(self):
+        return len(self.image_keys)
+
+    def __contains__(self, image_key):
+        return image_key in self._rows
+
+    @classmethod
+    def build(cls, labels_dir, packed=False):
+        index = cls()
+        index.update(labels_dir, packed)
+        return index
+
+    def update(self, labels_dir, packed=False):
+        """Bring the index in line with a split; returns (added, changed, removed) counts."""
+        store = open_label_store(labels_dir, packed)
+        try:
+            keys = store.keys()
+            current = set(keys)
+            removed = [key for key in self.image_keys if key not in current]
+            fresh = {}
+            for key in keys:
+                digest = store.digest(key)
+                row = self._rows.get(key)
+                if row is None or self.digests[row] != digest:
+                    fresh[key] = (digest, diagram_features(store.load(key)))
+        finally:
+            store.close()
+
+        added = sum(key not in self._rows for key in fresh)
+        if fresh or removed:
+            rows = {key: (self.digests[row], self.vectors[row]) for key, row in self._rows.items() if key in current}
+            rows.update(fresh)
+            self._assign(
+                keys,
+                [rows[key][0] for key in keys],
+                np.stack([rows[key][1] for key in keys]) if keys else None,
+            )
+        return added, len(fresh) - added, len(removed)
+
+    def nearest(self, query, k=2, exclude=()):
+        """
+        The k most similar indexed labels to a diagram (dict or CompiledDiagram) or a
+        feature vector, as [(image_key, cosine similarity)], most similar first.
+        Image keys in exclude are never returned, e.g. the query image itself.
+        """
+        vector = query if isinstance(query, np.ndarray) else diagram_features(query)
+        scores = self.vectors @ vector
+        for key in exclude:
+            row = self._rows.get(key)
+            if row is not None:
+                scores[row] = -np.inf
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(self.image_keys[row], float(scores[row])) for row in top.tolist() if scores[row] > -np.inf]
+
+    def save(self, path):
+        """Write the index atomically, so a running prompt builder never reads a partial file."""
+        temporary = f"{path}.tmp{os.getpid()}.npz"
+        np.savez(
+            temporary,
+            version=np.array(FEATURE_VERSION),
+            image_keys=np.array(self.image_keys, dtype=str),
+            digests=np.array(self.digests, dtype=str),
+            vectors=self.vectors,
+        )
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            version = int(data["version"])
+            if version != FEATURE_VERSION:
+                raise ValueError(f"{path} has feature version {version}, expected {FEATURE_VERSION}; rebuild it.")
+            return cls(data["image_keys"].tolist(), data["digests"].tolist(), data["vectors"])
+
+
+def open_example_index(labels_dir, packed=False, refresh=True):
+    """
+    The saved index of a split, built on first use; with refresh, labels changed since it
+    was saved are re-indexed and the index is saved again.
+    """
+    path = index_path(labels_dir)
+    saved = os.path.isfile(path)
+    index = ExampleIndex.load(path) if saved else ExampleIndex()
+    if refresh or not saved:
+        changes = index.update(labels_dir, packed)
+        if any(changes) or not saved:
+            index.save(path)
+    return index
@@ -0,0 +1,118 @@
+from collections import Counter
+
+import numpy as np
+
+from matching import SIMILARITIES
+
+# Texts compared in fuzzy mode, by metric: normalized node texts, edge labels and group names.
+FUZZY_FIELDS = {
+    "node_texts": "node_texts_norm",
+    "arrow_labels": "rel_labels_norm",
+    "group_names": "group_names_norm",
+}
+
+
+def ngram_sets(texts, n):
+    """Sets of the character n-grams of each text, padded with start and end markers."""
+    sets = []
+    for text in texts:
+        padded = f"\x02{text}\x03"
+        sets.append({padded[i:i + n] for i in range(max(1, len(padded) - n + 1))})
+    return sets
+
+
+def ngram_similarity_matrix(label_texts, model_texts, n=3):
+    """
+    Dice similarity of character n-gram sets for every (label, model) pair.
+
+    The n-gram sets of both sides are encoded as binary sparse matrices over a
+    shared vocabulary; all pairwise overlaps come from one sparse matrix product.
+    """
+    from scipy.sparse import csr_matrix
+
+    vocabulary = {}
+
+    def encode(texts):
+        indptr, indices = [0], []
+        for grams in ngram_sets(texts, n):
+            indices.extend(vocabulary.setdefault(gram, len(vocabulary)) for gram in grams)
+            indptr.append(len(indices))
+        return indptr, indices
+
+    label_ptr, label_idx = encode(label_texts)
+    model_ptr, model_idx = encode(model_texts)
+    shape = len(vocabulary)
+    label_matrix = csr_matrix((np.ones(len(label_idx), dtype=np.float32), label_idx, label_ptr), shape=(len(label_texts), shape))
+    model_matrix = csr_matrix((np.ones(len(model_idx), dtype=np.float32), model_idx, model_ptr), shape=(len(model_texts), shape))
+
+    overlap = (label_matrix @ model_matrix.T).toarray()
+    sizes = np.diff(label_matrix.indptr)[:, None] + np.diff(model_matrix.indptr)[None, :]
+    return 2.0 * overlap / sizes
+
+
+def levenshtein_similarity_matrix(label_texts, model_texts):
+    """Normalized Levenshtein similarity (1 - distance / max length) for every pair; needs rapidfuzz."""
+    try:
+        from rapidfuzz.distance import Levenshtein
+        from rapidfuzz.process import cdist
+    except ImportError as e:
+        raise ImportError("Levenshtein similarity requires the rapidfuzz package.") from e
+    return cdist(label_texts, model_texts, scorer=Levenshtein.normalized_similarity, dtype=np.float32, workers=-1)
+
+
+def similarity_matrix(label_texts, model_texts, similarity="ngram"):
+    if similarity == "ngram":
+        return ngram_similarity_matrix(label_texts, model_texts)
+    if similarity == "levenshtein":
+        return levenshtein_similarity_matrix(label_texts, model_texts)
+    raise ValueError(f"Unknown similarity {similarity!r}; expected one of {SIMILARITIES}.")
+
+
+def _exact_prepass(label_texts, model_texts):
+    """Pair identical texts first; returns (exact matches, unmatched label texts, unmatched model texts)."""
+    label_counts, model_counts = Counter(label_texts), Counter(model_texts)
+    common = label_counts & model_counts
+    return sum(common.values()), list((label_counts - common).elements()), list((model_counts - common).elements())
+
+
+def assign_fuzzy_pairs(label_texts, model_texts, threshold, similarity="ngram"):
+    """
+    Optimal one-to-one assignment between two text lists; returns [(label_index, model_index, score)].
+
+    Only pairs scoring at least threshold are admissible. The assignment maximizes the
+    number of admissible pairs first and their total similarity second.
+    """
+    if not label_texts or not model_texts:
+        return []
+    from scipy.optimize import linear_sum_assignment
+
+    scores = similarity_matrix(label_texts, model_texts, similarity)
+    admissible = scores >= threshold
+    if not admissible.any():
+        return []
+
+    # Every admissible pair is worth more than any similarity gain, so cardinality wins.
+    weights = np.where(admissible, scores + min(scores.shape) + 1, 0.0)
+    rows, columns = linear_sum_assignment(weights, maximize=True)
+    return [(int(r), int(c), float(scores[r, c])) for r, c in zip(rows, columns) if admissible[r, c]]
+
+
+def count_fuzzy_matches(label_texts, model_texts, threshold, similarity="ngram"):
+    """
+    Count one-to-one matches between two text lists, allowing near misses.
+
+    Identical texts are paired by a linear-time exact pre-pass; only the leftovers get a
+    similarity matrix and an optimal assignment.
+    """
+    exact, label_rest, model_rest = _exact_prepass(label_texts, model_texts)
+    return exact + len(assign_fuzzy_pairs(label_rest, model_rest, threshold, similarity))
+
+
+def fuzzy_matches(label, model, threshold, similarity="ngram", metrics=None):
+    """Fuzzy match counts of node texts, edge labels and group names between two CompiledDiagrams
+    (only those in metrics, if given)."""
+    return {
+        metric: count_fuzzy_matches(getattr(label, field), getattr(model, field), threshold, similarity)
+        for metric, field in FUZZY_FIELDS.items()
+        if metrics is None or metric in metrics
+    }
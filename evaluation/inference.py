@@ -0,0 +1,453 @@
+"""
+Running a model over a dataset split through an OpenAI-compatible chat completions API.
+
+Prompts come from prompts/*.txt. Their placeholders are filled per dataset:
+{diagram_type}, {allowed_node_classes}, {allowed_relation_classes} and
+{allowed_group_classes} (the classes seen in the dataset's training labels), and
+<ground_truth1>, <ground_truth2> with the JSON of few-shot example labels. Each <image>
+marker becomes an image part of the user message: the examples' images in order, then
+the image to extract.
+
+InferenceRunner sends the requests with a bounded number in flight and an optional
+requests-per-second limit, retries connection errors, timeouts, 429 and 5xx responses
+with exponential backoff (honoring Retry-After), and keeps responses in an on-disk
+cache keyed by the hashes of the rendered prompt and images, the model and the request
+parameters. Variants that render to the same prompt share cached responses, and a rerun
+only sends requests that have not been answered yet.
+
+Only the standard library is used: requests go over asyncio streams, one connection
+per request, so any local stub server can stand in for the endpoint.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import ssl
+import time
+from urllib.parse import urlsplit
+
+import corpus
+from cache import ResultCache, canonical_json
+from corpus import CorpusResult, evaluate_chunk
+from instrumentation import logger
+from normalization import correction_key
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prompts")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif")
+IMAGE_MEDIA_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".gif": "image/gif",
+}
+
+# Diagram type named in the prompts, by dataset.
+DIAGRAM_TYPES = {
+    "cbd": "flowchart",
+    "didi": "flowchart",
+    "fa": "flowchart",
+    "fc_a": "flowchart",
+    "hdBPMN-icdar2021": "BPMN",
+    "sap-sam-bpmn": "BPMN",
+    "sap-sam-uml": "UML class",
+}
+UML_DATASETS = ("sap-sam-uml",)
+
+_PLACEHOLDER = re.compile(r"\{(diagram_type|allowed_node_classes|allowed_relation_classes|allowed_group_classes)\}")
+_GROUND_TRUTH = re.compile(r"<ground_truth(\d+)>")
+IMAGE_MARKER = "<image>"
+
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+def prompt_path(variant, dataset, prompts_dir=PROMPTS_DIR):
+    """prompts/<variant>.txt, or <variant>_uml.txt for UML datasets when it exists."""
+    if dataset in UML_DATASETS:
+        path = os.path.join(prompts_dir, f"{variant}_uml.txt")
+        if os.path.isfile(path):
+            return path
+    return os.path.join(prompts_dir, f"{variant}.txt")
+
+
+def dataset_classes(labels):
+    """Sorted node, relation and group classes used in a set of labels."""
+    classes = (set(), set(), set())
+    for label in labels:
+        for kind, section in zip(classes, ("nodes", "relations", "groups")):
+            kind.update(
+                element["class"] for element in label.get(section) or [] if isinstance(element.get("class"), str)
+            )
+    return tuple(sorted(kind) for kind in classes)
+
+
+def example_count(template):
+    """Number of <ground_truthN> placeholders of a prompt template."""
+    return len(set(_GROUND_TRUTH.findall(template)))
+
+
+def render_prompt(template, diagram_type, node_classes, relation_classes, group_classes, examples=()):
+    """
+    Fill a prompt template; returns its text segments around the <image> markers
+    (one more segment than there are images).
+
+    The templates escape literal braces as {{ }} in str.format style, but also contain
+    single braces, so only the known placeholders are substituted.
+    """
+    values = {
+        "diagram_type": diagram_type,
+        "allowed_node_classes": ", ".join(node_classes),
+        "allowed_relation_classes": ", ".join(relation_classes),
+        "allowed_group_classes": ", ".join(group_classes) or "none",
+    }
+    text = _PLACEHOLDER.sub(lambda match: values[match.group(1)], template)
+    text = text.replace("{{", "{").replace("}}", "}")
+
+    def ground_truth(match):
+        index = int(match.group(1)) - 1
+        if index >= len(examples):
+            raise ValueError(f"The prompt needs {match.group(0)} but only {len(examples)} examples were given.")
+        return json.dumps(examples[index], ensure_ascii=False, indent=2)
+
+    return _GROUND_TRUTH.sub(ground_truth, text).split(IMAGE_MARKER)
+
+
+def find_image(images_dir, image_key):
+    """The image file of a label (same stem, any of IMAGE_EXTENSIONS), or None."""
+    stem = os.path.splitext(image_key)[0]
+    for extension in IMAGE_EXTENSIONS:
+        path = os.path.join(images_dir, stem + extension)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+class ImageFile:
+    """An image on disk. Its bytes are read when needed and not kept, so queued requests stay small."""
+
+    def __init__(self, path):
+        self.path = path
+        self.media_type = IMAGE_MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "image/png")
+        self._digest = None
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.read()).hexdigest()
+        return self._digest
+
+    def data_url(self):
+        return f"data:{self.media_type};base64,{base64.b64encode(self.read()).decode('ascii')}"
+
+
+class InferenceRequest:
+    """One image to extract: prompt segments and the images that go between them."""
+
+    def __init__(self, dataset, image_key, segments, images):
+        if len(segments) != len(images) + 1:
+            raise ValueError(
+                f"{dataset}__{image_key}: the prompt has {len(segments) - 1} <image> markers for {len(images)} images."
+            )
+        self.dataset = dataset
+        self.image_key = image_key
+        self.segments = segments
+        self.images = images
+
+    def prompt_digest(self):
+        return hashlib.sha256(canonical_json(self.segments)).hexdigest()
+
+    def messages(self):
+        content = []
+        for segment, image in zip(self.segments, self.images + [None]):
+            if segment.strip():
+                content.append({"type": "text", "text": segment})
+            if image is not None:
+                content.append({"type": "image_url", "image_url": {"url": image.data_url()}})
+        return [{"role": "user", "content": content}]
+
+
+def response_key(request, model, params):
+    """Cache key of a response: rendered prompt, images, model and request parameters."""
+    digest = hashlib.sha256()
+    parts = (request.prompt_digest(), [image.digest for image in request.images], model, params or {})
+    for part in parts:
+        part = canonical_json(part)
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class EndpointError(Exception):
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ChatClient:
+    """Minimal async client for POST <base_url>/chat/completions."""
+
+    def __init__(self, base_url, api_key=None, timeout=600.0):
+        parts = urlsplit(base_url.rstrip("/"))
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported endpoint URL {base_url!r}.")
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.path = f"{parts.path}/chat/completions"
+        self.api_key = api_key
+        self.timeout = timeout
+
+    async def complete(self, body):
+        """The parsed JSON response; raises EndpointError for non-2xx responses."""
+        return await asyncio.wait_for(self._post(json.dumps(body).encode("utf-8")), self.timeout)
+
+    async def _post(self, data):
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        try:
+            headers = [
+                f"POST {self.path} HTTP/1.1",
+                f"Host: {self.host}:{self.port}",
+                "Content-Type: application/json",
+                f"Content-Length: {len(data)}",
+                "Connection: close",
+            ]
+            if self.api_key:
+                headers.append(f"Authorization: Bearer {self.api_key}")
+            writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + data)
+            await writer.drain()
+
+            status_line = await reader.readline()
+            try:
+                status = int(status_line.split()[1])
+            except (IndexError, ValueError):
+                # Retried like a dropped connection: a flaky proxy can garble a response.
+                raise ValueError(f"Malformed status line {status_line[:80]!r}.") from None
+            response_headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                response_headers[name.strip().lower()] = value.strip()
+
+            if "chunked" in response_headers.get("transfer-encoding", "").lower():
+                body = bytearray()
+                while True:
+                    size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+                    if size == 0:
+                        break
+                    body += await reader.readexactly(size)
+                    await reader.readline()
+            elif "content-length" in response_headers:
+                body = await reader.readexactly(int(response_headers["content-length"]))
+            else:
+                body = await reader.read()
+        finally:
+            writer.close()
+
+        if not 200 <= status < 300:
+            retry_after = response_headers.get("retry-after")
+            try:
+                retry_after = float(retry_after) if retry_after is not None else None
+            except ValueError:
+                retry_after = None
+            raise EndpointError(status, bytes(body[:500]).decode("utf-8", "replace"), retry_after)
+        return json.loads(body)
+
+
+class RateLimiter:
+    """Spaces request starts at least 1 / rate seconds apart (no limit when rate is None)."""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class InferenceRunner:
+    """
+    Sends InferenceRequests to a ChatClient. run() yields (request, output, cached) as
+    responses complete, output being the message text or None after the last failed
+    attempt; at most concurrency requests are in flight.
+    """
+
+    def __init__(
+        self,
+        client,
+        model,
+        params=None,
+        cache_options=None,
+        concurrency=8,
+        rate=None,
+        max_retries=5,
+        backoff=1.0,
+    ):
+        self.client = client
+        self.model = model
+        self.params = params or {}
+        self.cache = ResultCache(**cache_options) if cache_options else None
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.cached = 0
+
+    async def _complete(self, request):
+        body = {"model": self.model, "messages": request.messages(), **self.params}
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.wait()
+            self.sent += 1
+            try:
+                response = await self.client.complete(body)
+                return response["choices"][0]["message"]["content"]
+            except EndpointError as e:
+                if e.status not in RETRY_STATUSES or attempt == self.max_retries:
+                    raise
+                delay = e.retry_after
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, KeyError, IndexError) as e:
+                if attempt == self.max_retries:
+                    raise EndpointError(0, f"{type(e).__name__}: {e}") from e
+                delay = None
+            self.retried += 1
+            if delay is None:
+                delay = self.backoff * 2**attempt * (0.5 + random.random())
+            await asyncio.sleep(delay)
+
+    async def _run_one(self, request):
+        key = response_key(request, self.model, self.params)
+        if self.cache is not None:
+            output = self.cache.get(key)
+            if output is not None:
+                self.cached += 1
+                return request, output, True
+        try:
+            output = await self._complete(request)
+        except EndpointError as e:
+            self.failed += 1
+            logger.error("Inference failed for %s__%s: %s", request.dataset, request.image_key, e)
+            return request, None, False
+        if self.cache is not None and isinstance(output, str):
+            self.cache.put(key, output)
+        return request, output, False
+
+    async def run(self, requests):
+        requests = iter(requests)
+        pending = set()
+        while True:
+            while len(pending) < self.concurrency:
+                request = next(requests, None)
+                if request is None:
+                    break
+                pending.add(asyncio.ensure_future(self._run_one(request)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+
+def dataset_requests(dataset, image_keys, images_dir, segments, example_images=(), prompts=None):
+    """
+    InferenceRequests of a dataset's images with one rendered prompt; returns (requests,
+    image keys without an image file). prompts ({image_key: (segments, example_images)})
+    overrides the prompt of single images, e.g. with few-shot examples picked per image.
+    A prompt without a marker for the image to extract gets it after its text.
+    """
+    requests, missing = [], []
+    for image_key in image_keys:
+        path = find_image(images_dir, image_key)
+        if path is None:
+            missing.append(image_key)
+            continue
+        image_segments, image_examples = (prompts or {}).get(image_key, (segments, example_images))
+        if len(image_segments) == len(image_examples) + 1:
+            image_segments = list(image_segments) + [""]
+        requests.append(
+            InferenceRequest(dataset, image_key, image_segments, list(image_examples) + [ImageFile(path)])
+        )
+    return requests, missing
+
+
+async def infer_and_score(
+    runner,
+    requests,
+    label_dirs,
+    run_id,
+    predictions_path,
+    missing=(),
+    mapping_dictionary=None,
+    evaluation_options=None,
+    packed=False,
+    workers=1,
+):
+    """
+    Run requests and score every response as it arrives; returns {(dataset, run_id):
+    CorpusResult}. Responses are appended to predictions_path as JSONL prediction records,
+    so the file can be rescored with `score`. (dataset, image_key) pairs in missing (no
+    image) and failed requests are scored as missing predictions.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    loop = asyncio.get_running_loop()
+    results = {}
+
+    def collect(chunk_results):
+        for key, image_key, counts, status, cached, _, _ in chunk_results:
+            result = results.get(key)
+            if result is None:
+                result = results[key] = CorpusResult()
+            result.add(image_key, counts, status, cached)
+
+    directory = os.path.dirname(predictions_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=corpus._init_pool_worker,
+        initargs=(label_dirs, mapping_dictionary, None, evaluation_options, packed),
+    ) as executor, open(predictions_path, "w", encoding="utf-8") as out:
+        scoring = set()
+
+        def score(dataset, image_key, output):
+            record = {"image_key": correction_key(dataset, image_key), "run_id": run_id, "output": output}
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            scoring.add(loop.run_in_executor(executor, evaluate_chunk, [(dataset, run_id, image_key, output)]))
+
+        for dataset, image_key in missing:
+            score(dataset, image_key, None)
+        async for request, output, _ in runner.run(requests):
+            score(request.dataset, request.image_key, output)
+            out.flush()
+            done = {future for future in scoring if future.done()}
+            for future in done:
+                collect(future.result())
+            scoring -= done
+        for chunk_results in await asyncio.gather(*scoring):
+            collect(chunk_results)
+    return results
@@ -0,0 +1,165 @@
+"""
+Opt-in instrumentation of corpus scoring.
+
+Worker side: when a run enables it, evaluate_image starts an ImageTimer before each
+image; evaluate_output and evaluate_compiled add compile and per-metric wall times to
+current_image. With instrumentation off, current_image stays None and the only cost
+is that check.
+
+Parent side: Telemetry receives one record per image, appends it to a JSON lines file
+and aggregates counters that are written as a Prometheus textfile at the end of the run.
+"""
+import json
+import logging
+import os
+import time
+
+from normalization import memo_stats
+
+logger = logging.getLogger("evaluation")
+
+# ImageTimer of the image being evaluated in this process, None when instrumentation is off.
+current_image = None
+
+PROMETHEUS_PREFIX = "diagram_evaluation"
+ELEMENT_KINDS = ("nodes", "relations", "groups", "attributes", "methods")
+
+
+class ImageTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.compile_seconds = 0.0
+        self.metric_seconds = {}
+        self.memo_start = memo_stats()
+
+
+def start_image():
+    global current_image
+    current_image = ImageTimer()
+    return current_image
+
+
+def finish_image(timer, image_key, status, cached, result):
+    """The record of one image: status, input sizes, total, compile and per-metric wall times."""
+    global current_image
+    current_image = None
+    hits, misses = memo_stats()
+    record = {
+        "image_key": image_key,
+        "status": status,
+        "cached": cached,
+        "seconds": time.perf_counter() - timer.start,
+        "compile_seconds": timer.compile_seconds,
+        "metric_seconds": timer.metric_seconds,
+        "normalize_memo_hits": hits - timer.memo_start[0],
+        "normalize_memo_misses": misses - timer.memo_start[1],
+    }
+    if result is not None:
+        record["label"] = {kind: result["label"][kind] for kind in ELEMENT_KINDS}
+        record["model"] = {kind: result["model"][kind] for kind in ELEMENT_KINDS}
+    return record
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in sorted(labels.items())) + "}"
+
+
+class Telemetry:
+    """
+    Aggregated instrumentation of a scoring run.
+
+    Every record passed to add is written as one line of jsonl_path (if given);
+    close() writes the counters to prometheus_path (if given) in the Prometheus text
+    exposition format, atomically so a node_exporter textfile collector never reads a
+    partial file.
+    """
+
+    def __init__(self, jsonl_path=None, prometheus_path=None):
+        self.prometheus_path = prometheus_path
+        self._jsonl = None
+        if jsonl_path:
+            os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+            self._jsonl = open(jsonl_path, "w", encoding="utf-8")
+        self.started = time.time()
+        self.images = {}
+        self.cached = 0
+        self.seconds = 0.0
+        self.compile_seconds = 0.0
+        self.metric_seconds = {}
+        self.elements = {}
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self.slowest_seconds = 0.0
+        self.slowest_image = None
+
+    def add(self, record):
+        key = (record.get("dataset"), record["status"])
+        self.images[key] = self.images.get(key, 0) + 1
+        self.cached += record["cached"]
+        self.seconds += record["seconds"]
+        self.compile_seconds += record["compile_seconds"]
+        for metric, seconds in record["metric_seconds"].items():
+            self.metric_seconds[metric] = self.metric_seconds.get(metric, 0.0) + seconds
+        for side in ("label", "model"):
+            for kind, count in (record.get(side) or {}).items():
+                self.elements[(side, kind)] = self.elements.get((side, kind), 0) + count
+        self.memo_hits += record["normalize_memo_hits"]
+        self.memo_misses += record["normalize_memo_misses"]
+        if record["seconds"] > self.slowest_seconds:
+            self.slowest_seconds = record["seconds"]
+            self.slowest_image = record["image_key"]
+        if self._jsonl is not None:
+            self._jsonl.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    @property
+    def total_images(self):
+        return sum(self.images.values())
+
+    def prometheus_text(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        metrics = [
+            ("images_total", "counter", "Images scored, by dataset and status.",
+             [(_labels(dataset=dataset, status=status), count) for (dataset, status), count in sorted(self.images.items())]),
+            ("result_cache_hits_total", "counter", "Images whose result came from the on-disk cache.",
+             [("", self.cached)]),
+            ("result_cache_misses_total", "counter", "Images that were evaluated.",
+             [("", self.total_images - self.cached)]),
+            ("normalize_memo_hits_total", "counter", "Normalization memo hits.", [("", self.memo_hits)]),
+            ("normalize_memo_misses_total", "counter", "Normalization memo misses.", [("", self.memo_misses)]),
+            ("image_seconds_total", "counter", "Wall time spent per image, summed over images.", [("", self.seconds)]),
+            ("compile_seconds_total", "counter", "Wall time spent compiling diagrams.", [("", self.compile_seconds)]),
+            ("metric_seconds_total", "counter", "Wall time spent per metric, summed over images.",
+             [(_labels(metric=metric), seconds) for metric, seconds in sorted(self.metric_seconds.items())]),
+            ("elements_total", "counter", "Diagram elements scored, by side and kind.",
+             [(_labels(side=side, kind=kind), count) for (side, kind), count in sorted(self.elements.items())]),
+            ("slowest_image_seconds", "gauge", "Wall time of the slowest image of the run.", [("", self.slowest_seconds)]),
+            ("run_seconds", "gauge", "Wall time of the run.", [("", elapsed)]),
+            ("images_per_second", "gauge", "Throughput of the run.", [("", self.total_images / elapsed)]),
+            ("last_run_timestamp_seconds", "gauge", "Unix time the run finished.", [("", time.time())]),
+        ]
+        lines = []
+        for name, metric_type, help_text, samples in metrics:
+            name = f"{PROMETHEUS_PREFIX}_{name}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(f"{name}{labels} {value}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self._jsonl is not None:
+            self._jsonl.close()
+            self._jsonl = None
+        if self.prometheus_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.prometheus_path)), exist_ok=True)
+            temporary = f"{self.prometheus_path}.tmp{os.getpid()}"
+            with open(temporary, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+            os.replace(temporary, self.prometheus_path)
+        if self.slowest_image is not None:
+            logger.info("Slowest image: %s (%.3fs)", self.slowest_image, self.slowest_seconds)
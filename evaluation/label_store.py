@@ -0,0 +1,163 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+from cache import file_digest
+from data_loader import decode_json, load_label_data
+
+PACK_SUFFIX = ".pack"
+PACK_MAGIC = b"LBLPACK\x00"
+PACK_VERSION = 1
+# magic, version, index offset, index length
+_HEADER = struct.Struct("<8sIQQ")
+
+
+def pack_path(labels_dir):
+    """Location of the pack of a label split directory: a sibling file <dir>.pack."""
+    return os.path.normpath(labels_dir) + PACK_SUFFIX
+
+
+def _label_names(labels_dir):
+    return sorted(name for name in os.listdir(labels_dir) if name.endswith(".json"))
+
+
+def build_label_pack(labels_dir, path=None):
+    """
+    Pack every label JSON file of a split directory into one file; returns its path.
+
+    The body holds the source files' bytes back to back, followed by a JSON index
+    {image_key: [offset, length, sha256]}. The pack is written to a temporary file
+    and moved into place, so readers never see a partial pack.
+    """
+    path = path or pack_path(labels_dir)
+    entries = {}
+    temporary = f"{path}.tmp{os.getpid()}"
+    with open(temporary, "wb") as out:
+        out.write(_HEADER.pack(PACK_MAGIC, PACK_VERSION, 0, 0))
+        for name in _label_names(labels_dir):
+            with open(os.path.join(labels_dir, name), "rb") as f:
+                data = f.read()
+            entries[name] = [out.tell(), len(data), hashlib.sha256(data).hexdigest()]
+            out.write(data)
+
+        index_offset = out.tell()
+        index = json.dumps({"entries": entries}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        out.write(index)
+        out.seek(0)
+        out.write(_HEADER.pack(PACK_MAGIC, PACK_VERSION, index_offset, len(index)))
+    os.replace(temporary, path)
+    return path
+
+
+class LabelDirectory:
+    """Labels read from a split directory of JSON files, one per image."""
+
+    def __init__(self, labels_dir):
+        self.labels_dir = labels_dir
+        self._keys = None
+
+    def keys(self):
+        if self._keys is None:
+            self._keys = _label_names(self.labels_dir)
+        return self._keys
+
+    def __contains__(self, image_key):
+        return os.path.isfile(os.path.join(self.labels_dir, image_key))
+
+    def load(self, image_key):
+        return load_label_data(os.path.join(self.labels_dir, image_key))
+
+    def digest(self, image_key):
+        return file_digest(os.path.join(self.labels_dir, image_key))
+
+    def close(self):
+        pass
+
+
+class LabelPack:
+    """
+    Labels read from a pack built by build_label_pack.
+
+    The file is memory-mapped and only its index is parsed on open; each label is
+    decoded when it is loaded. With verify=True (the default) the bytes of a label are
+    checked against the checksum its source file had when the pack was built.
+    """
+
+    def __init__(self, path, verify=True):
+        self.path = path
+        self.verify = verify
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            raise ValueError(f"{path} is not a label pack.")
+        magic, version, index_offset, index_length = _HEADER.unpack_from(self._map, 0)
+        if magic != PACK_MAGIC:
+            raise ValueError(f"{path} is not a label pack.")
+        if version != PACK_VERSION:
+            raise ValueError(f"{path} has pack version {version}, expected {PACK_VERSION}; rebuild it.")
+        self._entries = json.loads(self._map[index_offset:index_offset + index_length])["entries"]
+
+    def keys(self):
+        return sorted(self._entries)
+
+    def __contains__(self, image_key):
+        return image_key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def raw(self, image_key):
+        """The source file bytes of a label."""
+        offset, length, digest = self._entries[image_key]
+        data = self._map[offset:offset + length]
+        if self.verify and hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"{self.path}: checksum mismatch for {image_key}; rebuild the pack.")
+        return data
+
+    def load(self, image_key):
+        return decode_json(self.raw(image_key))
+
+    def digest(self, image_key):
+        """sha256 of the label's source file, as recorded when the pack was built."""
+        return self._entries[image_key][2]
+
+    def stale_entries(self, labels_dir):
+        """
+        Compare the pack with its source directory; returns sorted (image_key, problem)
+        pairs for labels that were changed, added or removed since the pack was built.
+        """
+        source = LabelDirectory(labels_dir)
+        source_keys = set(source.keys())
+        problems = [(key, "removed") for key in self._entries if key not in source_keys]
+        for key in source_keys:
+            if key not in self._entries:
+                problems.append((key, "added"))
+            elif source.digest(key) != self.digest(key):
+                problems.append((key, "changed"))
+        return sorted(problems)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+def open_label_store(labels_dir, packed=False):
+    """A LabelPack of labels_dir if packed, else a LabelDirectory."""
+    if not packed:
+        return LabelDirectory(labels_dir)
+    path = pack_path(labels_dir)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"No label pack at {path}; build it with `python -m evaluation pack`.")
+    return LabelPack(path)
+
+
+def label_split_dirs(labels_root):
+    """Every directory under labels_root that directly contains label JSON files."""
+    return sorted(
+        directory
+        for directory, _, names in os.walk(os.path.normpath(labels_root))
+        if any(name.endswith(".json") for name in names)
+    )
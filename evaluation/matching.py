@@ -1,403 +1,377 @@
-from utils import normalize_string
-from data_loader import build_id_to_text_map
-
-def count_field_matches(label_items, model_items, field, normalize=True):
-    """
-    Count exact matches (normalized) between label and model items for a given field.
-    """
-    matches = 0
-    model_values = [normalize_string(item.get(field)) if normalize else item.get(field, "") for item in model_items]
-    used_indices = set()
-
-    for label_item in label_items:
-        label_value = normalize_string(label_item.get(field)) if normalize else label_item.get(field, "")
-        for i, model_value in enumerate(model_values):
-            if i in used_indices:
-                continue
-
-            if label_value == "" and model_value == "":
-                matches += 1
-                used_indices.add(i)
-                break
-
-            if label_value == model_value:
-                matches += 1
-                used_indices.add(i)
-                break
-
-    return matches
-
-
-def count_arrow_path_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=True):
-    """
-    Count matches for arrow paths (head and tail nodes) between label and model relations.
-    Matching is done by exact equality of normalized node texts.
-    """
-    label_id_to_text = build_id_to_text_map(label_nodes, normalize=normalize)
-    model_id_to_text = build_id_to_text_map(model_nodes, normalize=normalize)
-
-    matches = 0
-    used = set()
-
-    for l in label_rels:
-        label_head = normalize_string(label_id_to_text.get(l.get("head"), "")) if normalize else label_id_to_text.get(l.get("head"), "")
-        label_tail = normalize_string(label_id_to_text.get(l.get("tail"), "")) if normalize else label_id_to_text.get(l.get("tail"), "")
-
-        for i, m in enumerate(model_rels):
-            if i in used:
-                continue
-
-            model_head = normalize_string(model_id_to_text.get(m.get("head"), "")) if normalize else model_id_to_text.get(m.get("head"), "")
-            model_tail = normalize_string(model_id_to_text.get(m.get("tail"), "")) if normalize else model_id_to_text.get(m.get("tail"), "")
-
-            if label_head == model_head and label_tail == model_tail:
-                matches += 1
-                used.add(i)
-                break
-
-    return matches
-
-def match_node_text_sets(label_list, model_list):
-    """
-    Compare two lists of node texts to check if they contain the same values (unordered).
-    Each label text must match one distinct model text.
-    """
-    if not label_list and not model_list:
-        return True
-
-    if len(label_list) != len(model_list):
-        return False
-
-    used_indices = set()
-    for l_text in label_list:
-        found = False
-        for i, m_text in enumerate(model_list):
-            if i in used_indices:
-                continue
-            if l_text == m_text:
-                used_indices.add(i)
-                found = True
-                break
-        if not found:
-            return False
-
-    return True
-
-
-def count_group_node_matches(label_groups, model_groups, label_nodes, model_nodes, normalize=False):
-    """
-    Count how many label groups have a matching group in the model
-    with the same set of node texts (unordered exact match).
-    """
-    label_text_map = build_id_to_text_map(label_nodes, normalize=normalize)
-    model_text_map = build_id_to_text_map(model_nodes, normalize=normalize)
-    matches = 0
-    used = set()
-
-    for lg in label_groups:
-        label_node_ids = lg.get("nodes", [])
-        label_node_texts = [label_text_map.get(nid, "") for nid in label_node_ids]
-
-        for j, mg in enumerate(model_groups):
-            if j in used:
-                continue
-
-            model_node_ids = mg.get("nodes", [])
-            model_node_texts = [model_text_map.get(nid, "") for nid in model_node_ids]
-
-            if not label_node_texts and not model_node_texts:
-                matches += 1
-                used.add(j)
-                break
-
-            if match_node_text_sets(label_node_texts, model_node_texts):
-                matches += 1
-                used.add(j)
-                break
-
-    return matches
-
-def match_node_text_class_sets(label_nodes, model_nodes, normalize=True):
-    """
-    Compare two sets of (text, class) node pairs for an exact normalized match.
-    """
-    def norm(val):
-        return normalize_string(val) if normalize else val or ""
-
-    label_set = {(norm(n.get("text")), norm(n.get("class"))) for n in label_nodes}
-    model_set = {(norm(n.get("text")), norm(n.get("class"))) for n in model_nodes}
-
-    return label_set == model_set
-
-
-def count_node_text_class_matches(label_nodes, model_nodes, normalize=True):
-    """
-    Count how many (text, class) pairs in label_nodes match with distinct pairs in model_nodes.
-    """
-    matches = 0
-    used_indices = set()
-
-    def norm(val):
-        return normalize_string(val) if normalize else val or ""
-
-    model_pairs = [(norm(n.get("text")), norm(n.get("class"))) for n in model_nodes]
-
-    for label_node in label_nodes:
-        label_pair = (norm(label_node.get("text")), norm(label_node.get("class")))
-        for i, model_pair in enumerate(model_pairs):
-            if i in used_indices:
-                continue
-            if label_pair == model_pair:
-                matches += 1
-                used_indices.add(i)
-                break
-
-    return matches
-
-
-def count_arrow_path_and_label_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=True):
-    """
-    Count matches for arrow paths (head, tail) and relation labels 
-    between label and model relations, using normalized exact matching.
-    """
-    label_id_to_text = build_id_to_text_map(label_nodes, normalize=normalize)
-    model_id_to_text = build_id_to_text_map(model_nodes, normalize=normalize)
-
-    matches = 0
-    used = set()
-
-    for l in label_rels:
-        label_head = normalize_string(label_id_to_text.get(l.get("head"), "")) if normalize else label_id_to_text.get(l.get("head"), "")
-        label_tail = normalize_string(label_id_to_text.get(l.get("tail"), "")) if normalize else label_id_to_text.get(l.get("tail"), "")
-        label_label = normalize_string(l.get("label", "")) if normalize else l.get("label", "")
-
-        for i, m in enumerate(model_rels):
-            if i in used:
-                continue
-
-            model_head = normalize_string(model_id_to_text.get(m.get("head"), "")) if normalize else model_id_to_text.get(m.get("head"), "")
-            model_tail = normalize_string(model_id_to_text.get(m.get("tail"), "")) if normalize else model_id_to_text.get(m.get("tail"), "")
-            model_label = normalize_string(m.get("label", "")) if normalize else m.get("label", "")
-
-            if label_head == model_head and label_tail == model_tail and label_label == model_label:
-                matches += 1
-                used.add(i)
-                break
-
-    return matches
-
-
-def count_full_group_matches(label_groups, model_groups, label_nodes, model_nodes, normalize=True):
-    """
-    Count label groups that match model groups exactly on name, class, and node texts (all normalized).
-    """
-    matches = 0
-    used = set()
-
-    label_text_map = build_id_to_text_map(label_nodes, normalize=normalize)
-    model_text_map = build_id_to_text_map(model_nodes, normalize=normalize)
-
-    for lg in label_groups:
-        lname = normalize_string(lg.get("name", "")) if normalize else lg.get("name", "")
-        lclass = normalize_string(lg.get("class", "")) if normalize else lg.get("class", "")
-        ltexts = [label_text_map.get(nid, "") for nid in lg.get("nodes", [])]
-
-        for j, mg in enumerate(model_groups):
-            if j in used:
-                continue
-
-            mname = normalize_string(mg.get("name", "")) if normalize else mg.get("name", "")
-            mclass = normalize_string(mg.get("class", "")) if normalize else mg.get("class", "")
-            mtexts = [model_text_map.get(nid, "") for nid in mg.get("nodes", [])]
-
-            if not ltexts and not mtexts and lname == mname and lclass == mclass:
-                matches += 1
-                used.add(j)
-                break
-
-            if lname == mname and lclass == mclass and match_node_text_sets(ltexts, mtexts):
-                matches += 1
-                used.add(j)
-                break
-
-    return matches
-
-def count_node_attribute_matches(label_nodes, model_nodes, normalize=True):
-    """Count label nodes whose attribute lists exactly match a model node's, after normalization."""
-    matches = 0
-    used = set()
-
-    def norm(val):
-        return normalize_string(val) if normalize else val or ""
-
-    def norm_list(lst):
-        return sorted([norm(x) for x in lst or []])
-
-    for lnode in label_nodes:
-        lattrs = norm_list(lnode.get("attributes", []))
-
-        for j, mnode in enumerate(model_nodes):
-            if j in used:
-                continue
-
-            mattrs = norm_list(mnode.get("attributes", []))
-
-            if lattrs == mattrs:
-                matches += 1
-                used.add(j)
-                break
-
-    return matches
-
-
-def count_node_method_matches(label_nodes, model_nodes, normalize=True):
-    """Count label nodes whose method lists exactly match a model node's, after normalization."""
-    matches = 0
-    used = set()
-
-    def norm(val):
-        return normalize_string(val) if normalize else val or ""
-
-    def norm_list(lst):
-        return sorted([norm(x) for x in lst or []])
-
-    for lnode in label_nodes:
-        lmeths = norm_list(lnode.get("methods", []))
-
-        for j, mnode in enumerate(model_nodes):
-            if j in used:
-                continue
-
-            mmeths = norm_list(mnode.get("methods", []))
-
-            if lmeths == mmeths:
-                matches += 1
-                used.add(j)
-                break
-
-    return matches
-
-
-def count_node_attribute_method_matches(label_nodes, model_nodes, normalize=True):
-    """
-    Count label nodes that match model nodes exactly on:
-    - text
-    - class
-    - attributes (list)
-    - methods (list)
-    All normalized before comparison.
-    """
-    matches = 0
-    used = set()
-
-    def norm(val):
-        return normalize_string(val) if normalize else val or ""
-
-    def norm_list(lst):
-        return sorted([norm(x) for x in lst or []])
-
-    for lnode in label_nodes:
-        ltext = norm(lnode.get("text"))
-        lclass = norm(lnode.get("class"))
-        lattrs = norm_list(lnode.get("attributes", []))
-        lmeths = norm_list(lnode.get("methods", []))
-
-        for j, mnode in enumerate(model_nodes):
-            if j in used:
-                continue
-
-            mtext = norm(mnode.get("text"))
-            mclass = norm(mnode.get("class"))
-            mattrs = norm_list(mnode.get("attributes", []))
-            mmeths = norm_list(mnode.get("methods", []))
-
-            if ltext == mtext and lclass == mclass and lattrs == mattrs and lmeths == mmeths:
-                matches += 1
-                used.add(j)
-                break
-
-    return matches
-
-def count_cardinality_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=True):
-    """Count matches where only cardinality_start and cardinality_end match between label and model relations."""
-    label_id_to_text = build_id_to_text_map(label_nodes, normalize=normalize)
-    model_id_to_text = build_id_to_text_map(model_nodes, normalize=normalize)
-
-    matches = 0
-    used = set()
-
-    for l in label_rels:
-        label_start = normalize_string(l.get("cardinality_start", "")) if normalize else l.get("cardinality_start", "")
-        label_end = normalize_string(l.get("cardinality_end", "")) if normalize else l.get("cardinality_end", "")
-
-        for i, m in enumerate(model_rels):
-            if i in used:
-                continue
-
-            model_start = normalize_string(m.get("cardinality_start", "")) if normalize else m.get("cardinality_start", "")
-            model_end = normalize_string(m.get("cardinality_end", "")) if normalize else m.get("cardinality_end", "")
-
-            if label_start == model_start and label_end == model_end:
-                matches += 1
-                used.add(i)
-                break
-
-    return matches
-
-def count_arrow_path_label_class_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=True):
-    """
-    Count matches for arrow paths (head/tail), labels, and class values.
-    Includes cardinality fields if present.
-    """
-    label_id_to_text = build_id_to_text_map(label_nodes, normalize=normalize)
-    model_id_to_text = build_id_to_text_map(model_nodes, normalize=normalize)
-
-    matches = 0
-    used = set()
-
-    has_arrow_classes = any("class" in rel and rel["class"] for rel in label_rels)
-    has_cardinality = any("cardinality_start" in rel and rel["cardinality_start"] for rel in label_rels)
-
-    for l in label_rels:
-        label_head = normalize_string(label_id_to_text.get(l.get("head"), "")) if normalize else label_id_to_text.get(l.get("head"), "")
-        label_tail = normalize_string(label_id_to_text.get(l.get("tail"), "")) if normalize else label_id_to_text.get(l.get("tail"), "")
-        label_label = normalize_string(l.get("label", "")) if normalize else l.get("label", "")
-        label_class = normalize_string(l.get("class", "")) if normalize else l.get("class", "")
-        label_start = normalize_string(l.get("cardinality_start", "")) if normalize else l.get("cardinality_start", "")
-        label_end = normalize_string(l.get("cardinality_end", "")) if normalize else l.get("cardinality_end", "")
-
-        for i, m in enumerate(model_rels):
-            if i in used:
-                continue
-
-            model_head = normalize_string(model_id_to_text.get(m.get("head"), "")) if normalize else model_id_to_text.get(m.get("head"), "")
-            model_tail = normalize_string(model_id_to_text.get(m.get("tail"), "")) if normalize else model_id_to_text.get(m.get("tail"), "")
-            model_label = normalize_string(m.get("label", "")) if normalize else m.get("label", "")
-            model_class = normalize_string(m.get("class", "")) if normalize else m.get("class", "")
-            model_start = normalize_string(m.get("cardinality_start", "")) if normalize else m.get("cardinality_start", "")
-            model_end = normalize_string(m.get("cardinality_end", "")) if normalize else m.get("cardinality_end", "")
-
-            head_match = label_head == model_head
-            tail_match = label_tail == model_tail
-            label_match = label_label == model_label
-            class_match = label_class == model_class
-            start_match = label_start == model_start
-            end_match = label_end == model_end
-
-            if has_cardinality:
-                if head_match and tail_match and label_match and class_match and start_match and end_match:
-                    matches += 1
-                    used.add(i)
-                    break
-            elif has_arrow_classes:
-                if head_match and tail_match and label_match and class_match:
-                    matches += 1
-                    used.add(i)
-                    break
-            else:
-                if head_match and tail_match and label_match:
-                    matches += 1
-                    used.add(i)
-                    break
-
-    return matches
\ No newline at end of file
+from collections import Counter
+
+from utils import normalize_string, make_hashable
+from diagram import compile_diagram
+
+
+def _multiset_key(values):
+    """Canonical, order-independent key for a list of hashable values (duplicates count)."""
+    return frozenset(Counter(make_hashable(v) for v in values).items())
+
+
+def count_multiset_matches(label_keys, model_keys):
+    """
+    Count one-to-one matches between two sequences of hashable keys.
+    Greedy first-exact-match pairing is a multiset intersection, so every key
+    contributes min(label count, model count) matches.
+    """
+    model_counts = Counter(model_keys)
+    if not model_counts:
+        return 0
+
+    matches = 0
+    for key, count in Counter(label_keys).items():
+        available = model_counts.get(key)
+        if available:
+            matches += min(count, available)
+
+    return matches
+
+
+# Key builders over CompiledDiagram. Each returns one hashable key per element;
+# `label` is the compiled label diagram, used where the label decides which fields count.
+# Builders of composite keys receive the keys of the metrics they require (see METRICS).
+
+def _or_empty(values):
+    return tuple(v or "" for v in values)
+
+
+def _node_text_keys(d, normalize, label):
+    return d.node_texts_norm if normalize else d.node_texts
+
+
+def _node_class_keys(d, normalize, label):
+    return d.node_classes_norm if normalize else d.node_classes
+
+
+def _node_text_class_keys(d, normalize, label):
+    if normalize:
+        return tuple(zip(d.node_texts_norm, d.node_classes_norm))
+    return tuple(zip(_or_empty(d.node_texts), _or_empty(d.node_classes)))
+
+
+def _node_attribute_keys(d, normalize, label):
+    return d.node_attributes_norm if normalize else d.node_attributes
+
+
+def _node_method_keys(d, normalize, label):
+    return d.node_methods_norm if normalize else d.node_methods
+
+
+def _node_attribute_method_keys(d, normalize, label, text_classes, attributes, methods):
+    return tuple(
+        text_class + (attribute_key, method_key)
+        for text_class, attribute_key, method_key in zip(text_classes, attributes, methods)
+    )
+
+
+def _arrow_label_keys(d, normalize, label):
+    return d.rel_labels_norm if normalize else d.rel_labels
+
+
+def _arrow_class_keys(d, normalize, label):
+    return d.rel_classes_norm if normalize else d.rel_classes
+
+
+def _arrow_cardinality_keys(d, normalize, label):
+    if normalize:
+        return tuple(zip(d.rel_cardinality_starts_norm, d.rel_cardinality_ends_norm))
+    return tuple(zip(d.rel_cardinality_starts, d.rel_cardinality_ends))
+
+
+def _arrow_path_keys(d, normalize, label):
+    # Resolved (head text, tail text) of every relation, shared by all path metrics.
+    return tuple(
+        (d.endpoint_text(head, normalize), d.endpoint_text(tail, normalize))
+        for head, tail in zip(d.rel_heads, d.rel_tails)
+    )
+
+
+def _arrow_path_label_keys(d, normalize, label, paths, rel_labels):
+    return tuple(path + (rel_label,) for path, rel_label in zip(paths, rel_labels))
+
+
+def _arrow_path_label_class_keys(d, normalize, label, path_labels, classes, cardinalities):
+    # The label decides whether relation classes and cardinalities take part in the match.
+    if label.has_cardinality_starts:
+        return tuple(pl + (cls,) + card for pl, cls, card in zip(path_labels, classes, cardinalities))
+    if label.has_rel_classes:
+        return tuple(pl + (cls,) for pl, cls in zip(path_labels, classes))
+    return path_labels
+
+
+def _group_name_keys(d, normalize, label):
+    return d.group_names_norm if normalize else d.group_names
+
+
+def _group_class_keys(d, normalize, label):
+    return d.group_classes_norm if normalize else d.group_classes
+
+
+def _group_text_keys(d, normalize, label):
+    return tuple(
+        _multiset_key(d.member_text(index, normalize) for index in members)
+        for members in d.group_members
+    )
+
+
+def _group_name_class_text_keys(d, normalize, label, names, classes, texts):
+    return tuple(zip(names, classes, texts))
+
+
+class Metric:
+    """
+    A matching metric: the function building its per-element keys, the metrics whose
+    keys it is built from, and the element kind whose label/model totals are its
+    recall/precision denominators.
+    """
+
+    __slots__ = ("keys", "requires", "elements")
+
+    def __init__(self, keys, elements, requires=()):
+        self.keys = keys
+        self.elements = elements
+        self.requires = requires
+
+
+METRICS = {
+    "node_texts": Metric(_node_text_keys, "nodes"),
+    "node_classes": Metric(_node_class_keys, "nodes"),
+    "node_text_and_class": Metric(_node_text_class_keys, "nodes"),
+    "arrow_labels": Metric(_arrow_label_keys, "relations"),
+    "arrow_classes": Metric(_arrow_class_keys, "relations"),
+    "group_names": Metric(_group_name_keys, "groups"),
+    "group_classes": Metric(_group_class_keys, "groups"),
+    "arrow_path": Metric(_arrow_path_keys, "relations"),
+    "arrow_path_and_label": Metric(_arrow_path_label_keys, "relations", ("arrow_path", "arrow_labels")),
+    "arrow_path_label_class": Metric(
+        _arrow_path_label_class_keys, "relations", ("arrow_path_and_label", "arrow_classes", "arrow_cardinalities")
+    ),
+    "group_texts": Metric(_group_text_keys, "groups"),
+    "group_name_class_texts": Metric(
+        _group_name_class_text_keys, "groups", ("group_names", "group_classes", "group_texts")
+    ),
+    "attribute_method_text_class": Metric(
+        _node_attribute_method_keys, "nodes", ("node_text_and_class", "node_attributes", "node_methods")
+    ),
+    "node_methods": Metric(_node_method_keys, "nodes"),
+    "node_attributes": Metric(_node_attribute_keys, "nodes"),
+    "arrow_cardinalities": Metric(_arrow_cardinality_keys, "relations"),
+}
+
+def dependent_metrics(names):
+    """The metrics in names and every metric whose keys are built from theirs, as a frozenset."""
+    found = set(names)
+    while True:
+        more = {name for name, metric in METRICS.items() if name not in found and found.intersection(metric.requires)}
+        if not more:
+            return frozenset(found)
+        found |= more
+
+# Names of the optional match types (fuzzy.py, spatial.py, graph.py), kept here so that
+# scoring without them does not import numpy/scipy.
+SIMILARITIES = ("ngram", "levenshtein")
+
+# Metrics of the spatial match type. node_boxes counts node pairs matched by IoU alone; the
+# others additionally require equal normalized fields, or the same endpoints (through the
+# node matching) for relations.
+SPATIAL_METRIC_ELEMENTS = {
+    "node_boxes": "nodes",
+    "node_texts": "nodes",
+    "node_classes": "nodes",
+    "node_text_and_class": "nodes",
+    "arrow_path": "relations",
+    "arrow_path_and_label": "relations",
+}
+
+GRAPH_METRICS = ("wl_subtree", "graph_edit")
+
+
+_ELEMENT_COUNTS = {"nodes": "node_count", "relations": "relation_count", "groups": "group_count"}
+
+
+class MetricKeys(dict):
+    """
+    Keys of one CompiledDiagram for every metric, built on first use.
+
+    A metric's keys are built once per diagram and normalize setting and reused by
+    every metric that requires them, e.g. the resolved edge endpoints of arrow_path
+    by all other path metrics.
+    """
+
+    def __init__(self, diagram, normalize, label):
+        super().__init__()
+        self.diagram = diagram
+        self.normalize = normalize
+        self.label = label
+
+    def __missing__(self, metric):
+        spec = METRICS[metric]
+        required = [self[name] for name in spec.requires]
+        keys = self[metric] = spec.keys(self.diagram, self.normalize, self.label, *required)
+        return keys
+
+
+def element_count(diagram, elements):
+    """Number of nodes, relations or groups of a CompiledDiagram."""
+    return getattr(diagram, _ELEMENT_COUNTS[elements])
+
+
+def count_metric_matches(label_keys, model_keys, metric):
+    """
+    Count matches for a metric from the MetricKeys of both diagrams. A metric over
+    elements one side does not have cannot match, so its keys are not built at all.
+    """
+    elements = METRICS[metric].elements
+    if not element_count(label_keys.diagram, elements) or not element_count(model_keys.diagram, elements):
+        return 0
+    return count_multiset_matches(label_keys[metric], model_keys[metric])
+
+
+def count_compiled_matches(label, model, metric, normalize=True):
+    """Count one-to-one matches for a metric between two CompiledDiagrams."""
+    return count_metric_matches(MetricKeys(label, normalize, label), MetricKeys(model, normalize, label), metric)
+
+
+def _field_key(item, field, normalize):
+    return normalize_string(item.get(field)) if normalize else make_hashable(item.get(field, ""))
+
+
+def _compile_dict(data):
+    # evaluate_output counts a null cardinality_start as "", as the original one did after
+    # filling in the field; the original count_* matchers compare the field as it is.
+    diagram = compile_diagram(data)
+    diagram.rel_cardinality_starts = tuple(
+        make_hashable(rel.get("cardinality_start", "")) for rel in data.get("relations") or []
+    )
+    return diagram
+
+
+def _count_dict_matches(metric, label_data, model_data, normalize):
+    return count_compiled_matches(_compile_dict(label_data), _compile_dict(model_data), metric, normalize)
+
+
+def count_field_matches(label_items, model_items, field, normalize=True):
+    """
+    Count exact matches (normalized) between label and model items for a given field.
+    """
+    return count_multiset_matches(
+        (_field_key(item, field, normalize) for item in label_items),
+        (_field_key(item, field, normalize) for item in model_items),
+    )
+
+
+def count_arrow_path_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=True):
+    """
+    Count matches for arrow paths (head and tail nodes) between label and model relations.
+    Matching is done by exact equality of normalized node texts.
+    """
+    return _count_dict_matches(
+        "arrow_path",
+        {"nodes": label_nodes, "relations": label_rels},
+        {"nodes": model_nodes, "relations": model_rels},
+        normalize,
+    )
+
+def match_node_text_sets(label_list, model_list):
+    """
+    Compare two lists of node texts to check if they contain the same values (unordered).
+    Each label text must match one distinct model text.
+    """
+    if len(label_list) != len(model_list):
+        return False
+
+    return _multiset_key(label_list) == _multiset_key(model_list)
+
+
+def count_group_node_matches(label_groups, model_groups, label_nodes, model_nodes, normalize=False):
+    """
+    Count how many label groups have a matching group in the model
+    with the same set of node texts (unordered exact match).
+    """
+    return _count_dict_matches(
+        "group_texts",
+        {"nodes": label_nodes, "groups": label_groups},
+        {"nodes": model_nodes, "groups": model_groups},
+        normalize,
+    )
+
+def match_node_text_class_sets(label_nodes, model_nodes, normalize=True):
+    """
+    Compare two sets of (text, class) node pairs for an exact normalized match.
+    """
+    label_keys = _node_text_class_keys(compile_diagram({"nodes": label_nodes}), normalize, None)
+    model_keys = _node_text_class_keys(compile_diagram({"nodes": model_nodes}), normalize, None)
+
+    return set(label_keys) == set(model_keys)
+
+
+def count_node_text_class_matches(label_nodes, model_nodes, normalize=True):
+    """
+    Count how many (text, class) pairs in label_nodes match with distinct pairs in model_nodes.
+    """
+    return _count_dict_matches("node_text_and_class", {"nodes": label_nodes}, {"nodes": model_nodes}, normalize)
+
+
+def count_arrow_path_and_label_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=True):
+    """
+    Count matches for arrow paths (head, tail) and relation labels
+    between label and model relations, using normalized exact matching.
+    """
+    return _count_dict_matches(
+        "arrow_path_and_label",
+        {"nodes": label_nodes, "relations": label_rels},
+        {"nodes": model_nodes, "relations": model_rels},
+        normalize,
+    )
+
+
+def count_full_group_matches(label_groups, model_groups, label_nodes, model_nodes, normalize=True):
+    """
+    Count label groups that match model groups exactly on name, class, and node texts (all normalized).
+    """
+    return _count_dict_matches(
+        "group_name_class_texts",
+        {"nodes": label_nodes, "groups": label_groups},
+        {"nodes": model_nodes, "groups": model_groups},
+        normalize,
+    )
+
+def count_node_attribute_matches(label_nodes, model_nodes, normalize=True):
+    """Count label nodes whose attribute lists exactly match a model node's, after normalization."""
+    return _count_dict_matches("node_attributes", {"nodes": label_nodes}, {"nodes": model_nodes}, normalize)
+
+
+def count_node_method_matches(label_nodes, model_nodes, normalize=True):
+    """Count label nodes whose method lists exactly match a model node's, after normalization."""
+    return _count_dict_matches("node_methods", {"nodes": label_nodes}, {"nodes": model_nodes}, normalize)
+
+
+def count_node_attribute_method_matches(label_nodes, model_nodes, normalize=True):
+    """
+    Count label nodes that match model nodes exactly on:
+    - text
+    - class
+    - attributes (list)
+    - methods (list)
+    All normalized before comparison.
+    """
+    return _count_dict_matches(
+        "attribute_method_text_class", {"nodes": label_nodes}, {"nodes": model_nodes}, normalize
+    )
+
+def count_cardinality_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=True):
+    """Count matches where only cardinality_start and cardinality_end match between label and model relations."""
+    return _count_dict_matches("arrow_cardinalities", {"relations": label_rels}, {"relations": model_rels}, normalize)
+
+def count_arrow_path_label_class_matches(label_rels, model_rels, label_nodes, model_nodes, normalize=True):
+    """
+    Count matches for arrow paths (head/tail), labels, and class values.
+    Includes cardinality fields if present.
+    """
+    return _count_dict_matches(
+        "arrow_path_label_class",
+        {"nodes": label_nodes, "relations": label_rels},
+        {"nodes": model_nodes, "relations": model_rels},
+        normalize,
+    )
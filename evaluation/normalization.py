@@ -0,0 +1,125 @@
+import re
+import sys
+import unicodedata
+from functools import lru_cache
+
+# Optional steps on top of the base normalization, in the order they are applied.
+NORMALIZATION_STEPS = ("nfkc", "hyphenation", "punctuation", "casefold")
+
+_NULL_VALUES = ("null", "none")
+_SEPARATORS = re.compile(r"[_\s]+")
+# A word broken over two lines with a hyphen, e.g. "Müügi-\nkampaaniate".
+_HYPHENATED_BREAK = re.compile(r"(?<=\w)-[^\S\n]*\n\s*(?=\w)")
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+class Normalizer:
+    """
+    A compiled text normalization pipeline.
+
+    The base pipeline maps None, "null" and "none" to "" and otherwise removes
+    surrounding whitespace, underscores and inner whitespace and lowercases; this is
+    what normalize_string has always done. Optional steps (NORMALIZATION_STEPS) add
+    Unicode NFKC, joining of hyphenated line breaks, removal of punctuation and
+    symbols, and full case folding instead of lower(). Numbers are normalized as their
+    text and other non-string values (e.g. lists) as "", so no value raises.
+
+    Results for strings are memoized in a bounded LRU cache shared by every diagram
+    normalized with this pipeline, so repeated class names are normalized once.
+    """
+
+    def __init__(self, steps=(), memo_size=2**16):
+        unknown = set(steps) - set(NORMALIZATION_STEPS)
+        if unknown:
+            raise ValueError(f"Unknown normalization steps {sorted(unknown)}; expected some of {NORMALIZATION_STEPS}.")
+        self.steps = tuple(step for step in NORMALIZATION_STEPS if step in steps)
+
+        transforms = []
+        if "nfkc" in self.steps:
+            transforms.append(lambda v: unicodedata.normalize("NFKC", v))
+        if "hyphenation" in self.steps:
+            transforms.append(lambda v: _HYPHENATED_BREAK.sub("", v))
+        if "punctuation" in self.steps:
+            transforms.append(lambda v: _PUNCTUATION.sub("", v))
+        fold = str.casefold if "casefold" in self.steps else str.lower
+
+        if transforms:
+            def pipeline(value):
+                for transform in transforms:
+                    value = transform(value)
+                return fold(_SEPARATORS.sub("", value.strip()))
+        else:
+            def pipeline(value):
+                return fold(_SEPARATORS.sub("", value.strip()))
+
+        def normalize_uncached(value):
+            if not isinstance(value, str):
+                # Numbers are normalized as their text; None and other values (e.g. lists) as "".
+                if not isinstance(value, (int, float)):
+                    return ""
+                value = str(value)
+            if value.lower() in _NULL_VALUES:
+                return ""
+            return pipeline(value)
+
+        self._normalize_uncached = normalize_uncached
+        self._normalize_cached = lru_cache(maxsize=memo_size)(lambda value: sys.intern(normalize_uncached(value)))
+
+    def normalize(self, value):
+        """Normalize one value; strings are memoized and interned."""
+        if isinstance(value, str):
+            return self._normalize_cached(value)
+        return self._normalize_uncached(value)
+
+    def normalize_many(self, values):
+        """Normalize a sequence of values, e.g. all node texts of a diagram; returns a tuple."""
+        return tuple(map(self.normalize, values))
+
+    def cache_info(self):
+        return self._normalize_cached.cache_info()
+
+
+_normalizers = {}
+
+
+def get_normalizer(steps=()):
+    """The shared Normalizer for a set of optional steps; each configuration is compiled once."""
+    key = frozenset(steps or ())
+    normalizer = _normalizers.get(key)
+    if normalizer is None:
+        normalizer = _normalizers[key] = Normalizer(key)
+    return normalizer
+
+
+def memo_stats():
+    """(hits, misses) of the memo caches of every Normalizer in this process."""
+    hits = misses = 0
+    for normalizer in _normalizers.values():
+        info = normalizer.cache_info()
+        hits += info.hits
+        misses += info.misses
+    return hits, misses
+
+
+def correction_key(dataset_name, image_key):
+    """Key of an image's entry in mapping_dictionary.json: "<dataset>__<image file name>"."""
+    return f"{dataset_name}__{image_key}"
+
+
+def text_corrections(mapping_dictionary, dataset_name, image_key):
+    """
+    The corrections of one image from mapping_dictionary.json, {lowercased predicted text: label text}.
+
+    image_key may also be a full "<dataset>__<image>" key, in which case dataset_name may be None.
+    """
+    if not mapping_dictionary or not image_key:
+        return {}
+    key = image_key if dataset_name is None else correction_key(dataset_name, image_key)
+    return mapping_dictionary.get(key) or {}
+
+
+def correct_text(text, corrections):
+    """Replace a predicted text by its correction, looked up by the lowercased text."""
+    if corrections and isinstance(text, str) and text:
+        return corrections.get(text.lower(), text)
+    return text
@@ -0,0 +1,380 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from urllib.parse import parse_qsl
+
+import corpus
+from aggregate import f1_from_counts
+from corpus import chunks, evaluate_chunk, label_files
+from data_loader import decode_json, prediction_key
+from instrumentation import logger
+
+MAX_BODY_BYTES = 64 * 2**20
+MAX_HEADERS = 100
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+_worker_state = {}
+
+
+def _init_service_worker(ready, *args):
+    corpus._init_pool_worker(*args)
+    corpus.preload_labels()
+    _worker_state["ready"] = ready
+
+
+def _wait_ready():
+    # Blocks until every worker of the pool is inside this call. A worker runs one call at
+    # a time, so one call per worker is needed, and each of them has run its initializer.
+    _worker_state["ready"].wait()
+
+
+def _metric_key(metric):
+    return "/".join(metric)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RunAggregate:
+    """
+    Running totals of one (dataset, run_id) over the images scored so far.
+
+    Scoring an image again replaces its earlier result, so resubmitted predictions
+    are not counted twice.
+    """
+
+    def __init__(self):
+        self.images = {}
+        self.totals = {}
+        self.statuses = {}
+
+    def add(self, image_key, counts, status):
+        previous = self.images.get(image_key)
+        if previous is not None:
+            self._apply(*previous, sign=-1)
+        self.images[image_key] = (counts, status)
+        self._apply(counts, status, sign=1)
+
+    def _apply(self, counts, status, sign):
+        self.statuses[status] = self.statuses.get(status, 0) + sign
+        for metric, values in counts.items():
+            total = self.totals.get(metric, (0, 0, 0))
+            self.totals[metric] = tuple(t + sign * v for t, v in zip(total, values))
+
+    def summary(self):
+        metrics = sorted(self.totals)
+        scores = f1_from_counts([self.totals[metric] for metric in metrics]).tolist() if metrics else []
+        return {
+            "images": len(self.images),
+            "statuses": {status: count for status, count in sorted(self.statuses.items()) if count},
+            "f1": {_metric_key(metric): round(score, 6) for metric, score in zip(metrics, scores)},
+        }
+
+
+class ScoringService:
+    """
+    Local HTTP service that scores predictions against preloaded labels.
+
+    The label sets of label_dirs ({dataset: split directory}) are compiled in every
+    worker process when the service starts, and mapping_dictionary is sent to the
+    workers once, so a request only pays for matching. The event loop parses requests
+    and streams results; matching runs in a process pool.
+
+    Endpoints:
+      POST /score     one {"image_key": "<dataset>__<image>", "run_id": ..., "output": ...}
+                      object, a JSON list of them, or one per line (NDJSON). Results are
+                      streamed back as NDJSON, one line per prediction, as they finish.
+      GET  /runs      running F1 and status counts per (dataset, run_id).
+      DELETE /runs    forget all runs (?run_id=... forgets one run).
+      GET  /health    datasets and label counts.
+    """
+
+    def __init__(
+        self,
+        label_dirs,
+        mapping_dictionary=None,
+        workers=None,
+        chunk_size=8,
+        cache_options=None,
+        evaluation_options=None,
+        packed=False,
+    ):
+        self.label_dirs = label_dirs
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.images = {dataset: set(label_files(labels_dir, packed)) for dataset, labels_dir in label_dirs.items()}
+        self.runs = {}
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_service_worker,
+            initargs=(
+                multiprocessing.Barrier(self.workers),
+                label_dirs,
+                mapping_dictionary,
+                cache_options,
+                evaluation_options,
+                packed,
+            ),
+        )
+        self._server = None
+        self._streaming = set()
+
+    async def start(self, host="127.0.0.1", port=8765, unix_socket=None):
+        # Wait until every worker has compiled its labels, so the first request is fast.
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _wait_ready) for _ in range(self.workers)))
+        if unix_socket:
+            self._server = await asyncio.start_unix_server(self._handle, path=unix_socket)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    @property
+    def addresses(self):
+        return [socket.getsockname() for socket in self._server.sockets] if self._server else []
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        # Waiting for the workers to exit must not block the event loop.
+        await asyncio.get_running_loop().run_in_executor(None, partial(self._executor.shutdown, cancel_futures=True))
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, query, headers = await self._read_head(reader)
+            body = await self._read_body(reader, headers) if method in ("POST", "PUT") else b""
+            await self._route(method, path, query, headers, body, writer)
+        except HTTPError as e:
+            await self._respond(writer, e.status, {"error": str(e)})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.exception("Scoring service request failed")
+            # Once a streamed response has started, its status line cannot change.
+            if writer not in self._streaming:
+                await self._respond(writer, 500, {"error": str(e)})
+        finally:
+            self._streaming.discard(writer)
+            writer.close()
+
+    async def _read_head(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        parts = request_line.split()
+        if len(parts) != 3:
+            raise HTTPError(400, "Malformed request line.")
+        method, target, _ = parts
+        headers = {}
+        for _ in range(MAX_HEADERS):
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise HTTPError(400, "Too many headers.")
+        path, _, query_string = target.partition("?")
+        query = dict(parse_qsl(query_string, keep_blank_values=True))
+        return method.upper(), path, query, headers
+
+    async def _read_body(self, reader, headers):
+        if "content-length" not in headers:
+            raise HTTPError(411, "Content-Length is required.")
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise HTTPError(400, "Content-Length must be an integer.") from None
+        if length < 0:
+            raise HTTPError(400, "Content-Length must not be negative.")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"Request bodies are limited to {MAX_BODY_BYTES} bytes.")
+        return await reader.readexactly(length)
+
+    async def _route(self, method, path, query, headers, body, writer):
+        if path == "/score":
+            if method != "POST":
+                raise HTTPError(405, "Use POST.")
+            await self._score(self._parse_predictions(body, headers), writer)
+        elif path == "/runs":
+            if method == "GET":
+                await self._respond(writer, 200, self.run_summaries())
+            elif method == "DELETE":
+                if "run_id" in query:
+                    self.runs = {key: run for key, run in self.runs.items() if str(key[1]) != query["run_id"]}
+                else:
+                    self.runs = {}
+                await self._respond(writer, 200, {"runs": len(self.runs)})
+            else:
+                raise HTTPError(405, "Use GET or DELETE.")
+        elif path == "/health":
+            await self._respond(
+                writer, 200, {"status": "ok", "workers": self.workers, "labels": {d: len(i) for d, i in self.images.items()}}
+            )
+        else:
+            raise HTTPError(404, f"No endpoint {path}.")
+
+    def _parse_predictions(self, body, headers):
+        if "ndjson" in headers.get("content-type", "") or "jsonlines" in headers.get("content-type", ""):
+            # A bad line is reported as an invalid result instead of failing the whole batch.
+            records = []
+            for line in body.splitlines():
+                if line.strip():
+                    try:
+                        records.append(decode_json(line))
+                    except ValueError:
+                        records.append(None)
+            return records
+        data = self._decode(body)
+        return data if isinstance(data, list) else [data]
+
+    @staticmethod
+    def _decode(data):
+        try:
+            return decode_json(data)
+        except ValueError as e:
+            raise HTTPError(400, f"Invalid JSON: {e}") from e
+
+    def run_summaries(self):
+        return [
+            dict(dataset=dataset, run_id=run_id, **run.summary())
+            for (dataset, run_id), run in sorted(self.runs.items(), key=lambda item: (item[0][0], str(item[0][1])))
+        ]
+
+    async def _score(self, records, writer):
+        self._streaming.add(writer)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+            b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n"
+        )
+        connected = True
+
+        async def emit(payload):
+            # A client that went away stops the output, not the scoring of its batch.
+            nonlocal connected
+            if connected:
+                try:
+                    await self._write_chunk(writer, payload)
+                except ConnectionError:
+                    connected = False
+
+        items = []
+        for record in records:
+            if not isinstance(record, dict) or not isinstance(record.get("image_key"), str) or "output" not in record:
+                await emit({"error": "Expected an object with image_key and output.", "status": "invalid"})
+                continue
+            dataset, _, image = record["image_key"].partition("__")
+            image = prediction_key(image)
+            if image not in self.images.get(dataset, ()):
+                await emit({"image_key": record["image_key"], "run_id": record.get("run_id"), "status": "unmatched"})
+                continue
+            items.append((dataset, record.get("run_id"), image, record["output"]))
+
+        loop = asyncio.get_running_loop()
+        pending = {}
+        work = chunks(items, self.chunk_size)
+        try:
+            while True:
+                while len(pending) < 2 * self.workers:
+                    chunk = next(work, None)
+                    if chunk is None:
+                        break
+                    pending[loop.run_in_executor(self._executor, evaluate_chunk, chunk)] = chunk
+                if not pending:
+                    break
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    chunk = pending.pop(future)
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        logger.exception("Scoring a chunk of %d predictions failed", len(chunk))
+                        for dataset, run_id, image, _ in chunk:
+                            await emit(
+                                {
+                                    "image_key": f"{dataset}__{image}",
+                                    "run_id": run_id,
+                                    "status": "error",
+                                    "error": str(e),
+                                }
+                            )
+                        continue
+                    for key, image_key, counts, status, cached, _, _ in results:
+                        await emit(self._add_result(key, image_key, counts, status, cached))
+        finally:
+            for future in pending:
+                future.cancel()
+            if connected:
+                try:
+                    writer.write(b"0\r\n\r\n")
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+
+    def _add_result(self, key, image_key, counts, status, cached):
+        run = self.runs.get(key)
+        if run is None:
+            run = self.runs[key] = RunAggregate()
+        run.add(image_key, counts, status)
+        metrics = sorted(counts)
+        scores = f1_from_counts([counts[metric] for metric in metrics]).tolist() if metrics else []
+        dataset, run_id = key
+        return {
+            "image_key": f"{dataset}__{image_key}",
+            "run_id": run_id,
+            "status": status,
+            "cached": cached,
+            "f1": {_metric_key(metric): round(score, 6) for metric, score in zip(metrics, scores)},
+            "counts": {_metric_key(metric): list(counts[metric]) for metric in metrics},
+        }
+
+    @staticmethod
+    async def _write_chunk(writer, payload):
+        data = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        writer.write(b"%x\r\n" % len(data) + data + b"\r\n")
+        await writer.drain()
+
+    @staticmethod
+    async def _respond(writer, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n"
+        )
+        try:
+            writer.write(head.encode("latin-1") + data)
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+async def serve(service, host="127.0.0.1", port=8765, unix_socket=None):
+    """Run service until SIGINT or SIGTERM."""
+    await service.start(host, port, unix_socket)
+    logger.info("Scoring service listening on %s", unix_socket or f"http://{host}:{service.addresses[0][1]}")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await service.close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.unlink(unix_socket)
@@ -0,0 +1,186 @@
+"""
+Splitting a scoring job over machines and merging the partial results.
+
+A shard manifest assigns every image of the scored datasets to one of N shards by a
+hash of its image key, so the split does not depend on file order or on the machine,
+and lists the report categories of each dataset (from all of its labels). Each shard
+is scored on its own into a ShardAggregate: summed (tp, label, pred) counts per run
+and metric, plus the set of shards it covers. Merging adds the counts of aggregates
+over disjoint shard sets; integer sums are associative and commutative, so any
+grouping of merges of all shards gives the same F1 scores as a single-node run, and
+a failed shard can be re-scored and merged on its own.
+"""
+import hashlib
+import json
+import os
+
+from cache import canonical_json, evaluator_version
+from corpus import f1_rows, f1_scores, report_categories
+from label_store import open_label_store
+
+MANIFEST_VERSION = 1
+
+
+def shard_of(image_key, shard_count):
+    """Shard index of an image key: the first 8 bytes of its sha256, modulo shard_count."""
+    digest = hashlib.sha256(image_key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+def build_manifest(label_dirs, shard_count, packed=False):
+    """
+    Shard manifest of {dataset: labels_dir}: {"version", "shards", "datasets": {dataset:
+    {"categories", "images": [[image keys of shard 0], ...]}}, "id"}. id is a hash of
+    the rest, so aggregates of different manifests are never merged.
+    """
+    if shard_count < 1:
+        raise ValueError("A manifest needs at least one shard.")
+    datasets = {}
+    for dataset, labels_dir in sorted(label_dirs.items()):
+        store = open_label_store(labels_dir, packed)
+        try:
+            keys = store.keys()
+            categories = report_categories([store.load(key) for key in keys])
+        finally:
+            store.close()
+        images = [[] for _ in range(shard_count)]
+        for key in keys:
+            images[shard_of(key, shard_count)].append(key)
+        datasets[dataset] = {"categories": categories, "images": images}
+    manifest = {"version": MANIFEST_VERSION, "shards": shard_count, "datasets": datasets}
+    manifest["id"] = hashlib.sha256(canonical_json(manifest)).hexdigest()[:16]
+    return manifest
+
+
+def write_manifest(path, manifest):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+
+def load_manifest(path):
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"{path} has manifest version {manifest.get('version')}, expected {MANIFEST_VERSION}.")
+    return manifest
+
+
+def shard_images(manifest, dataset, shard):
+    """Image keys of one dataset in one shard."""
+    if not 0 <= shard < manifest["shards"]:
+        raise ValueError(f"Shard {shard} is out of range; the manifest has {manifest['shards']} shards.")
+    return manifest["datasets"][dataset]["images"][shard]
+
+
+def configuration_digest(evaluation_options=None, mapping_dictionary=None):
+    """Hash of everything besides the inputs that determines the counts, so shards scored differently are not merged."""
+    digest = hashlib.sha256()
+    for part in (evaluator_version(), evaluation_options or {}, mapping_dictionary or {}):
+        digest.update(canonical_json(part))
+    return digest.hexdigest()[:16]
+
+
+COUNTERS = ("images", "missing", "malformed", "truncated")
+
+
+def _add_run(runs, run_id, run):
+    # Add one run's counters and counts into runs[run_id].
+    target = runs.setdefault(run_id, {"method": run["method"], "counts": {}, **dict.fromkeys(COUNTERS, 0)})
+    for counter in COUNTERS:
+        target[counter] += run[counter]
+    for metric, total in run["counts"].items():
+        counts = target["counts"].setdefault(metric, [0, 0, 0])
+        for i, value in enumerate(total):
+            counts[i] += value
+
+
+class ShardAggregate:
+    """
+    Summed counts of the runs of one dataset over a set of shards.
+
+    runs maps run_id (None for a single unnamed run) to {"method", "images", "missing",
+    "malformed", "truncated", "counts": {(match_type, category): [tp, label, pred]}}.
+    """
+
+    def __init__(self, manifest_id, dataset, configuration, shards, runs=None):
+        self.manifest_id = manifest_id
+        self.dataset = dataset
+        self.configuration = configuration
+        self.shards = frozenset(shards)
+        self.runs = runs if runs is not None else {}
+
+    def add_result(self, run_id, method, result):
+        """Add a corpus.CorpusResult of this aggregate's shards."""
+        run = {counter: getattr(result, counter) for counter in COUNTERS}
+        _add_run(self.runs, run_id, {"method": method, "counts": result.totals, **run})
+
+    def merge(self, other):
+        """
+        A new aggregate with the counts of both. They must come from the same manifest,
+        dataset and configuration and cover disjoint shards.
+        """
+        for field in ("manifest_id", "dataset", "configuration"):
+            if getattr(self, field) != getattr(other, field):
+                raise ValueError(f"Cannot merge aggregates with different {field}s.")
+        overlap = self.shards & other.shards
+        if overlap:
+            raise ValueError(f"Shards {sorted(overlap)} would be counted twice.")
+
+        merged = ShardAggregate(self.manifest_id, self.dataset, self.configuration, self.shards | other.shards)
+        for source in (self, other):
+            for run_id, run in source.runs.items():
+                _add_run(merged.runs, run_id, run)
+        return merged
+
+    def f1_rows(self, categories):
+        """Rows of <dataset>_f1_scores.csv, runs in the order of a single-node score run."""
+        rows = []
+        for run_id in sorted(self.runs, key=lambda run_id: run_id or ""):
+            run = self.runs[run_id]
+            rows.extend(f1_rows(run["method"], f1_scores(run["counts"]), categories))
+        return rows
+
+    def to_json(self):
+        return {
+            "manifest": self.manifest_id,
+            "dataset": self.dataset,
+            "configuration": self.configuration,
+            "shards": sorted(self.shards),
+            "runs": [
+                {
+                    "run_id": run_id,
+                    **{key: value for key, value in run.items() if key != "counts"},
+                    "counts": {"/".join(metric): total for metric, total in sorted(run["counts"].items())},
+                }
+                for run_id, run in sorted(self.runs.items(), key=lambda item: item[0] or "")
+            ],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        runs = {}
+        for run in data["runs"]:
+            run = dict(run)
+            run_id = run.pop("run_id")
+            run["counts"] = {tuple(metric.split("/", 1)): total for metric, total in run["counts"].items()}
+            runs[run_id] = run
+        return cls(data["manifest"], data["dataset"], data["configuration"], data["shards"], runs)
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_json(json.load(f))
+
+
+def aggregate_path(output_dir, dataset, shard, shard_count):
+    return os.path.join(output_dir, f"{dataset}_shard{shard:03d}of{shard_count:03d}.json")
@@ -0,0 +1,177 @@
+import numpy as np
+
+from fuzzy import ngram_sets
+from matching import count_multiset_matches
+
+# Endpoint of a predicted relation whose node has no IoU match; never equal to a label endpoint.
+_UNMATCHED = -2
+
+
+def box_array(bboxes):
+    """
+    (n, 4) float array of x0, y0, x1, y1 from [x, y, width, height] boxes, as in the
+    labels' "bbox" fields. Missing, malformed or empty boxes become NaN rows, which
+    never match.
+    """
+    boxes = np.full((len(bboxes), 4), np.nan)
+    for i, bbox in enumerate(bboxes):
+        if (
+            isinstance(bbox, (list, tuple))
+            and len(bbox) == 4
+            and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in bbox)
+            and bbox[2] > 0
+            and bbox[3] > 0
+        ):
+            boxes[i] = bbox
+    boxes[:, 2:] += boxes[:, :2]
+    return boxes
+
+
+def pair_iou(a, b):
+    """Intersection over union of the box pairs a[i], b[i] (two (n, 4) x0/y0/x1/y1 arrays)."""
+    width = np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None)
+    height = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    intersection = width * height
+    union = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]) + (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]) - intersection
+    return intersection / union
+
+
+def _expand(counts):
+    # For runs of the given lengths: the run of every position and its offset within the run.
+    runs = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    return runs, offsets
+
+
+class GridIndex:
+    """
+    Uniform grid over a set of boxes. Each box is registered in every cell it touches,
+    so boxes that overlap share at least one cell. The default cell size is the median
+    box side, which keeps the number of cells per box and boxes per cell small.
+
+    Cells are stored as one sorted array of cell keys; queries find their cells with
+    searchsorted, so building and querying are vectorized.
+    """
+
+    def __init__(self, boxes, cell_size=None):
+        self.size = len(boxes)
+        valid = np.flatnonzero(~np.isnan(boxes).any(axis=1))
+        sides = boxes[valid, 2:] - boxes[valid, :2]
+        if cell_size is None:
+            cell_size = float(np.median(sides.max(axis=1))) if len(valid) else 1.0
+        self.cell_size = max(cell_size, 1e-9)
+        self.keys = self.rows = np.array([], dtype=np.int64)
+        if not len(valid):
+            return
+        cells = np.floor(boxes[valid] / self.cell_size).astype(np.int64)
+        self.lower, self.upper = cells[:, :2].min(axis=0), cells[:, 2:].max(axis=0)
+        rows, keys = self._cells(valid, cells)
+        order = np.argsort(keys, kind="stable")
+        self.keys, self.rows = keys[order], rows[order]
+
+    def _cells(self, rows, cells):
+        # (row, cell key) for every cell touched by each box.
+        widths, heights = cells[:, 2] - cells[:, 0] + 1, cells[:, 3] - cells[:, 1] + 1
+        box, offset = _expand(widths * heights)
+        x = cells[box, 0] + offset // heights[box]
+        y = cells[box, 1] + offset % heights[box]
+        return rows[box], (x - self.lower[0]) * (self.upper[1] - self.lower[1] + 1) + (y - self.lower[1])
+
+    def candidate_pairs(self, boxes):
+        """(query rows, indexed rows) of every query box / indexed box pair sharing a cell, each pair once."""
+        if not len(self.keys):
+            return np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+        valid = np.flatnonzero(~np.isnan(boxes).any(axis=1))
+        cells = np.floor(boxes[valid] / self.cell_size).astype(np.int64)
+        # Cells outside the indexed area hold no boxes.
+        cells[:, :2] = np.maximum(cells[:, :2], self.lower)
+        cells[:, 2:] = np.minimum(cells[:, 2:], self.upper)
+        inside = (cells[:, :2] <= cells[:, 2:]).all(axis=1)
+        rows, keys = self._cells(valid[inside], cells[inside])
+
+        start, end = np.searchsorted(self.keys, keys, "left"), np.searchsorted(self.keys, keys, "right")
+        entry, offset = _expand(end - start)
+        pairs = np.unique(rows[entry].astype(np.int64) * self.size + self.rows[start[entry] + offset])
+        return (pairs // self.size).astype(np.intp), (pairs % self.size).astype(np.intp)
+
+
+def _pair_text_similarity(label_texts, model_texts, label_rows, model_rows, n=3):
+    # Character n-gram Dice similarity (as in fuzzy mode), only for the candidate pairs.
+    label_sets, model_sets = ngram_sets(label_texts, n), ngram_sets(model_texts, n)
+    return np.array(
+        [
+            2 * len(label_sets[i] & model_sets[j]) / (len(label_sets[i]) + len(model_sets[j]))
+            for i, j in zip(label_rows.tolist(), model_rows.tolist())
+        ],
+        dtype=np.float64,
+    )
+
+
+def match_boxes(label_boxes, model_boxes, threshold=0.5, label_texts=None, model_texts=None, text_weight=0.0):
+    """
+    One-to-one matching of model boxes to label boxes; returns {model row: label row}.
+
+    Only pairs with IoU >= threshold are admissible; candidates come from a GridIndex
+    of the label boxes instead of all pairs. Pairs are taken greedily by score, which is
+    the IoU, or (1 - text_weight) * IoU + text_weight * text similarity when texts are
+    given, so a box overlapping two labels prefers the one with the matching text.
+    """
+    model_rows, label_rows = GridIndex(label_boxes).candidate_pairs(model_boxes)
+    if not len(model_rows):
+        return {}
+    scores = pair_iou(model_boxes[model_rows], label_boxes[label_rows])
+    admissible = scores >= threshold
+    model_rows, label_rows, scores = model_rows[admissible], label_rows[admissible], scores[admissible]
+    if text_weight and label_texts is not None and model_texts is not None and len(scores):
+        similarity = _pair_text_similarity(label_texts, model_texts, label_rows, model_rows)
+        scores = (1 - text_weight) * scores + text_weight * similarity
+
+    matches = {}
+    used = set()
+    for k in np.lexsort((label_rows, model_rows, -scores)).tolist():
+        model_row, label_row = int(model_rows[k]), int(label_rows[k])
+        if model_row not in matches and label_row not in used:
+            matches[model_row] = label_row
+            used.add(label_row)
+    return matches
+
+
+def spatial_matches(label, model, threshold=0.5, text_weight=0.0):
+    """
+    Match counts of the spatial match type between two CompiledDiagrams.
+
+    Nodes are matched by their bboxes (see match_boxes); a relation matches when its
+    tail and head are matched to the tail and head of a label relation.
+    """
+    node_matches = match_boxes(
+        box_array(label.node_bboxes),
+        box_array(model.node_bboxes),
+        threshold,
+        label.node_texts_norm,
+        model.node_texts_norm,
+        text_weight,
+    )
+    pairs = list(node_matches.items())
+    same_text = sum(label.node_texts_norm[j] == model.node_texts_norm[i] for i, j in pairs)
+    same_class = sum(label.node_classes_norm[j] == model.node_classes_norm[i] for i, j in pairs)
+    same_both = sum(
+        label.node_texts_norm[j] == model.node_texts_norm[i] and label.node_classes_norm[j] == model.node_classes_norm[i]
+        for i, j in pairs
+    )
+
+    def endpoint(index):
+        return index if index < 0 else node_matches.get(index, _UNMATCHED)
+
+    label_paths = tuple(zip(label.rel_tails, label.rel_heads))
+    model_paths = tuple((endpoint(tail), endpoint(head)) for tail, head in zip(model.rel_tails, model.rel_heads))
+    return {
+        "node_boxes": len(pairs),
+        "node_texts": same_text,
+        "node_classes": same_class,
+        "node_text_and_class": same_both,
+        "arrow_path": count_multiset_matches(label_paths, model_paths),
+        "arrow_path_and_label": count_multiset_matches(
+            tuple(path + (rel_label,) for path, rel_label in zip(label_paths, label.rel_labels_norm)),
+            tuple(path + (rel_label,) for path, rel_label in zip(model_paths, model.rel_labels_norm)),
+        ),
+    }
@@ -0,0 +1,293 @@
+"""
+Scoring of model output while it is being generated.
+
+StreamingParser consumes a generation in arbitrary text chunks and emits every node,
+relation and group of the prompts/base.txt schema as soon as its object closes.
+Text before the first "{" (prose, a ```json fence) and after the root object closes
+is ignored, and an element cut off by truncation is dropped.
+
+IncrementalEvaluator feeds those elements into running match counts against a
+compiled label. Every metric is a multiset intersection, so adding one model key
+raises the match count by one exactly when the model has fewer copies of that key
+than the label so far. Relations and groups refer to nodes by id; they are held back
+until the nodes section has closed (or the stream ends), so they resolve against the
+same node table as evaluate_output would use.
+"""
+import json
+import re
+from collections import Counter
+
+from diagram import CompiledDiagram, compile_diagram
+from evaluation import EXACT_METRICS, NORMALIZED_METRICS, select_metrics
+from matching import METRICS, MetricKeys
+from normalization import get_normalizer, text_corrections
+from utils import make_hashable
+
+SECTIONS = ("nodes", "relations", "groups")
+
+_STRUCTURAL = re.compile(r'[{}\[\]":]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+class StreamingParser:
+    """
+    Incremental scanner for one JSON diagram object.
+
+    feed(chunk) returns the events completed by the chunk: (section, element dict) for
+    every closed element of a nodes/relations/groups array, and (section, None) when
+    that array closes. Only the text of the element being read is buffered.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.done = False
+        self.skipped = 0
+        self.sections = {}
+        self._buffer = ""
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._string_start = None
+        self._last_string = None
+        self._key = None
+        self._section = None
+        self._element_start = None
+
+    def feed(self, chunk):
+        if self.done:
+            return []
+        self._buffer += chunk
+        events = []
+        buffer, pos, stack = self._buffer, self._pos, self._stack
+        while not self.done:
+            if not self.started:
+                pos = buffer.find("{", pos)
+                if pos < 0:
+                    pos = len(buffer)
+                    break
+                self.started = True
+                stack.append("{")
+                pos += 1
+                continue
+
+            if self._in_string:
+                match = _STRING_SPECIAL.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                if match.group() == "\\":
+                    if match.end() >= len(buffer):
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self._in_string = False
+                pos = match.end()
+                if len(stack) == 1:
+                    self._last_string = buffer[self._string_start:pos]
+                self._string_start = None
+                continue
+
+            match = _STRUCTURAL.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            char, pos = match.group(), match.end()
+            if char == '"':
+                self._in_string = True
+                self._string_start = match.start()
+            elif char == ":":
+                if len(stack) == 1 and self._last_string is not None:
+                    self._key = json.loads(self._last_string)
+            elif char in "{[":
+                if char == "{" and len(stack) == 2 and self._section is not None:
+                    self._element_start = match.start()
+                elif char == "[" and len(stack) == 1:
+                    self._section = self._key if self._key in SECTIONS else None
+                stack.append(char)
+            else:
+                if stack:
+                    stack.pop()
+                if not stack:
+                    self.done = True
+                elif len(stack) == 2 and char == "}" and self._element_start is not None:
+                    element = self._decode(buffer[self._element_start:pos])
+                    if element is not None:
+                        events.append((self._section, element))
+                    self._element_start = None
+                elif len(stack) == 1 and char == "]" and self._section is not None:
+                    events.append((self._section, None))
+                    self.sections.setdefault(self._section, [])
+                    self._section = None
+
+        # Keep only the text a pending token still needs.
+        keep = pos
+        for start in (self._element_start, self._string_start):
+            if start is not None:
+                keep = min(keep, start)
+        self._buffer = buffer[keep:]
+        self._pos = pos - keep
+        if self._element_start is not None:
+            self._element_start -= keep
+        if self._string_start is not None:
+            self._string_start -= keep
+        return events
+
+    def _decode(self, text):
+        # Elements that are not valid JSON objects are counted and skipped.
+        try:
+            element = json.loads(text)
+        except ValueError:
+            element = None
+        if not isinstance(element, dict):
+            self.skipped += 1
+            return None
+        self.sections.setdefault(self._section, []).append(element)
+        return element
+
+    def result(self):
+        """The diagram recovered so far, {section: elements} for every section seen; None before the root object opens."""
+        return dict(self.sections) if self.started else None
+
+
+def recover_model_output(raw):
+    """Best-effort diagram dict from a truncated or garbled generation (None if no object starts)."""
+    parser = StreamingParser()
+    parser.feed(raw)
+    return parser.result()
+
+
+class IncrementalEvaluator:
+    """
+    Running evaluate_output counts of one streamed model output against its label.
+
+    feed(chunk) parses a chunk and updates the counts; result() returns the counts so
+    far in evaluate_output's format, and finish() ends the stream and returns the final
+    result. For a complete generation the final result equals evaluate_output on the
+    parsed output. Fuzzy matching needs the whole output and is not available here.
+    """
+
+    def __init__(
+        self,
+        label_data,
+        dataset_name=None,
+        image_key=None,
+        mapping_dictionary=None,
+        normalization=None,
+        metrics=None,
+    ):
+        self._normalizer = get_normalizer(normalization)
+        if isinstance(label_data, CompiledDiagram):
+            self.label = label_data
+        else:
+            self.label = compile_diagram(label_data, normalizer=self._normalizer)
+        self._corrections = text_corrections(mapping_dictionary, dataset_name, image_key) if dataset_name else None
+        self.parser = StreamingParser()
+
+        selected = None if metrics is None else select_metrics(metrics)
+        self._match_types = {}
+        match_types = (("exact_matches", False, EXACT_METRICS), ("normalized_matches", True, NORMALIZED_METRICS))
+        for section, normalize, names in match_types:
+            self._match_types[section] = (normalize, [m for m in names if selected is None or m in selected])
+
+        self._label_keys = {}
+        self._model_keys = {}
+        self.matches = {}
+        for section, (normalize, names) in self._match_types.items():
+            label_keys = MetricKeys(self.label, normalize, self.label)
+            self.matches[section] = dict.fromkeys(names, 0)
+            for metric in names:
+                self._label_keys[(normalize, metric)] = Counter(label_keys[metric])
+                self._model_keys[(normalize, metric)] = Counter()
+
+        self.model = dict.fromkeys(("nodes", "relations", "groups", "attributes", "methods", "cardinalities"), 0)
+        self._nodes = {}
+        self._nodes_closed = False
+        self._deferred = []
+
+    def feed(self, chunk):
+        """Parse a chunk of the generation; returns the elements it completed as (section, element)."""
+        events = self.parser.feed(chunk)
+        for section, element in events:
+            if element is None:
+                if section == "nodes":
+                    self._flush()
+            elif section == "nodes" or self._nodes_closed:
+                self._add(section, element)
+            else:
+                self._deferred.append((section, element))
+        return [(section, element) for section, element in events if element is not None]
+
+    def _flush(self):
+        self._nodes_closed = True
+        for section, element in self._deferred:
+            self._add(section, element)
+        self._deferred = []
+
+    def _add(self, section, element):
+        if section == "nodes":
+            self._nodes[make_hashable(element.get("id"))] = element
+            data = {"nodes": [element]}
+        elif section == "relations":
+            endpoints = (element.get("tail"), element.get("head"))
+            data = {"nodes": self._known_nodes(endpoints), "relations": [element]}
+        else:
+            data = {"nodes": self._known_nodes(element.get("nodes") or []), "groups": [element]}
+        diagram = compile_diagram(data, text_corrections=self._corrections, normalizer=self._normalizer)
+
+        self.model[section] += 1
+        if section == "nodes":
+            self.model["attributes"] += diagram.attribute_count
+            self.model["methods"] += diagram.method_count
+        elif section == "relations":
+            self.model["cardinalities"] += 1
+
+        for match_section, (normalize, names) in self._match_types.items():
+            keys = MetricKeys(diagram, normalize, self.label)
+            matches = self.matches[match_section]
+            for metric in names:
+                if METRICS[metric].elements != section:
+                    continue
+                [key] = keys[metric]
+                model_counts = self._model_keys[(normalize, metric)]
+                if model_counts[key] < self._label_keys[(normalize, metric)][key]:
+                    matches[metric] += 1
+                model_counts[key] += 1
+
+    def _known_nodes(self, node_ids):
+        nodes = []
+        for node_id in node_ids:
+            node = self._nodes.get(make_hashable(node_id))
+            if node is not None:
+                nodes.append(node)
+        return nodes
+
+    def result(self):
+        """Counts over the elements scored so far, in evaluate_output's format."""
+        label = self.label
+        return {
+            "label": {
+                "nodes": label.node_count,
+                "relations": label.relation_count,
+                "groups": label.group_count,
+                "attributes": label.attribute_count,
+                "methods": label.method_count,
+                "cardinalities": label.relation_count,
+            },
+            "model": dict(self.model),
+            "exact_matches": dict(self.matches["exact_matches"]),
+            "normalized_matches": dict(self.matches["normalized_matches"]),
+        }
+
+    def finish(self):
+        """End the stream: score held-back relations and groups and return the final result."""
+        self._flush()
+        return self.result()
+
+
+def evaluate_stream(label_data, chunks, **options):
+    """Score an iterable of generation chunks against a label; returns the final evaluate_output-style result."""
+    evaluator = IncrementalEvaluator(label_data, **options)
+    for chunk in chunks:
+        evaluator.feed(chunk)
+    return evaluator.finish()
@@ -1,21 +1,25 @@
-import re
-
-def simplify_filename(filename: str) -> str:
-    if "__" in filename:
-        return filename.split("__", 1)[1]
-    return filename
-
-def normalize_string(value: str, filename: str = None, mapping_dict: dict = None) -> str:
-    """Normalize string by removing underscores, dots, whitespace, lowering case.
-    Optionally apply mapping_dict if given."""
-    if value is None or value.lower() in ("null", "none"):
-        return ""
-
-    if mapping_dict and filename:
-        filename = simplify_filename(filename)
-        file_map = mapping_dict.get(filename, {})
-        if value in file_map:
-            mapped_value = file_map[value]
-            return re.sub(r"[_\s]+", "", mapped_value.strip()).lower()
-
-    return re.sub(r"[_\s]+", "", value.strip()).lower()
+from normalization import correct_text, get_normalizer, text_corrections
+
+_default_normalizer = get_normalizer()
+
+def simplify_filename(filename: str) -> str:
+    if "__" in filename:
+        return filename.split("__", 1)[1]
+    return filename
+
+def normalize_string(value: str, filename: str = None, mapping_dict: dict = None) -> str:
+    """Normalize string by removing underscores, whitespace, lowering case.
+    Optionally correct it first with the mapping_dict entry of filename ("<dataset>__<image>"),
+    the same lookup evaluate_output uses."""
+    if mapping_dict and filename:
+        value = correct_text(value, text_corrections(mapping_dict, None, filename))
+    return _default_normalizer.normalize(value)
+
+def make_hashable(value):
+    """Return a hashable stand-in for a raw JSON value that preserves equality.
+    Lists and dicts only show up in malformed model output, but must still compare like before."""
+    if isinstance(value, list):
+        return ("__list__", tuple(make_hashable(v) for v in value))
+    if isinstance(value, dict):
+        return ("__dict__", frozenset((k, make_hashable(v)) for k, v in value.items()))
+    return value